@@ -0,0 +1,167 @@
+import array
+import bisect
+import csv
+import datetime
+import itertools
+from models import JsonStore, ValidationError, occurrences, to_ordinal, add_months
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PERIODS = ("week", "month")
+
+class BookingColumns:
+    """Booking occurrences inside a date window as parallel columns of day ordinals and integer name codes.
+
+    The columns are typed arrays, so they can be handed to NumPy without copying."""
+    def __init__(self, start_date, end_date):
+        """Initializes empty columns for occurrences clipped to [start_date, end_date]."""
+        self.start = to_ordinal(start_date)
+        self.end = to_ordinal(end_date)
+        if self.end < self.start:
+            raise ValidationError("End date cannot be before start date.")
+        self.resource_codes = {}
+        self.owner_codes = {}
+        self.ordinals = {}
+        self.starts = array.array("l")
+        self.ends = array.array("l")
+        self.resources = array.array("l")
+        self.owners = array.array("l")
+
+    def __len__(self):
+        """Returns the number of occurrences held."""
+        return len(self.starts)
+
+    def ordinal(self, date):
+        """Returns the day ordinal of an ISO date string, parsing each distinct string only once."""
+        ordinal = self.ordinals.get(date)
+        if ordinal is None:
+            ordinal = self.ordinals[date] = to_ordinal(date)
+        return ordinal
+
+    def extend(self, bookings):
+        """Appends every occurrence of each booking that overlaps the window, clipped to it."""
+        #This runs once per booking, so everything it touches is looked up once up front
+        start, end, ordinal = self.start, self.end, self.ordinal
+        resource_codes, owner_codes = self.resource_codes, self.owner_codes
+        add_start, add_end, add_resource, add_owner = self.starts.append, self.ends.append, self.resources.append, self.owners.append
+        for booking in bookings:
+            if booking.get("repeat"):
+                spans = occurrences(booking, start, end)
+            else:
+                first, last = ordinal(booking["start_date"]), ordinal(booking["end_date"])
+                if last < start or first > end:
+                    continue
+                spans = ((first, last),)
+            resource = resource_codes.setdefault(booking["resource"], len(resource_codes))
+            owner = owner_codes.setdefault(booking["owner"], len(owner_codes))
+            for first, last in spans:
+                add_start(first if first > start else start)
+                add_end(last if last < end else end)
+                add_resource(resource)
+                add_owner(owner)
+
+    @classmethod
+    def from_bookings(cls, bookings, start_date, end_date):
+        """Builds the columns from the archived, unloaded and loaded bookings of a Bookings model."""
+        columns = cls(start_date, end_date)
+        #Collecting by key drops a booking left both archived and live by a crash during archiving
+        columns.extend(dict(bookings.bookings_between(start_date, end_date)).values())
+        return columns
+
+def period_edges(start, end, period="month"):
+    """Returns (labels, edges) for the weeks (from Monday) or calendar months covering ordinals [start, end].
+
+    edges holds the first day of each period clipped to the window, followed by end + 1."""
+    if period not in PERIODS:
+        raise ValidationError(f"Unknown period {period!r}; use one of {', '.join(PERIODS)}.")
+    if period == "week":
+        firsts = list(range(start - datetime.date.fromordinal(start).weekday(), end + 1, 7))
+    else:
+        firsts = [datetime.date.fromordinal(start).replace(day=1).toordinal()]
+        while add_months(firsts[-1], 1) <= end:
+            firsts.append(add_months(firsts[-1], 1))
+    labels = [datetime.date.fromordinal(first).isoformat()[:7 if period == "month" else 10] for first in firsts]
+    return labels, [max(first, start) for first in firsts] + [end + 1]
+
+def booked_days(starts, ends, codes, edges):
+    """Returns {(code, period index): booked days}, splitting each [start, end] range at the period edges."""
+    if numpy is not None and len(starts):
+        starts, ends, codes = numpy.asarray(starts), numpy.asarray(ends), numpy.asarray(codes)
+        edges = numpy.asarray(edges)
+        first = numpy.searchsorted(edges, starts, side="right") - 1
+        spans = numpy.searchsorted(edges, ends, side="right") - first
+        #One row per (range, period) piece: repeat each range once per period it touches
+        rows = numpy.repeat(numpy.arange(len(starts)), spans)
+        period = first[rows] + numpy.arange(len(rows)) - numpy.repeat(numpy.cumsum(spans) - spans, spans)
+        days = numpy.minimum(ends[rows] + 1, edges[period + 1]) - numpy.maximum(starts[rows], edges[period])
+        cells, inverse = numpy.unique(codes[rows] * (len(edges) - 1) + period, return_inverse=True)
+        totals = numpy.bincount(inverse, weights=days)
+        return {divmod(int(cell), len(edges) - 1): int(total) for cell, total in zip(cells, totals)}
+    totals = {}
+    for start, end, code in zip(starts, ends, codes):
+        period = bisect.bisect_right(edges, start) - 1
+        while start <= end:
+            stop = min(end + 1, edges[period + 1])
+            totals[code, period] = totals.get((code, period), 0) + stop - start
+            start = stop
+            period += 1
+    return totals
+
+def daily_demand(starts, ends, start, end):
+    """Returns the number of ranges covering each day of [start, end], from a running sum of +1/-1 boundary counts."""
+    length = end - start + 1
+    if numpy is not None:
+        starts, ends = numpy.asarray(starts), numpy.asarray(ends)
+        change = numpy.bincount(starts - start, minlength=length + 1) - numpy.bincount(ends + 1 - start, minlength=length + 1)
+        return numpy.cumsum(change[:length])
+    change = array.array("l", [0]) * (length + 1)
+    for first, last in zip(starts, ends):
+        change[first - start] += 1
+        change[last + 1 - start] -= 1
+    return array.array("l", itertools.accumulate(change[:length]))
+
+def utilization_report(bookings, resources, start_date, end_date, period="month"):
+    """Returns booked days per resource and per user in each period, the daily peak of each period and the idle resources.
+
+    Utilization is the fraction of the period's days (within the window) that the resource is booked."""
+    columns = BookingColumns.from_bookings(bookings, start_date, end_date)
+    labels, edges = period_edges(columns.start, columns.end, period)
+    resource_names = list(columns.resource_codes)
+    owner_names = list(columns.owner_codes)
+    report = {"start_date": str(start_date), "end_date": str(end_date), "period": period, "bookings": len(columns)}
+
+    by_resource = booked_days(columns.starts, columns.ends, columns.resources, edges)
+    report["resources"] = [{"resource": resource_names[code], "period": labels[index], "booked_days": days,
+        "utilization": round(days / (edges[index + 1] - edges[index]), 4)} for (code, index), days in sorted(by_resource.items(), key=lambda item: (resource_names[item[0][0]], item[0][1]))]
+    by_owner = booked_days(columns.starts, columns.ends, columns.owners, edges)
+    report["users"] = [{"user": owner_names[code], "period": labels[index], "booked_days": days}
+        for (code, index), days in sorted(by_owner.items(), key=lambda item: (owner_names[item[0][0]], item[0][1]))]
+
+    demand = daily_demand(columns.starts, columns.ends, columns.start, columns.end)
+    report["peaks"] = []
+    for index, label in enumerate(labels):
+        days = demand[edges[index] - columns.start:edges[index + 1] - columns.start]
+        busiest = int(days.argmax()) if numpy is not None else days.index(max(days))
+        report["peaks"].append({"period": label, "peak_bookings": int(days[busiest]),
+            "peak_day": datetime.date.fromordinal(edges[index] + busiest).isoformat()})
+    report["idle"] = sorted(set(resources.resources) - set(resource_names))
+    return report
+
+def write_report(report, filepath):
+    """Writes a utilization report as JSON, or as one CSV table if filepath ends in .csv.
+
+    The CSV rows are (kind, name, period, value, utilization): booked days for resource and user rows,
+    the most bookings on one day for peak rows (named by that day), and nothing for idle resources."""
+    if not filepath.endswith(".csv"):
+        JsonStore(filepath).write(report)
+        return
+    with open(filepath, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["kind", "name", "period", "value", "utilization"])
+        writer.writerows(["resource", row["resource"], row["period"], row["booked_days"], row["utilization"]] for row in report["resources"])
+        writer.writerows(["user", row["user"], row["period"], row["booked_days"], ""] for row in report["users"])
+        writer.writerows(["peak", row["peak_day"], row["period"], row["peak_bookings"], ""] for row in report["peaks"])
+        writer.writerows(["idle", name, "", "", ""] for name in report["idle"])
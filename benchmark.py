@@ -0,0 +1,158 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from analytics import utilization_report
+from models import Resources, Bookings, JsonStore, available_codecs
+
+def make_users(count):
+    """Generates count synthetic users."""
+    return {f"user{i}": {"full_name": f"User {i}", "password": "pass"} for i in range(count)}
+
+def make_resources(count, user_count):
+    """Generates count synthetic resources, each owned by one of the synthetic users."""
+    return {f"PC{i}": {"description": f"Computer {i}", "available": True, "owner": f"user{i % user_count}"} for i in range(count)}
+
+def make_bookings(count, user_count, resource_count):
+    """Generates count non-overlapping bookings spread evenly over the synthetic resources, in shuffled order.
+
+    Files are rarely stored in start order, and indexes that are only fast for sorted input should show it."""
+    first_day = datetime.date(2030, 1, 1).toordinal()
+    order = list(range(count))
+    random.Random(count).shuffle(order)
+    bookings = {}
+    for i in order:
+        #Each resource gets back-to-back three day bookings with a one day gap
+        start = first_day + (i // resource_count) * 4
+        bookings[f"booking{i}"] = {
+            "owner": f"user{i % user_count}",
+            "resource": f"PC{i % resource_count}",
+            "start_date": datetime.date.fromordinal(start).isoformat(),
+            "end_date": datetime.date.fromordinal(start + 2).isoformat(),
+        }
+    return bookings
+
+#Times each measurement is taken; the fastest is recorded, being the least disturbed by the rest of the machine
+REPEATS = 5
+
+def timed(results, name, function, repeat=REPEATS, setup=None):
+    """Runs function repeat times and records the fastest run in seconds under name.
+
+    setup, if given, runs untimed before each run, to put back whatever the previous run changed."""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    results[name] = best
+
+def run_scale(count, directory, repeat=REPEATS):
+    """Benchmarks the model operations with count bookings, best of repeat runs each, and returns {operation: seconds}."""
+    user_count = max(count // 10, 1)
+    resource_count = max(count // 40, 1)
+    users_file = os.path.join(directory, f"users_{count}.json")
+    resources_file = os.path.join(directory, f"resources_{count}.json")
+    bookings_file = os.path.join(directory, f"bookings_{count}.json")
+    JsonStore(users_file).write(make_users(user_count))
+    JsonStore(resources_file).write(make_resources(resource_count, user_count))
+    JsonStore(bookings_file).write(make_bookings(count, user_count, resource_count))
+
+    results = {}
+    bookings = Bookings(bookings_file)
+    resources = Resources(resources_file)
+    def reload():
+        bookings.load_bookings()
+        resources.load_resources()
+    def save_one_change():
+        #A save with nothing changed returns without writing, so each run adds or removes one booking first
+        if bookings.has_booking("extra"):
+            bookings.remove_booking("extra")
+        else:
+            bookings.add_booking("extra", {"owner": "user0", "resource": "PC0", "start_date": "2029-12-01", "end_date": "2029-12-02"})
+        bookings.save_bookings()
+    timed(results, "load", bookings.load_bookings, repeat)
+    timed(results, "save", save_one_change, repeat)
+    first_day = datetime.date(2030, 1, 1).toordinal()
+    span = (count // resource_count + 1) * 4
+    queries = [(f"PC{i % resource_count}", datetime.date.fromordinal(first_day + (i * 37) % span)) for i in range(1000)]
+    timed(results, "conflict_check_1000", lambda: [bookings.is_free(resource, day, day) for resource, day in queries], repeat)
+    bookings.search("warm up")
+    timed(results, "search_100", lambda: [bookings.search(f"user{i} pc{i}") for i in range(100)], repeat)
+    timed(results, "generate_booking_dates_100", lambda: [bookings.generate_booking_dates(f"PC{i % resource_count}") for i in range(100)], repeat)
+    timed(results, "utilization_report", lambda: utilization_report(bookings, resources, "2030-01-01", "2030-12-31"), repeat)
+    #Renames and deletes change the data, so every run starts again from the saved files
+    timed(results, "rename_owner_100", lambda: [(bookings.rename_owner(f"user{i}", f"renamed{i}"), resources.update_owners(f"user{i}", f"renamed{i}")) for i in range(min(100, user_count))],
+        repeat, reload)
+    timed(results, "rename_resource_100", lambda: [bookings.rename_resource(f"PC{i}", f"lab{i}") for i in range(min(100, resource_count))], repeat, reload)
+    timed(results, "cascade_delete_100", lambda: [bookings.remove_user_bookings(f"user{i}") for i in range(100, min(200, user_count))], repeat, reload)
+    return results
+
+def run_codecs(count, directory, repeat=REPEATS):
+    """Benchmarks writing and reading count bookings with every available codec and returns {operation: value}.
+
+    Values are seconds, except the <codec>_bytes entries, which are file sizes."""
+    records = make_bookings(count, max(count // 10, 1), max(count // 40, 1))
+    results = {}
+    for codec in available_codecs():
+        store = JsonStore(os.path.join(directory, f"codec_{count}.{codec.name}"), codec)
+        timed(results, f"{codec.name}_save", lambda: store.write(records), repeat)
+        timed(results, f"{codec.name}_load", store.read, repeat)
+        results[f"{codec.name}_bytes"] = os.path.getsize(store.filepath)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Returns a message for every operation that is more than tolerance (a fraction) slower than baseline.
+
+    File sizes (the <codec>_bytes entries) are compared the same way, as a regression when a file grows."""
+    regressions = []
+    for scale, operations in results.items():
+        for operation, value in operations.items():
+            expected = baseline.get(scale, {}).get(operation)
+            if expected is None or value <= expected * (1 + tolerance):
+                continue
+            if operation.endswith("_bytes"):
+                regressions.append(f"{operation} at {scale} bookings: {value} bytes vs baseline {expected} bytes")
+            else:
+                regressions.append(f"{operation} at {scale} bookings: {value:.4f}s vs baseline {expected:.4f}s")
+    return regressions
+
+def main(argv=None):
+    """Runs the benchmarks, writes the results as JSON and fails on regressions against a baseline."""
+    parser = argparse.ArgumentParser(description="Benchmark the booking model operations on synthetic data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000, 1000000], help="booking counts to benchmark")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="results file to compare against, if it exists")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--codec-scale", type=int, default=100000, help="booking count for the codec comparison (0 to skip)")
+    parser.add_argument("--repeat", type=int, default=REPEATS, help="runs per measurement, of which the fastest is kept")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.scales:
+            results[str(count)] = run_scale(count, directory, args.repeat)
+            print(count, json.dumps(results[str(count)]))
+        if args.codec_scale:
+            codecs = run_codecs(args.codec_scale, directory, args.repeat)
+            results.setdefault(str(args.codec_scale), {}).update(codecs)
+            print(args.codec_scale, "codecs", json.dumps(codecs))
+    JsonStore(args.output).write(results)
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("PERFORMANCE REGRESSIONS:\n" + "\n".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import csv
+import datetime
+import sys
+from analytics import PERIODS, utilization_report, write_report
+from importer import import_bookings
+from integrity import check_stores
+from models import open_service, BookingError, METRICS
+from server import serve
+
+def read_pairs(filepath):
+    """Reads (old, new) name pairs from a two column CSV file, or from standard input if filepath is '-'."""
+    file = sys.stdin if filepath == "-" else open(filepath, newline="")
+    try:
+        return [(row[0].strip(), row[1].strip()) for row in csv.reader(file) if len(row) >= 2 and row[0].strip()]
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+def run_each(items, action, describe):
+    """Applies action to every item, reporting failures on stderr; returns the number that failed."""
+    failed = 0
+    for item in items:
+        try:
+            action(item)
+        except BookingError as error:
+            print(f"{describe(item)}: {error}", file=sys.stderr)
+            failed += 1
+    return failed
+
+def delete_users(service, args):
+    """Deletes each user and their bookings, handing their resources to --new-owner."""
+    failed = run_each(args.users, lambda user_name: service.delete_user(user_name, args.new_owner), lambda user_name: user_name)
+    print(f"{len(args.users) - failed} users deleted")
+    return failed
+
+def rename_users(service, args):
+    """Renames users listed as old,new pairs, carrying the renames over to their resources and bookings."""
+    pairs = read_pairs(args.mapping)
+    failed = run_each(pairs, lambda pair: service.edit_user(pair[0], pair[1]), lambda pair: f"{pair[0]} -> {pair[1]}")
+    print(f"{len(pairs) - failed} users renamed")
+    return failed
+
+def rename_resources(service, args):
+    """Renames resources listed as old,new pairs, carrying the renames over to their bookings."""
+    pairs = read_pairs(args.mapping)
+    failed = run_each(pairs, lambda pair: service.edit_resource(pair[0], pair[1]), lambda pair: f"{pair[0]} -> {pair[1]}")
+    print(f"{len(pairs) - failed} resources renamed")
+    return failed
+
+def migrate_passwords(service, args):
+    """Replaces the plaintext passwords left from before hashing with their salted hashes."""
+    print(f"{service.users.migrate_passwords()} passwords hashed")
+    return 0
+
+def purge_bookings(service, args):
+    """Deletes the bookings matching the given user, resource and end date filters."""
+    purged = service.purge_bookings(args.user, args.resource, args.before)
+    print(f"{len(purged)} bookings purged")
+    return 0
+
+def archive_bookings(service, args):
+    """Moves finished bookings into the monthly archive files."""
+    print(f"{service.archive_bookings(args.before)} bookings archived")
+    return 0
+
+def import_file(service, args):
+    """Bulk imports bookings from a JSON lines file; it saves the bookings itself."""
+    result = import_bookings(service, args.file)
+    print(f"{result['accepted']} bookings imported, {result['rejected']} rejected")
+    return 0
+
+def report_utilization(service, args):
+    """Writes the utilization report for the chosen window to --output."""
+    year = datetime.date.today().year
+    start_date = service.parse_date(args.start or f"{year}-01-01")
+    end_date = service.parse_date(args.end or f"{year}-12-31")
+    report = utilization_report(service.bookings, service.resources, start_date, end_date, args.period)
+    write_report(report, args.output)
+    print(f"{report['bookings']} bookings reported to {args.output}, {len(report['idle'])} resources idle")
+    return 0
+
+def check_data(args):
+    """Reports integrity problems in the stores, repairing them in the same pass with --repair; returns 1 if any are left."""
+    fix = args.repair and not args.dry_run
+    issues = check_stores(args.database, args.journal, fix, args.workers)
+    for found in issues:
+        print(f"{found['store']} {found['key']}: {found['message']}")
+    print(f"{len(issues)} issues found" + (" and repaired" if fix and issues else ""))
+    return 1 if issues and not fix else 0
+
+def main(argv=None):
+    """Runs one administrative command over the stores and saves once at the end; returns the exit status."""
+    parser = argparse.ArgumentParser(description="Headless administration of the resource booking data.")
+    parser.add_argument("--database", help="SQLite database file to use instead of the JSON files")
+    parser.add_argument("--journal", action="store_true", help="use journaled JSON files")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without saving")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("serve", help="run the HTTP/JSON booking server")
+    command.add_argument("port", type=int, nargs="?", default=8080)
+    command = commands.add_parser("import", help="bulk import bookings from a JSON lines file")
+    command.add_argument("file")
+    command.set_defaults(run=import_file, save=False)
+    command = commands.add_parser("archive", help="move finished bookings into the archive")
+    command.add_argument("--before", help="archive bookings ending before this date (default today)")
+    command.set_defaults(run=archive_bookings)
+    command = commands.add_parser("delete-users", help="delete users and their bookings")
+    command.add_argument("users", nargs="+")
+    command.add_argument("--new-owner", help="user to hand the deleted users' resources to")
+    command.set_defaults(run=delete_users)
+    command = commands.add_parser("rename-users", help="rename users from a CSV file of old,new pairs ('-' for stdin)")
+    command.add_argument("mapping")
+    command.set_defaults(run=rename_users)
+    command = commands.add_parser("rename-resources", help="rename resources from a CSV file of old,new pairs ('-' for stdin)")
+    command.add_argument("mapping")
+    command.set_defaults(run=rename_resources)
+    command = commands.add_parser("migrate-passwords", help="hash the plaintext passwords left from before hashing")
+    command.set_defaults(run=migrate_passwords)
+    command = commands.add_parser("purge-bookings", help="delete bookings by user, resource and/or end date")
+    command.add_argument("--user")
+    command.add_argument("--resource")
+    command.add_argument("--before", help="only bookings ending before this date")
+    command.set_defaults(run=purge_bookings)
+    command = commands.add_parser("check", help="check references, dates and overlaps in the stores")
+    command.add_argument("--repair", action="store_true", help="delete or fix the bad records and save")
+    command.add_argument("--workers", type=int, help="worker processes (default one per CPU for large stores)")
+    command = commands.add_parser("report", help="write per-resource and per-user utilization as JSON or CSV")
+    command.add_argument("--start", help="first day of the report (default January 1st this year)")
+    command.add_argument("--end", help="last day of the report (default December 31st this year)")
+    command.add_argument("--period", choices=PERIODS, default="month")
+    command.add_argument("--output", default="utilization.json", help="report file; a .csv name writes CSV")
+    command.set_defaults(run=report_utilization, save=False)
+    args = parser.parse_args(argv)
+
+    #The archive files are written as soon as bookings are archived, so there is nothing a dry run could hold back
+    if args.dry_run and args.command in ("serve", "import", "archive"):
+        parser.error(f"--dry-run cannot be used with {args.command}")
+    METRICS.enable_from_environment()
+    if args.command == "serve":
+        asyncio.run(serve(port=args.port, database=args.database, journal=args.journal))
+        return 0
+    if args.command == "check":
+        #Checked on the raw records, since records the models cannot index would stop them loading
+        return check_data(args)
+    service = open_service(args.database, args.journal)
+    try:
+        failed = args.run(service, args)
+    except BookingError as error:
+        print(error, file=sys.stderr)
+        return 1
+    if args.dry_run:
+        print("Dry run: nothing saved")
+    elif getattr(args, "save", True):
+        #Every change above stays in memory, so the whole batch is written by one save
+        service.save()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
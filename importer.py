@@ -0,0 +1,70 @@
+import json
+from models import BookingError, ValidationError
+
+def read_jsonl(filepath):
+    """Yields (line_number, record, error) for each non-blank line of a JSONL file, one line at a time."""
+    with open(filepath, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line), None
+            except json.JSONDecodeError as error:
+                yield line_number, line.rstrip("\n"), f"Invalid JSON: {error.msg}."
+
+def batched(items, size):
+    """Yields lists of up to size items from any iterable without reading ahead further."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def checked_bookings(service, batch, rejected_lines):
+    """Yields (key, booking) for each line of a batch that passes the service's checks, appending the others to rejected_lines.
+
+    The caller must add each booking before taking the next, so later lines are checked against it."""
+    for line_number, record, error in batch:
+        if error is None:
+            try:
+                if not isinstance(record, dict):
+                    raise ValidationError("Each line must be a JSON object.")
+                yield record.get("booking_name"), service.check_new_booking(record.get("booking_name"), record.get("owner"), record.get("resource"),
+                    record.get("start_date"), record.get("end_date"), record.get("repeat"))
+                continue
+            except BookingError as booking_error:
+                error = str(booking_error)
+        rejected_lines.append(json.dumps({"line": line_number, "reason": error, "request": record}) + "\n")
+
+def import_bookings(service, filepath, rejects_path=None, batch_size=1000):
+    """Streams booking requests from a JSONL file into the stores, saving all accepted bookings at once.
+
+    Each line holds the bookings.json fields plus the booking name, e.g.
+    {"booking_name": "b1", "owner": "u1", "resource": "r1", "start_date": "2030-01-01", "end_date": "2030-01-02"}.
+    Rejected lines are written with their reason to rejects_path (default: filepath + ".rejected.jsonl").
+    The bookings are saved first, as the checkpoint a failed import reloads; the import itself cannot be undone.
+    """
+    if rejects_path is None:
+        rejects_path = filepath + ".rejected.jsonl"
+    service.bookings.save_bookings()
+    accepted = rejected = 0
+    try:
+        with open(rejects_path, 'w') as rejects:
+            for batch in batched(read_jsonl(filepath), batch_size):
+                rejected_lines = []
+                accepted += service.bookings.add_bookings(checked_bookings(service, batch, rejected_lines))
+                rejects.writelines(rejected_lines)
+                rejected += len(rejected_lines)
+        service.bookings.save_bookings()
+    except BaseException:
+        #Nothing is kept unless the whole import is saved
+        service.bookings.load_bookings()
+        raise
+    service.sync_days_booked()
+    service.resources.save_resources()
+    #Earlier steps could otherwise be undone into dates the import has filled since
+    service.log.clear()
+    return {"accepted": accepted, "rejected": rejected}
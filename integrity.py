@@ -0,0 +1,177 @@
+import concurrent.futures
+import contextlib
+import datetime
+import os
+from models import AvailabilityIndex, DayBitmap, open_stores, occurrences
+
+#Bookings handed to a worker process per task; smaller inputs are checked in this process
+CHUNK_SIZE = 50000
+
+#Names every worker checks references against, set once per process by set_known_names
+known_users = frozenset()
+known_resources = frozenset()
+
+def set_known_names(user_names, resource_names):
+    """Pool initializer: remembers the user and resource names so they are sent to each worker only once."""
+    global known_users, known_resources
+    known_users, known_resources = user_names, resource_names
+
+def issue(store, key, problem, message, **details):
+    """Returns one issue record; problem is a fixed code that repair() acts on."""
+    return dict(store=store, key=key, problem=problem, message=message, **details)
+
+def is_iso_date(value):
+    """Returns True if value is a YYYY-MM-DD date string."""
+    try:
+        datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def is_valid_rule(rule):
+    """Returns True if rule is a repeat rule occurrences() can expand to a finite series."""
+    if not isinstance(rule, dict) or rule.get("every") not in ("daily", "weekly", "monthly"):
+        return False
+    if not isinstance(rule.get("interval", 1), int) or rule.get("interval", 1) < 1:
+        return False
+    if rule.get("count") is not None:
+        return isinstance(rule["count"], int) and rule["count"] > 0 and rule.get("until") is None
+    return is_iso_date(rule.get("until"))
+
+def check_booking(booking_key, booking):
+    """Returns the issue that stops a booking from being kept as it is, or None if it is sound."""
+    missing = [field for field in ("owner", "resource", "start_date", "end_date") if not booking.get(field)]
+    if missing:
+        return issue("bookings", booking_key, "missing_field", f"Missing {', '.join(missing)}.")
+    if not (is_iso_date(booking["start_date"]) and is_iso_date(booking["end_date"])):
+        return issue("bookings", booking_key, "bad_date", f"Invalid dates {booking['start_date']!r} to {booking['end_date']!r}.")
+    if booking["owner"] not in known_users:
+        return issue("bookings", booking_key, "unknown_owner", f"Owner {booking['owner']!r} does not exist.")
+    if booking["resource"] not in known_resources:
+        return issue("bookings", booking_key, "unknown_resource", f"Resource {booking['resource']!r} does not exist.")
+    if booking.get("repeat") and not is_valid_rule(booking["repeat"]):
+        return issue("bookings", booking_key, "bad_repeat", f"Invalid repeat rule {booking['repeat']!r}.")
+    if booking["end_date"] < booking["start_date"]:
+        return issue("bookings", booking_key, "reversed_dates", f"Ends on {booking['end_date']} before it starts on {booking['start_date']}.")
+    return None
+
+def check_bookings(items):
+    """Worker task: checks a list of (key, booking) pairs on their own and returns their issues."""
+    return [found for found in (check_booking(booking_key, booking) for booking_key, booking in items) if found is not None]
+
+def check_overlaps(groups):
+    """Worker task: finds overlapping bookings on each resource of {resource: [(key, booking)]}.
+
+    Returns (issues, {resource: booked day ranges}), where the ranges cover the one-off bookings not reported as overlapping."""
+    issues = []
+    days_booked = {}
+    for resource, items in groups.items():
+        #Whole bookings are kept in order of their first day, each only if none of its occurrences clash with one kept before it
+        series = sorted((spans[0][0], booking_key, booking, spans)
+            for booking_key, booking in items for spans in [list(occurrences(booking))] if spans)
+        kept = AvailabilityIndex()
+        busy = DayBitmap()
+        for _, booking_key, booking, spans in series:
+            other = next((key for start, end in spans for key in kept.overlapping(start, end, first_only=True)), None)
+            if other is not None:
+                issues.append(issue("bookings", booking_key, "overlap",
+                    f"Overlaps booking {other!r} on resource {resource!r}.", other=other))
+                continue
+            for start, end in spans:
+                kept.add(start, end, booking_key)
+                #Stored booked days hold only one-off bookings; rules stay rules
+                if not booking.get("repeat"):
+                    busy.add(start, end)
+        days_booked[resource] = busy.to_json()
+    return issues, days_booked
+
+@contextlib.contextmanager
+def worker_pool(workers, user_names, resource_names):
+    """Yields a map function that runs tasks on a pool of workers processes, or in this process if workers is 1."""
+    if workers <= 1:
+        set_known_names(user_names, resource_names)
+        yield map
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=set_known_names, initargs=(user_names, resource_names)) as pool:
+        yield pool.map
+
+def resource_batches(groups):
+    """Splits {resource: [(key, booking)]} into dicts of whole resources holding about CHUNK_SIZE bookings each."""
+    batch, size = {}, 0
+    for resource, items in groups.items():
+        batch[resource] = items
+        size += len(items)
+        if size >= CHUNK_SIZE:
+            yield batch
+            batch, size = {}, 0
+    if batch:
+        yield batch
+
+def check(users, resources, bookings, workers=None):
+    """Checks the raw {key: record} dicts of the three stores and returns the list of issues found.
+
+    Bookings are checked on their own in chunks, then resource by resource for overlaps, each stage spread over
+    workers processes (by default one per CPU once there is more than a chunk of bookings)."""
+    issues = [issue("resources", resource_name, "unknown_owner", f"Owner {resource['owner']!r} does not exist.")
+        for resource_name, resource in resources.items() if resource.get("owner") is not None and resource["owner"] not in users]
+    items = list(bookings.items())
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(items) > CHUNK_SIZE else 1
+    days_booked = {}
+    with worker_pool(workers, frozenset(users), frozenset(resources)) as run:
+        problems = {}
+        for found in run(check_bookings, [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]):
+            issues.extend(found)
+            problems.update((each["key"], each["problem"]) for each in found)
+        #Overlaps are only looked for among the bookings a repair keeps, with reversed dates already swapped
+        groups = {}
+        for booking_key, booking in items:
+            problem = problems.get(booking_key)
+            if problem == "reversed_dates":
+                booking = dict(booking, start_date=booking["end_date"], end_date=booking["start_date"])
+            elif problem is not None:
+                continue
+            groups.setdefault(booking["resource"], []).append((booking_key, booking))
+        for found, booked in run(check_overlaps, list(resource_batches(groups))):
+            issues.extend(found)
+            days_booked.update(booked)
+    for resource_name, resource in resources.items():
+        expected = days_booked.get(resource_name, [])
+        try:
+            stored = DayBitmap.from_json(resource.get("days_booked") or []).to_json()
+        except (TypeError, ValueError, IndexError):
+            stored = None
+        if stored != expected:
+            issues.append(issue("resources", resource_name, "days_booked", "Booked days do not match its bookings.", expected=expected))
+    return issues
+
+def repair(issues, resources, bookings):
+    """Fixes every issue in place on the raw resources and bookings dicts.
+
+    Unusable, orphaned and overlapping bookings are deleted and reversed dates swapped; resources whose owner is
+    missing are left to nobody, as when their owner is deleted, and their booked days are rewritten."""
+    for found in issues:
+        key, problem = found["key"], found["problem"]
+        if found["store"] == "resources":
+            if problem == "unknown_owner":
+                resources[key]["owner"] = None
+            else:
+                resources[key]["days_booked"] = found["expected"]
+        elif problem == "reversed_dates":
+            booking = bookings[key]
+            booking["start_date"], booking["end_date"] = booking["end_date"], booking["start_date"]
+        else:
+            bookings.pop(key, None)
+
+def check_stores(database=None, journal=False, fix=False, workers=None):
+    """Checks the JSON files, journaled JSON files or SQLite database and, with fix set, repairs and saves them in the same pass.
+
+    Returns the list of issues found."""
+    _, resources_store, bookings_store = stores = open_stores(database, journal)
+    users, resources, bookings = (store.load() for store in stores)
+    issues = check(users, resources, bookings, workers)
+    if fix and issues:
+        repair(issues, resources, bookings)
+        resources_store.save(resources)
+        bookings_store.save(bookings)
+    return issues
@@ -2,137 +2,191 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import simpledialog as dialog
 from tkinter import messagebox as msgbox
-import json
 import datetime
+import sys
+#The data model lives in models.py so that scripts and tests can use it without importing Tk
+from models import (open_service, BookingError, AuthenticationError, NotFoundError, UNCHANGED, SaveConflictError, METRICS, instrumented,
+    describe_repeat)
 
-class Users:
-    """Handles user management including loading, saving, authentication, and deletion."""
-    def __init__(self, filepath="users.json"):
-        """Initializes Users with a given JSON file path."""
-        self.filepath = filepath
-        self.load_users()
-        self.save_users()
-    
-    def load_users(self):
-        """Loads users from the JSON file."""
+def ask_valid(title, prompt, check, cancel_message, **options):
+    """Prompts until check accepts the answer and returns check's result, or None if cancelled."""
+    while True:
+        answer = dialog.askstring(title, prompt, **options)
+        if answer == None:
+            msgbox.showinfo("Cancelled", cancel_message)
+            return None
         try:
-            with open(self.filepath, 'r') as file:
-                self.users = json.load(file)
-        except FileNotFoundError:
-            self.users = {}
-        except json.JSONDecodeError:
-            self.users = {}
-            
-    def save_users(self):
-        """Saves users to the JSON file."""
-        with open(self.filepath, 'w') as file:
-            json.dump(self.users, file, indent=4)
-    
-    def delete_user(self, user_name):
-        """Deletes a user by username."""
-        if user_name in self.users:
-            del self.users[user_name]
-            self.save_users()
-            return True
-        return False
-    
-    def log_in(self, user_name, start_text, cancel_text):
-        """Prompts for password and authenticates a user."""
-        fail_count = 0
-        while True:
-            password = dialog.askstring("Login", "Enter password to "+start_text+":", show='*')
-            if password == None:
-                msgbox.showinfo("Cancelled", cancel_text+" cancelled.")
-                return True
-            elif password == "":
-                msgbox.showerror("Error", "Password cannot be empty.")
-            elif password == self.users[user_name]["password"]:
-                return False
+            return check(answer)
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+
+def describe_promoted(promoted):
+    """Returns a sentence naming the waiting requests that were booked, or nothing if there were none."""
+    return f"\nBooked from the waitlist: {', '.join(promoted)}." if promoted else ""
+
+class VirtualView(ttk.Frame):
+    """Scrollable view over a list of keys that only renders the rows currently visible."""
+    def __init__(self, parent, height=10):
+        """Initializes an empty view showing height rows at a time."""
+        super().__init__(parent)
+        self.height = height
+        self.keys = []
+        self.top = 0
+        self.selected_key = None
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+
+    def bind_wheel(self, widget):
+        """Routes mouse wheel events on widget to the view (Windows/macOS and X11 bindings)."""
+        widget.bind("<MouseWheel>", lambda event: self.scroll_by(-1 if event.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda event: self.scroll_by(-1))
+        widget.bind("<Button-5>", lambda event: self.scroll_by(1))
+
+    def set_keys(self, keys):
+        """Replaces all keys and re-renders the visible window."""
+        self.keys = list(keys)
+        if self.selected_key is not None and self.selected_key not in self.keys:
+            self.selected_key = None
+        self.render()
+
+    def apply(self, added, removed, reset=False):
+        """Applies a model change notification as a diff of the key list."""
+        if reset:
+            self.set_keys(added)
+            return
+        if added and removed:
+            #Keys both removed and added were edited in place, so those shown keep their position; the rest,
+            #such as records an edit made match a search, are new to the view
+            edited = set(added) & set(removed)
+            if edited:
+                shown = edited.intersection(self.keys)
+                added = [key for key in added if key not in shown]
+                removed = [key for key in removed if key not in edited]
+        if removed:
+            removed = set(removed)
+            if len(removed) == 1:
+                key = next(iter(removed))
+                if key in self.keys:
+                    self.keys.remove(key)
             else:
-                msgbox.showerror("Error", "Incorrect password.")
-                fail_count += 1
-                if fail_count == 3:
-                    msgbox.showerror("Error", "Too many failed attempts. Exiting.")
-                    return True
+                self.keys = [key for key in self.keys if key not in removed]
+            if self.selected_key in removed:
+                self.selected_key = None
+        self.keys.extend(added)
+        self.render()
 
-class Resources:
-    """Handles resource management including loading, saving, updating owners."""
-    def __init__(self, filepath="resources.json"):
-        """Initializes Resources with a given JSON file path."""
-        self.filepath = filepath
-        self.load_resources()
-        self.save_resources()
-    def load_resources(self):
-        """Loads resources from the JSON file."""
-        try:
-            with open(self.filepath, 'r') as file:
-                self.resources = json.load(file)
-        except FileNotFoundError:
-            self.resources = {}
-        except json.JSONDecodeError:
-            self.resources = {}
-    
-    def save_resources(self):
-        """Saves resources to the JSON file."""
-        with open(self.filepath, 'w') as file:
-            json.dump(self.resources, file, indent=4)
-        
-    def update_owners(self, old_owner, new_owner):
-        """Updates the owner of resources from old_owner to new_owner."""
-        for resource_key, resource in self.resources.items():
-            if resource["owner"] == old_owner:
-                resource["owner"] = new_owner
-            
-class Bookings:
-    """Handles booking management including loading, saving, and date calculations."""
-    def __init__(self, filepath="bookings.json"):
-        """Initializes Bookings with a given JSON file path."""
-        self.filepath = filepath
-        self.load_bookings()
-        self.save_bookings()
-    
-    def load_bookings(self):
-        """Loads bookings from the JSON file."""
-        try:
-            with open(self.filepath, 'r') as file:
-                self.bookings = json.load(file)
-        except FileNotFoundError:
-            self.bookings = {}
-        except json.JSONDecodeError:
-            self.bookings = {}
-    def save_bookings(self):
-        """Saves bookings to the JSON file."""
-        with open(self.filepath, 'w') as file:
-            json.dump(self.bookings, file, indent=4)
-    
-    def generate_booking_dates(self, resource):
-        """Generates a list of all booked dates for a given resource."""
-        booking_dates = []
-        for booking_key, booking in self.bookings.items():
-            if booking["resource"] == resource:
-                start_date = datetime.datetime.strptime(booking["start_date"], "%Y-%m-%d").date()
-                end_date = datetime.datetime.strptime(booking["end_date"], "%Y-%m-%d").date()
-                booking_dates = booking_dates + [(start_date + datetime.timedelta(days=i)).isoformat()
-                    for i in range((end_date - start_date).days + 1)]
-        return booking_dates
-                    
-    def remove_user_bookings(self, user_name):
-        """Removes all bookings for a given user."""
-        for booking_key, booking in self.bookings.items():
-            if booking["owner"] == user_name:
-                del self.bookings[booking_key]
-    
-    def remove_resource_bookings(self, resource):
-        """Removes all bookings for a given resource."""
-        for booking_key, booking in self.bookings.items():
-            if booking["resource"] == resource:
-                del self.bookings[booking_key]
-        
+    def on_scroll(self, action, value, units=None):
+        """Handles scrollbar drags and clicks."""
+        if action == "moveto":
+            self.scroll_to(int(float(value) * len(self.keys)))
+        elif action == "scroll":
+            self.scroll_by(int(value) * (self.height if units == "pages" else 1))
+
+    def scroll_by(self, rows):
+        """Moves the visible window by a number of rows."""
+        self.scroll_to(self.top + rows)
+
+    def scroll_to(self, top):
+        """Moves the visible window so it starts at row top."""
+        self.top = top
+        self.render()
+
+    @instrumented
+    def render(self):
+        """Shows the visible window of keys and updates the scrollbar."""
+        self.top = max(0, min(self.top, len(self.keys) - self.height))
+        visible = self.keys[self.top:self.top + self.height]
+        self.show_rows(visible)
+        if self.keys:
+            self.scrollbar.set(self.top / len(self.keys), (self.top + len(visible)) / len(self.keys))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def show_rows(self, keys):
+        """Replaces the rows in the underlying widget; implemented by subclasses."""
+        raise NotImplementedError
+
+    def selected(self):
+        """Returns the selected key, or None if nothing is selected."""
+        return self.selected_key
+
+class VirtualListbox(VirtualView):
+    """Virtualized replacement for a single-selection Listbox of keys."""
+    def __init__(self, parent, height=10):
+        """Initializes the listbox with height visible rows."""
+        super().__init__(parent, height)
+        self.listbox = tk.Listbox(self, height=height, selectmode=tk.SINGLE, exportselection=False)
+        self.listbox.pack(side="left", fill="both", expand=True)
+        self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.bind_wheel(self.listbox)
+
+    def show_rows(self, keys):
+        """Replaces the listbox rows with keys, keeping the selection if it is visible."""
+        self.listbox.delete(0, tk.END)
+        if keys:
+            self.listbox.insert(0, *keys)
+        if self.selected_key in keys:
+            self.listbox.selection_set(keys.index(self.selected_key))
+
+    def on_select(self, event):
+        """Remembers the selected key so it survives scrolling."""
+        selection = self.listbox.curselection()
+        if selection:
+            self.selected_key = self.keys[self.top + selection[0]]
+
+class VirtualTreeview(VirtualView):
+    """Virtualized read-only table whose rows are built from keys only when they scroll into view."""
+    def __init__(self, parent, columns, row_values, height=15):
+        """Initializes the table; row_values(key) returns the tuple of column values for a key."""
+        super().__init__(parent, height)
+        self.row_values = row_values
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=height)
+        for column in columns:
+            self.tree.heading(column, text=column)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.bind_wheel(self.tree)
+
+    def show_rows(self, keys):
+        """Replaces the table rows with those for keys."""
+        self.tree.delete(*self.tree.get_children())
+        for key in keys:
+            self.tree.insert("", "end", values=self.row_values(key))
+
+class SearchBox(ttk.Frame):
+    """Search entry that narrows a virtual view to the keys matching a model's search, as the user types."""
+    def __init__(self, parent, view, model, all_keys):
+        """Initializes the entry; all_keys() returns every key of model in display order."""
+        super().__init__(parent)
+        self.view = view
+        self.model = model
+        self.all_keys = all_keys
+        ttk.Label(self, text="Search:").pack(side="left")
+        self.entry = ttk.Entry(self)
+        self.entry.pack(side="left", fill="x", expand=True)
+        self.entry.bind("<KeyRelease>", lambda event: self.refresh())
+        model.subscribe(self.apply)
+
+    @instrumented
+    def refresh(self):
+        """Shows the keys matching the current query, or every key if the query is blank."""
+        found = self.model.search(self.entry.get())
+        keys = self.all_keys()
+        self.view.set_keys(keys if found is None else [key for key in keys if key in found])
+
+    def apply(self, added, removed, reset=False):
+        """Passes a model change on to the view, dropping added keys that do not match the query."""
+        if reset:
+            self.refresh()
+            return
+        found = self.model.search(self.entry.get())
+        if found is not None:
+            added = [key for key in added if key in found]
+        self.view.apply(added, removed)
 
 class App(tk.Tk):
     """Main application window for the Resource Management System."""
-    def __init__(self):
-        """Initializes the main application window and its components."""
+    def __init__(self, database=None, journal=False):
+        """Initializes the main application window and its components, using a SQLite database file or journaled JSON files if asked."""
         super().__init__()
         self.title("Resource Management System")
         self.style = ttk.Style(self)
@@ -140,35 +194,108 @@ class App(tk.Tk):
         frame = ttk.Frame(self, padding="15")
         frame.pack(fill="both", expand=True)
         
-        self.users = Users()
-        self.resources = Resources()
-        self.bookings = Bookings()
+        self.service = open_service(database, journal)
+        self.users = self.service.users
+        self.resources = self.service.resources
+        self.bookings = self.service.bookings
 
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(fill="both", expand=True, padx=10, pady=10)
-        #Generates pages for the notebook
+        #Each tab starts as an empty frame; its page is only built the first time the tab is selected
         self.pages = {}
-        for Page in (UserPage, ResourcePage, BookerPage):
-            page = Page(self.notebook, self)
-            self.pages[Page.__name__] = page
-            self.notebook.add(page, text=page.title)
+        self.page_classes = (UserPage, ResourcePage, BookerPage)
+        self.tabs = []
+        for Page in self.page_classes:
+            tab = ttk.Frame(self.notebook)
+            self.tabs.append(tab)
+            self.notebook.add(tab, text=Page.title)
+        self.notebook.bind("<<NotebookTabChanged>>", self.build_selected_page)
+        self.build_page(0)
         
         button_frame = ttk.Frame(frame)
         button_frame.pack(fill="x", pady=(10, 0))
         ttk.Button(button_frame, text="Save", command=self.save).pack(side="left", padx=(60, 35))
         ttk.Button(button_frame, text="Save & Exit", command=self.save_exit).pack(side="left")
+        ttk.Button(button_frame, text="Redo", command=self.redo).pack(side="right")
+        ttk.Button(button_frame, text="Undo", command=self.undo).pack(side="right", padx=5)
+        self.bind_all("<Control-z>", lambda event: self.undo())
+        self.bind_all("<Control-y>", lambda event: self.redo())
     
+    def build_selected_page(self, event=None):
+        """Builds the page of the newly selected tab if it has not been built yet."""
+        self.build_page(self.notebook.index("current"))
+
+    @instrumented
+    def build_page(self, index):
+        """Builds the page for the tab at index, once, and returns it."""
+        Page = self.page_classes[index]
+        if Page.__name__ not in self.pages:
+            page = Page(self.tabs[index], self)
+            page.pack(fill="both", expand=True)
+            self.pages[Page.__name__] = page
+        return self.pages[Page.__name__]
+
+    @instrumented
     def save(self):
-        """Saves all user, resource, and booking data."""
-        self.users.save_users()
-        self.resources.save_resources()
-        self.bookings.save_bookings()
+        """Saves all user, resource, and booking data; returns False if another desk changed the same records."""
+        try:
+            self.service.save()
+        except SaveConflictError as error:
+            msgbox.showerror("Save Conflict", f"{error}\nRestart to load the latest data; your changes to those records were not saved.")
+            return False
         msgbox.showinfo("Success", "All data saved successfully.")
+        return True
     
+    def undo(self):
+        """Reverts the last change made through the service; the pages follow through their change notifications."""
+        try:
+            self.title(f"Resource Management System - undid {self.service.undo()}")
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+
+    def redo(self):
+        """Applies the last undone change again."""
+        try:
+            self.title(f"Resource Management System - redid {self.service.redo()}")
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+
     def save_exit(self):
-        """Saves all data and exits the application."""
-        self.save()
-        self.destroy()
+        """Saves all data and exits the application unless the save hit a conflict."""
+        if self.save():
+            self.destroy()
+
+    def log_in(self, user_name, start_text, cancel_text):
+        """Prompts for password and authenticates a user; returns True if the action should be cancelled."""
+        fail_count = 0
+        while True:
+            password = dialog.askstring("Login", "Enter password to "+start_text+":", show='*')
+            if password == None:
+                msgbox.showinfo("Cancelled", cancel_text+" cancelled.")
+                return True
+            try:
+                self.service.authenticate(user_name, password)
+                return False
+            except AuthenticationError as error:
+                msgbox.showerror("Error", str(error))
+                fail_count += 1
+                if fail_count == 3:
+                    msgbox.showerror("Error", "Too many failed attempts. Exiting.")
+                    return True
+            except BookingError as error:
+                msgbox.showerror("Error", str(error))
+
+    def ask_owner(self, cancel_message, current_owner=None):
+        """Asks whether a resource is owned and by whom; returns (cancelled, owner_name)."""
+        while True:
+            is_owned = msgbox.askyesno("Ownership", "Is the resource owned by someone?:")
+            if is_owned:
+                owner_name = ask_valid("Owner Name", "Enter owner's username:", lambda name: self.service.require_user(name, "Owner"), cancel_message, initialvalue=current_owner)
+                return owner_name is None, owner_name
+            confirm = msgbox.askyesno("Ownership", "Resource will be editable by anyone. Continue?")
+            if confirm:
+                return False, None
+            msgbox.showinfo("Understood", "Understood.")
 
 class UserPage(ttk.Frame):
     """User management page for creating, editing, deleting, and viewing users."""
@@ -179,8 +306,10 @@ class UserPage(ttk.Frame):
         self.main_app = main_app
         
         tk.Label(self, text="User Portal", font=("Arial", 12)).pack(pady=5)
-        self.user_listbox = tk.Listbox(self, height=10, selectmode=tk.SINGLE)
-        self.user_listbox.pack(fill="x", padx=5, pady=5)
+        self.user_list = VirtualListbox(self, height=10)
+        self.user_list.pack(fill="x", padx=5, pady=5)
+        self.user_search = SearchBox(self, self.user_list, self.main_app.users, lambda: self.main_app.users.users.keys())
+        self.user_search.pack(fill="x", padx=5, before=self.user_list)
         self.refresh_user_list()
 
         ttk.Button(self, text="Create New User", command=self.create_user).pack(pady=5)
@@ -189,136 +318,73 @@ class UserPage(ttk.Frame):
         ttk.Button(self, text="Refresh User List", command=self.refresh_user_list).pack(pady=5)
         ttk.Button(self, text="View User Information", command=self.view_user_info).pack(pady=5)
 
+    @instrumented
     def refresh_user_list(self):
         """Refreshes the user listbox with current users."""
-        self.winfo_children()[1]
-        while self.user_listbox.size() > 0:
-            self.user_listbox.delete(0)
-        for user_name in self.main_app.users.users.keys():
-            self.user_listbox.insert(tk.END, user_name)
+        self.user_search.refresh()
 
     def create_user(self):
         """Handles creation of a new user."""
-        while True:
-            username = dialog.askstring("Create New User", "Enter Username:")
-            if username == None:
-                msgbox.showinfo("Cancelled", "User creation cancelled.")
-                return
-            elif username == "":
-                msgbox.showerror("Error", "Username cannot be empty.")
-            elif username not in self.main_app.users.users:
-                break
-            else:
-                msgbox.showerror("Error", "User already exists.")
-        while True:
-            full_name = dialog.askstring("Full Name", "Enter Full Name (Optional):")
-            if full_name == None:
-                    msgbox.showinfo("Cancelled", "User creation cancelled.")
-                    return
-            else:
-                break
-        while True:
-            password = dialog.askstring("Password", "Enter Password:", show='*')
-            if password == None:
-                msgbox.showinfo("Cancelled", "User creation cancelled.")
-                return
-            elif password == "":
-                msgbox.showerror("Error", "Password cannot be empty.")
-            else:
-              break  
-        self.main_app.users.users[username] = {"full_name": full_name, "password": password}
+        service = self.main_app.service
+        username = ask_valid("Create New User", "Enter Username:", service.require_new_user_name, "User creation cancelled.")
+        if username == None:
+            return
+        full_name = ask_valid("Full Name", "Enter Full Name (Optional):", lambda text: text, "User creation cancelled.")
+        if full_name == None:
+            return
+        password = ask_valid("Password", "Enter Password:", service.require_password, "User creation cancelled.", show='*')
+        if password == None:
+            return
+        try:
+            service.create_user(username, full_name, password)
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+            return
         msgbox.showinfo("Success", f"New user '{username}' created successfully.")
-        self.refresh_user_list()
         
     def edit_user(self): 
         """Handles editing of an existing user."""
-        if self.user_listbox.curselection():
-            user_name = self.user_listbox.get(self.user_listbox.curselection())
-            cancel = self.main_app.users.log_in(user_name, "edit user", "User edit")
+        user_name = self.user_list.selected()
+        if user_name is not None:
+            cancel = self.main_app.log_in(user_name, "edit user", "User edit")
             if cancel is False:
-                while True:
-                    new_user_name = dialog.askstring("Edit Username", "Enter new username:", initialvalue=user_name)
-                    if new_user_name == None:
-                        msgbox.showinfo("Cancelled", "User edit cancelled.")
-                        return
-                    elif new_user_name == "":
-                        msgbox.showerror("Error", "Username cannot be empty.")
-                    elif new_user_name != user_name:
-                        if new_user_name in self.main_app.users.users:
-                            msgbox.showerror("Error", "New username already exists.")
-                        else:
-                            break
-                    else:
-                        break
-                self.main_app.users.users[new_user_name] = self.main_app.users.users.pop(user_name)
-                old_user_name = user_name
-                user_name = new_user_name  
-                while True:
-                    full_name = dialog.askstring("Edit Full Name", "Enter new full name:", initialvalue=self.main_app.users.users[user_name]["full_name"])
-                    if full_name == None:
-                        msgbox.showinfo("Cancelled", "User edit cancelled.")
-                        return
-                    else:
-                        break
-                while True:
-                    new_password = dialog.askstring("Edit Password", "Enter new password (leave blank to keep current):", show='*')
-                    if new_password == None:
-                        msgbox.showinfo("Cancelled", "User edit cancelled.")
-                        return
-                    elif new_password == "":
-                        new_password = self.main_app.users.users[user_name]["password"]
-                        break
-                    else:
-                        break
-                if full_name:
-                    self.main_app.users.users[user_name]["full_name"] = full_name
-                if new_password:
-                    self.main_app.users.users[user_name]["password"] = new_password
-                # Update bookings and resources with new username
-                for booking_name, booking in self.main_app.bookings.bookings.items():
-                    if booking["owner"] == user_name:
-                        self.main_app.bookings.bookings[booking_name]["owner"] = user_name
-                for resource in self.main_app.resources.resources.values():
-                    if resource.get("owner") == old_user_name:
-                        resource["owner"] = user_name 
-                msgbox.showinfo("Success", f"User '{user_name}' updated successfully.")
-                self.refresh_user_list()
-                return
-            else:    
-                return
+                service = self.main_app.service
+                new_user_name = ask_valid("Edit Username", "Enter new username:", lambda name: service.require_new_user_name(name, current=user_name), "User edit cancelled.", initialvalue=user_name)
+                if new_user_name == None:
+                    return
+                full_name = ask_valid("Edit Full Name", "Enter new full name:", lambda text: text, "User edit cancelled.", initialvalue=self.main_app.users.users[user_name]["full_name"])
+                if full_name == None:
+                    return
+                new_password = ask_valid("Edit Password", "Enter new password (leave blank to keep current):", lambda text: text, "User edit cancelled.", show='*')
+                if new_password == None:
+                    return
+                try:
+                    #Blank answers keep the current full name and password
+                    service.edit_user(user_name, new_user_name, full_name or None, new_password or None)
+                except BookingError as error:
+                    msgbox.showerror("Error", str(error))
+                    return
+                msgbox.showinfo("Success", f"User '{new_user_name}' updated successfully.")
         else:
             msgbox.showerror("Error", "No user selected for editing.")
 
     def delete_user(self):
         """Handles deletion of a user."""
-        if self.user_listbox.curselection():
-            user_name = self.user_listbox.get(self.user_listbox.curselection())
-            cancel = self.main_app.users.log_in(user_name, "delete user", "User deletion")
+        user_name = self.user_list.selected()
+        if user_name is not None:
+            cancel = self.main_app.log_in(user_name, "delete user", "User deletion")
             if cancel is False:
                 confirm = msgbox.askyesno("Confirm Delete", f"Are you sure you want to delete user '{user_name}'?")
                 if confirm:
+                    service = self.main_app.service
+                    new_owner = None
                     change_owner = msgbox.askyesno("Change Owner", "Do you want to change the owner of resources owned by this user?")
                     if change_owner:
-                        while True:
-                            new_owner = dialog.askstring("New Owner", "Enter new owner's username:")
-                            if new_owner is None:
-                                msgbox.showinfo("Cancelled", "Owner change cancelled. Resources will be free for all users.")
-                                change_owner = False
-                                break
-                            elif new_owner == "":
-                                msgbox.showerror("Error", "New owner cannot be empty.")
-                            elif new_owner in self.main_app.users.users:
-                                self.main_app.resources.update_owners(user_name, new_owner)
-                                break
-                            else:
-                                msgbox.showerror("Error", "New owner does not exist. Please enter a valid username.")
-                    else:
-                        self.main_app.resources.update_owners(user_name, None)
-                        self.main_app.bookings.remove_user_bookings(user_name)
-                        self.main_app.users.delete_user(user_name)
-                        self.refresh_user_list()
-            else: 
-                self.refresh_user_list()
+                        new_owner = ask_valid("New Owner", "Enter new owner's username:", lambda name: service.require_user(name, "New owner"), "Owner change cancelled. Resources will be free for all users.")
+                    try:
+                        service.delete_user(user_name, new_owner)
+                    except BookingError as error:
+                        msgbox.showerror("Error", str(error))
         else:
             msgbox.showerror("Error", "No user selected for deletion.")
 
@@ -334,14 +400,11 @@ class UserPage(ttk.Frame):
         ttk.Label(frame, text="User Information", font=("Arial", 12)).pack(pady=(0, 15))
         
         columns = ("Username", "Full Name")
-        tree = ttk.Treeview(frame, columns=columns, show="headings")
-        tree.heading("Username", text="Username")
-        tree.heading("Full Name", text="Full Name")
-        tree.pack(fill="both", expand=True)
-
-        # Insert user data into the grid
-        for user_name, info in self.main_app.users.users.items():
-            tree.insert("", "end", values=(user_name, info.get("full_name", "")))
+        users = self.main_app.users.users
+        # Rows are only built for the users scrolled into view
+        table = VirtualTreeview(frame, columns, lambda user_name: (user_name, users[user_name].get("full_name", "")))
+        table.pack(fill="both", expand=True)
+        table.set_keys(users.keys())
 
 class ResourcePage(ttk.Frame):
     """Resource management page for creating, editing, deleting, and viewing resources."""
@@ -352,8 +415,10 @@ class ResourcePage(ttk.Frame):
         self.main_app = main_app
         
         tk.Label(self, text="Resource Creator/Editor", font=("Arial", 12)).pack(pady=5)
-        self.resource_listbox = tk.Listbox(self, height=10, selectmode=tk.SINGLE)
-        self.resource_listbox.pack(fill="x", padx=5, pady=5)
+        self.resource_list = VirtualListbox(self, height=10)
+        self.resource_list.pack(fill="x", padx=5, pady=5)
+        self.resource_search = SearchBox(self, self.resource_list, self.main_app.resources, lambda: self.main_app.resources.resources.keys())
+        self.resource_search.pack(fill="x", padx=5, before=self.resource_list)
         self.refresh_resource_list()
 
         ttk.Button(self, text="Create Resource", command=self.create_resource).pack(pady=5)
@@ -362,221 +427,83 @@ class ResourcePage(ttk.Frame):
         ttk.Button(self, text="Refresh Resource List", command=self.refresh_resource_list).pack(pady=5)
         ttk.Button(self, text="View Resource Information", command=self.view_resource_info).pack(pady=5)
 
+    @instrumented
     def refresh_resource_list(self):
         """Refreshes the resource listbox with current resources."""
-        self.winfo_children()[1]
-        while self.resource_listbox.size() > 0:
-            self.resource_listbox.delete(0)
-        for resource_name in self.main_app.resources.resources.keys():
-            self.resource_listbox.insert(tk.END, resource_name)
+        self.resource_search.refresh()
 
     def create_resource(self):
         """Handles creation of a new resource."""
-        while True:
-            resource_name = dialog.askstring("Create Resource", "Enter resource name:")
-            if resource_name == None:
-                msgbox.showinfo("Cancelled", "Resource creation cancelled.")
-                return
-            elif resource_name == "":
-                msgbox.showerror("Error", "Resource name cannot be empty.")
-            elif resource_name not in self.main_app.resources.resources:
-                while True:
-                    description = dialog.askstring("Resource Description", "Enter resource description (Optional):") 
-                    if description == None:
-                        msgbox.showinfo("Cancelled", "Resource creation cancelled.")
-                        return
-                    else:
-                        break
-                is_available = msgbox.askyesno("Availability", "Is the resource available?:")
-                if is_available:
-                    availability = True
-                else:
-                    availability = False
-                while True:
-                    is_owned = msgbox.askyesno("Ownership", "Is the resource owned by someone?:")
-                    if is_owned:
-                        owner_name = dialog.askstring("Owner Name", "Enter owner's username:")
-                        if owner_name == None:
-                            msgbox.showinfo("Cancelled", "Resource creation cancelled.")
-                            return
-                        elif owner_name == "":
-                            msgbox.showerror("Error", "Owner name cannot be empty.")
-                        elif owner_name in self.main_app.users.users:
-                            break
-                        else:
-                            msgbox.showerror("Error", "Owner does not exist. Please enter a valid username.")
-                    else:
-                        confirm = msgbox.askyesno("Ownership", "Resource will be editable by anyone. Continue?")
-                        if confirm:
-                            owner_name = None
-                            break
-                        else:
-                            msgbox.showinfo("Understood", "Understood.")
-                self.main_app.resources.resources[resource_name] = {
-                    "description": description,
-                    "available": availability,
-                    "owner": owner_name
-                }
-                msgbox.showinfo("Success", f"Resource '{resource_name}' created successfully.")
-                self.refresh_resource_list()
-                break  
-            else:
-                msgbox.showerror("Error", "Resource already exists.")
+        service = self.main_app.service
+        resource_name = ask_valid("Create Resource", "Enter resource name:", service.require_new_resource_name, "Resource creation cancelled.")
+        if resource_name == None:
+            return
+        description = ask_valid("Resource Description", "Enter resource description (Optional):", lambda text: text, "Resource creation cancelled.")
+        if description == None:
+            return
+        availability = msgbox.askyesno("Availability", "Is the resource available?:")
+        cancel, owner_name = self.main_app.ask_owner("Resource creation cancelled.")
+        if cancel:
+            return
+        try:
+            service.create_resource(resource_name, description, availability, owner_name)
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+            return
+        msgbox.showinfo("Success", f"Resource '{resource_name}' created successfully.")
 
     def edit_resource(self):
         """Handles editing of an existing resource."""
-        if self.resource_listbox.curselection():
-            resource_name = self.resource_listbox.get(self.resource_listbox.curselection())
-            if "owner" in self.main_app.resources.resources[resource_name] == None:
-                while True:
-                    new_resource_name = dialog.askstring("Edit Resource Name", "Enter new resource name:", initialvalue=resource_name)
-                    if new_resource_name == None:
-                        msgbox.showinfo("Cancelled", "Resource edit cancelled.")
-                        return
-                    elif new_resource_name == "":
-                        msgbox.showerror("Error", "Resource name cannot be empty.")
-                    elif new_resource_name != resource_name:
-                        if new_resource_name in self.main_app.resources.resources:
-                            msgbox.showerror("Error", "Resource name already exists.")
-                        else:
-                            old_resource_name = resource_name
-                            resource_name = new_resource_name
-                            break
-                while True:
-                    description = dialog.askstring("Resource Description", "Enter new resource description:", initialvalue=self.main_app.resources.resources[resource_name]["description"])
-                    if description == None:
-                        msgbox.showinfo("Cancelled", "Resource edit cancelled.")
-                        return
-                    else:
-                        break
-                is_available = msgbox.askyesno("Availability", "Is the resource available?:")
-                if is_available:
-                    availability = True
-                else:
-                    availability = False
-                change_owner = msgbox.askyesno("Change Owner", "Do you want to change the owner of this resource?")
-                if change_owner:
-                    while True:
-                        is_owned = msgbox.askyesno("Ownership", "Is the resource owned by someone?:")
-                        if is_owned:
-                            while True:
-                                owner_name = dialog.askstring("Owner Name", "Enter owner's username:", initialvalue=owner)
-                                if owner_name == None:
-                                    msgbox.showinfo("Cancelled", "Resource edit cancelled.")
-                                    return
-                                elif owner_name == "":
-                                    msgbox.showerror("Error", "Owner name cannot be empty.")
-                                elif owner_name in self.main_app.users.users:
-                                    break
-                                else:
-                                    msgbox.showerror("Error", "Owner does not exist. Please enter a valid username.")
-                        else:
-                            confirm = msgbox.askyesno("Ownership", "Resource will be editable by anyone. Continue?")
-                            if confirm:
-                                owner_name = None
-                                break
-                            else:
-                                msgbox.showinfo("Understood", "Understood.")
-                else:
-                    owner_name = self.main_app.resources.resources[resource_name]["owner"]
-                self.main_app.resources.resources[resource_name] = {
-                    "description": description,
-                    "available": availability,
-                    "owner": owner_name,
-                }
-                    #Update bookings with new resource name
-                for booking_name, booking in list(self.main_app.bookings.bookings.items()):
-                    if booking["resource"] == old_resource_name:
-                        self.main_app.bookings.bookings[booking_name]["resource"] = resource_name
-                msgbox.showinfo("Success", f"Resource '{resource_name}' edited successfully.")
-            else:
-                owner = self.main_app.resources.resources[resource_name]["owner"]
-                cancel = self.main_app.users.log_in(owner, "edit resource", "Resource edit")
+        resource_name = self.resource_list.selected()
+        if resource_name is not None:
+            owner = self.main_app.resources.resources[resource_name]["owner"]
+            #Unowned resources are editable by anyone, owned ones need the owner's password
+            if owner is not None:
+                cancel = self.main_app.log_in(owner, "edit resource", "Resource edit")
                 if cancel is True:
                     return
-                while True:    
-                    new_resource_name = dialog.askstring("Edit Resource Name", "Enter new resource name:", initialvalue=resource_name)
-                    if new_resource_name == None:
-                        msgbox.showinfo("Cancelled", "Resource edit cancelled.")
-                        return
-                    elif new_resource_name == "":
-                        msgbox.showerror("Error", "Resource name cannot be empty.")
-                    elif new_resource_name != resource_name:
-                        if new_resource_name in self.main_app.resources.resources:
-                            msgbox.showerror("Error", "Resource name already exists.")
-                        else:
-                            old_resource_name = resource_name
-                            resource_name = new_resource_name
-                            break
-                    else:
-                        old_resource_name = resource_name
-                        break
-                while True:
-                    description = dialog.askstring("Resource Description", "Enter new resource description:", initialvalue=self.main_app.resources.resources[resource_name]["description"])
-                    if description == None:
-                        msgbox.showinfo("Cancelled", "Resource edit cancelled.")
-                        return
-                    else:
-                        break
-                is_available = msgbox.askyesno("Availability", "Is the resource available?:")
-                if is_available:
-                    availability = True
-                else:
-                    availability = False
-                change_owner = msgbox.askyesno("Change Owner", "Do you want to change the owner of this resource?")
-                if change_owner:    
-                    is_owned = msgbox.askyesno("Ownership", "Is the resource owned by someone?:")
-                    if is_owned:
-                        while True:
-                            owner_name = dialog.askstring("Owner Name", "Enter owner's username:", initialvalue=owner)
-                            if owner_name == None:
-                                msgbox.showinfo("Cancelled", "Resource edit cancelled.")
-                                return
-                            elif owner_name == "":
-                                msgbox.showerror("Error", "Owner name cannot be empty.")
-                            elif owner_name in self.main_app.users.users:
-                                break
-                            else:
-                                msgbox.showerror("Error", "Owner does not exist. Please enter a valid username.")
-                else:
-                    owner_name = self.main_app.resources.resources[resource_name]["owner"]
-                self.main_app.resources.resources[resource_name] = {
-                    "description": description,
-                    "available": availability,
-                    "owner": owner_name,
-                }
-                #Update bookings again
-                for booking_name, booking in list(self.main_app.bookings.bookings.items()):
-                    if booking["resource"] == old_resource_name:
-                        self.main_app.bookings.bookings[booking_name]["resource"] = resource_name
-                msgbox.showinfo("Success", f"Resource '{resource_name}' edited successfully.")
+            service = self.main_app.service
+            new_resource_name = ask_valid("Edit Resource Name", "Enter new resource name:", lambda name: service.require_new_resource_name(name, current=resource_name), "Resource edit cancelled.", initialvalue=resource_name)
+            if new_resource_name == None:
+                return
+            description = ask_valid("Resource Description", "Enter new resource description:", lambda text: text, "Resource edit cancelled.", initialvalue=self.main_app.resources.resources[resource_name]["description"])
+            if description == None:
+                return
+            availability = msgbox.askyesno("Availability", "Is the resource available?:")
+            owner_name = UNCHANGED
+            change_owner = msgbox.askyesno("Change Owner", "Do you want to change the owner of this resource?")
+            if change_owner:
+                cancel, owner_name = self.main_app.ask_owner("Resource edit cancelled.", owner)
+                if cancel:
+                    return
+            try:
+                service.edit_resource(resource_name, new_resource_name, description, availability, owner_name)
+            except BookingError as error:
+                msgbox.showerror("Error", str(error))
+                return
+            msgbox.showinfo("Success", f"Resource '{new_resource_name}' edited successfully.")
         else:
             msgbox.showerror("Error", "No resource selected for editing.")
 
     def delete_resource(self):
         """Handles deletion of a resource."""
-        if self.resource_listbox.curselection():
-            resource_name = self.resource_listbox.get(self.resource_listbox.curselection())
-            if "owner" in self.main_app.resources.resources[resource_name] == None:
-                confirm = msgbox.askyesno("Confirm Delete", f"Are you sure you want to delete resource '{resource_name}'?")
-                if confirm:
-                    del self.main_app.resources.resources[resource_name]
-                    self.main_app.booking.delete_resource_bookings(resource_name)
-                    msgbox.showinfo("Success", f"Resource '{resource_name}' deleted successfully.")
-                else:
-                    msgbox.showinfo("Cancelled", "Resource deletion cancelled.")
-            else:
-                owner = self.main_app.resources.resources[resource_name]["owner"]
-                cancel = self.main_app.users.log_in(owner, "delete resource", "Resource deletion")
+        resource_name = self.resource_list.selected()
+        if resource_name is not None:
+            owner = self.main_app.resources.resources[resource_name]["owner"]
+            if owner is not None:
+                cancel = self.main_app.log_in(owner, "delete resource", "Resource deletion")
                 if cancel is True:
                     return
-                confirm = msgbox.askyesno("Confirm Delete", f"Are you sure you want to delete resource '{resource_name}'?")
-                if confirm:
-                    del self.main_app.resources.resources[resource_name]
-                    self.main_app.bookings.remove_resource_bookings(resource_name)
-                    msgbox.showinfo("Success", f"Resource '{resource_name}' deleted successfully.")
-                else:
-                    msgbox.showinfo("Cancelled", "Resource deletion cancelled.")
+            confirm = msgbox.askyesno("Confirm Delete", f"Are you sure you want to delete resource '{resource_name}'?")
+            if confirm:
+                try:
+                    self.main_app.service.delete_resource(resource_name)
+                except BookingError as error:
+                    msgbox.showerror("Error", str(error))
+                    return
+                msgbox.showinfo("Success", f"Resource '{resource_name}' deleted successfully.")
+            else:
+                msgbox.showinfo("Cancelled", "Resource deletion cancelled.")
         else:
             msgbox.showerror("Error", "No resource selected for deletion.")
     
@@ -592,16 +519,12 @@ class ResourcePage(ttk.Frame):
         ttk.Label(frame, text="Resource Information", font=("Arial", 12)).pack(pady=(0, 15))
         
         columns = ("Resource Name", "Description", "Available", "Owner")
-        tree = ttk.Treeview(frame, columns=columns, show="headings")
-        tree.heading("Resource Name", text="Resource Name")
-        tree.heading("Description", text="Description")
-        tree.heading("Available", text="Available")
-        tree.heading("Owner", text="Owner")
-        tree.pack(fill="both", expand=True)
-
-        # Insert resource data into the grid
-        for resource_name, info in self.main_app.resources.resources.items():
-            tree.insert("", "end", values=(resource_name, info.get("description", ""), info.get("available", False), info.get("owner", "None")))
+        resources = self.main_app.resources.resources
+        # Rows are only built for the resources scrolled into view
+        table = VirtualTreeview(frame, columns, lambda resource_name: (resource_name, resources[resource_name].get("description", ""),
+            resources[resource_name].get("available", False), resources[resource_name].get("owner", "None")))
+        table.pack(fill="both", expand=True)
+        table.set_keys(resources.keys())
 
 class BookerPage(ttk.Frame):
     """Booking management page for creating, editing, deleting, and viewing bookings."""
@@ -611,8 +534,10 @@ class BookerPage(ttk.Frame):
         super().__init__(parent, padding=10)
         self.main_app = main_app
         tk.Label(self, text="Booking System", font=("Arial", 12)).pack(pady=5)
-        self.booking_listbox = tk.Listbox(self, height=10, selectmode=tk.SINGLE)
-        self.booking_listbox.pack(fill="x", padx=5, pady=5)
+        self.booking_list = VirtualListbox(self, height=10)
+        self.booking_list.pack(fill="x", padx=5, pady=5)
+        self.booking_search = SearchBox(self, self.booking_list, self.main_app.bookings, lambda: self.main_app.bookings.bookings.keys())
+        self.booking_search.pack(fill="x", padx=5, before=self.booking_list)
         self.refresh_booking_list()
 
         ttk.Button(self, text="Create Booking", command=self.create_booking).pack(pady=5)
@@ -620,229 +545,108 @@ class BookerPage(ttk.Frame):
         ttk.Button(self, text="Delete Booking", command=self.delete_booking).pack(pady=5)
         ttk.Button(self, text="Refresh Booking List", command=self.refresh_booking_list).pack(pady=5)
         ttk.Button(self, text="View Booking Information", command=self.view_booking_info).pack(pady=5)
+        ttk.Button(self, text="Find Free Windows", command=self.find_free_windows).pack(pady=5)
+        ttk.Button(self, text="Booking History", command=self.view_booking_history).pack(pady=5)
+        ttk.Button(self, text="Join Waitlist", command=self.join_waitlist).pack(pady=5)
+        ttk.Button(self, text="Leave Waitlist", command=self.leave_waitlist).pack(pady=5)
+        ttk.Button(self, text="View Waitlist", command=self.view_waitlist).pack(pady=5)
         
+    @instrumented
     def refresh_booking_list(self):
         """Refreshes the booking listbox with current bookings."""
-        self.winfo_children()[1]
-        while self.booking_listbox.size() > 0:
-            self.booking_listbox.delete(0)
-        for booking_name in self.main_app.bookings.bookings.keys():
-            self.booking_listbox.insert(tk.END, booking_name)
+        self.booking_search.refresh()
 
     def create_booking(self):
         """Handles creation of a new booking."""
-        while True:
-            booking_name = dialog.askstring("Create Booking", "Enter booking name:")
-            if booking_name == None:
-                msgbox.showinfo("Cancelled", "Booking creation cancelled.")
-                return
-            elif booking_name == "":
-                msgbox.showerror("Error", "Booking name cannot be empty.")
-            elif booking_name not in self.main_app.bookings.bookings:
-                while True:
-                    user_name = dialog.askstring("User Name", "Enter username for booking:")
-                    if user_name == None:
-                        msgbox.showinfo("Cancelled", "Booking creation cancelled.")
-                        return
-                    elif user_name == "":
-                        msgbox.showerror("Error", "Username cannot be empty.")
-                    elif user_name in self.main_app.users.users:
-                        cancel = self.main_app.users.log_in(user_name, "create booking", "Booking creation")
-                        if cancel is True:
-                            return
-                        else:
-                            break
-                    else:
-                        msgbox.showerror("Error", "User does not exist. Please enter a valid username.")
-                while True:
-                    resource_name = dialog.askstring("Resource Name", "Enter resource name to book:")
-                    if resource_name == None:
-                        msgbox.showinfo("Cancelled", "Booking creation cancelled.")
-                        return
-                    elif resource_name == "":
-                        msgbox.showerror("Error", "Resource name cannot be empty.")
-                    elif resource_name in self.main_app.resources.resources:
-                        if self.main_app.resources.resources[resource_name]["available"]:
-                            break
-                        else:
-                            msgbox.showerror("Error", "Resource is not available for booking.")
-                    else:
-                        msgbox.showerror("Error", "Resource does not exist. Please enter a valid resource name.")
-                while True:
-                    booking_start_date = dialog.askstring("Booking Date", "Enter booking date (YYYY-MM-DD):")
-                    if booking_start_date == None:
-                        msgbox.showinfo("Cancelled", "Booking creation cancelled.")
-                        return
-                    elif booking_start_date == "":
-                        msgbox.showerror("Error", "Booking date cannot be empty.")
-                    else:
-                        try:
-                            booking_start_date = datetime.datetime.strptime(booking_start_date, "%Y-%m-%d").date()
-                            if booking_start_date < datetime.date.today():
-                                msgbox.showerror("Error", "Booking date cannot be in the past.")
-                            else:
-                                #Check if resource is already booked for date
-                                booked_dates = [
-                                    datetime.datetime.strptime(d, "%Y-%m-%d").date()
-                                    if isinstance(d, str) else d
-                                    for d in self.main_app.resources.resources[resource_name]["days_booked"]
-                                ]
-                                if booking_start_date in booked_dates:
-                                    msgbox.showerror("Error", "Resource is already booked for this date.")
-                                else:  
-                                    break
-                        except ValueError:
-                            msgbox.showerror("Error", "Invalid date format. Please use YYYY-MM-DD.")
-                while True:
-                    booking_end_date = dialog.askstring("Booking Date", "Enter booking end date (YYYY-MM-DD):")
-                    if booking_end_date == None:
-                        msgbox.showinfo("Cancelled", "Booking creation cancelled.")
-                        return
-                    elif booking_end_date == "":
-                        msgbox.showerror("Error", "Booking end date cannot be empty.")
-                    else:
-                        try:
-                            booking_end_date = datetime.datetime.strptime(booking_end_date, "%Y-%m-%d").date()
-                            if booking_end_date <= booking_start_date:
-                                msgbox.showerror("Error", "End date must be after start date.")
-                            else:
-                                #Check if resource is already booked for date again
-                                booked_dates = [
-                                    datetime.datetime.strptime(d, "%Y-%m-%d").date()
-                                    if isinstance(d, str) else d
-                                    for d in self.main_app.resources.resources[resource_name]["days_booked"]
-                                ]
-                                if booking_end_date in booked_dates:
-                                    msgbox.showerror("Error", "Resource is already booked for this date.")
-                                else:
-                                    break
-                        except ValueError:
-                            msgbox.showerror("Error", "Invalid date format. Please use YYYY-MM-DD.")
-                #Update resource availability
-                days_booked = [(booking_start_date + datetime.timedelta(days=i)).isoformat()
-                    for i in range((booking_end_date - booking_start_date).days + 1)]
-                self.main_app.resources.resources[resource_name]["days_booked"].extend(days_booked)
-                self.main_app.bookings.bookings[booking_name] = {
-                    "owner": user_name,
-                    "resource": resource_name,
-                    "start_date": booking_start_date.isoformat(),
-                    "end_date": booking_end_date.isoformat(),
-                }
-                msgbox.showinfo("Success", f"Booking '{booking_name}' created successfully.")
-                self.refresh_booking_list()
-                break
-            else:
-                msgbox.showerror("Error", "Booking does not exist.")
+        service = self.main_app.service
+        booking_name = ask_valid("Create Booking", "Enter booking name:", service.require_new_booking_name, "Booking creation cancelled.")
+        if booking_name == None:
+            return
+        user_name = ask_valid("User Name", "Enter username for booking:", service.require_user, "Booking creation cancelled.")
+        if user_name == None:
+            return
+        cancel = self.main_app.log_in(user_name, "create booking", "Booking creation")
+        if cancel is True:
+            return
+        resource_name = ask_valid("Resource Name", "Enter resource name to book:", service.require_bookable_resource, "Booking creation cancelled.")
+        if resource_name == None:
+            return
+        booking_start_date = ask_valid("Booking Date", "Enter booking date (YYYY-MM-DD):", lambda text: service.check_start_date(resource_name, text), "Booking creation cancelled.")
+        if booking_start_date == None:
+            return
+        booking_end_date = ask_valid("Booking Date", "Enter booking end date (YYYY-MM-DD):", lambda text: service.check_end_date(resource_name, booking_start_date, text), "Booking creation cancelled.")
+        if booking_end_date == None:
+            return
+        repeat = self.ask_repeat("Booking creation cancelled.")
+        if repeat == False:
+            return
+        try:
+            service.create_booking(booking_name, user_name, resource_name, booking_start_date, booking_end_date, repeat)
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+            return
+        msgbox.showinfo("Success", f"Booking '{booking_name}' created successfully.")
+
+    def ask_repeat(self, cancel_message):
+        """Asks how a booking repeats; returns a repeat rule, None for a single booking, or False if cancelled."""
+        every = ask_valid("Repeat", "Repeat daily, weekly or monthly? (Leave blank for a single booking):",
+            lambda text: text.strip().lower(), cancel_message)
+        if every == None:
+            return False
+        if not every:
+            return None
+        limit = ask_valid("Repeat", "Repeat how many times, or until which date (YYYY-MM-DD)?:", lambda text: text.strip(), cancel_message)
+        if limit == None:
+            return False
+        return {"every": every, "count": limit} if limit.isdigit() else {"every": every, "until": limit}
 
     def edit_booking(self):
         """Handles editing of an existing booking."""
-        if self.booking_listbox.curselection():
-            booking_name = self.booking_listbox.get(self.booking_listbox.curselection())
+        booking_name = self.booking_list.selected()
+        if booking_name is not None:
             user_name = self.main_app.bookings.bookings[booking_name]["owner"]
-            cancel = self.main_app.users.log_in(user_name, "edit booking", "Booking edit")
+            cancel = self.main_app.log_in(user_name, "edit booking", "Booking edit")
             if cancel is False: 
-                while True:
-                    new_booking_name = dialog.askstring("Edit Booking Name", "Enter new booking name:", initialvalue=booking_name)
-                    if new_booking_name == None:
-                        msgbox.showinfo("Cancelled", "Booking edit cancelled.")
-                        return
-                    elif new_booking_name == "":
-                        msgbox.showerror("Error", "Booking name cannot be empty.")
-                    elif new_booking_name != booking_name:
-                        if new_booking_name in self.main_app.bookings.bookings:
-                            msgbox.showerror("Error", "Booking name already exists.")
-                        else:
-                            booking_name = new_booking_name
-                            break
-                    else:
-                        break
-                resource_name = self.main_app.bookings.bookings[booking_name]["resource"]
-                while True:
-                    new_resource_name = dialog.askstring("Resource Name", "Enter new resource name:", initialvalue=resource_name)
-                    if new_resource_name in self.main_app.resources.resources:
-                        if self.main_app.resources.resources[new_resource_name]["available"]:
-                            resource_name = new_resource_name
-                            break
-                        else:
-                            msgbox.showerror("Error", "Resource is not available for booking.")
-                    else:
-                        msgbox.showerror("Error", "Resource does not exist. Please enter a valid resource name.")
-                old_start_date = datetime.datetime.strptime(self.main_app.bookings.bookings[booking_name]["start_date"], "%Y-%m-%d").date()
-                old_end_date = datetime.datetime.strptime(self.main_app.bookings.bookings[booking_name]["end_date"], "%Y-%m-%d").date()
-                booking_range = [
-                    (old_start_date + datetime.timedelta(days=i)).isoformat()
-                    for i in range((old_end_date - old_start_date).days + 1)
-                ]
-                booked_dates = self.main_app.bookings.get_booked_dates(resource_name)
-                while True:
-                    booking_start_date = dialog.askstring("Booking Date", "Enter new booking start date (YYYY-MM-DD):")
-                    if booking_start_date is None:
-                        msgbox.showinfo("Cancelled", "Booking edit cancelled.")
-                        return
-                    elif booking_start_date == "":
-                        msgbox.showerror("Error", "Booking start date cannot be empty.")
-                    else:
-                        try:
-                            booking_start_date = datetime.datetime.strptime(booking_start_date, "%Y-%m-%d").date()
-                            if booking_start_date < datetime.date.today():
-                                msgbox.showerror("Error", "Booking date cannot be in the past.")
-                            elif booking_start_date in booking_range:
-                                #Allow booking within old range
-                                break
-                            else:
-                                if booking_start_date in booked_dates:
-                                    msgbox.showerror("Error", "Resource is already booked for this date.")
-                                else:
-                                    break
-                        except ValueError:
-                            msgbox.showerror("Error", "Invalid date format. Please use YYYY-MM-DD.")
-                while True:
-                    booking_end_date = dialog.askstring("Booking Date", "Enter new booking end date (YYYY-MM-DD):")
-                    if booking_end_date == None:
-                        msgbox.showinfo("Cancelled", "Booking edit cancelled.")
-                        return
-                    elif booking_end_date == "":
-                        msgbox.showerror("Error", "Booking end date cannot be empty.")
-                    else:
-                        try:
-                            booking_end_date = datetime.datetime.strptime(booking_end_date, "%Y-%m-%d").date()
-                            if booking_end_date <= booking_start_date:
-                                msgbox.showerror("Error", "End date must be after start date.")
-                            elif booking_end_date in booking_range:
-                                #Allow booking within old range again
-                                break
-                            else:
-                                if booking_end_date in booked_dates:
-                                    msgbox.showerror("Error", "Resource is already booked for this date.")
-                                else:
-                                    break
-                        except ValueError:
-                            msgbox.showerror("Error", "Invalid date format. Please use YYYY-MM-DD.") 
-                    self.main_app.bookings.bookings[booking_name] = {
-                        "owner": user_name,
-                        "resource": resource_name,
-                        "start_date": booking_start_date.isoformat(),
-                        "end_date": booking_end_date.isoformat(),
-                    }
-                    msgbox.showinfo("Success", f"Booking '{booking_name}' edited successfully.")
+                service = self.main_app.service
+                new_booking_name = ask_valid("Edit Booking Name", "Enter new booking name:", lambda name: service.require_new_booking_name(name, current=booking_name), "Booking edit cancelled.", initialvalue=booking_name)
+                if new_booking_name == None:
+                    return
+                resource_name = ask_valid("Resource Name", "Enter new resource name:", service.require_bookable_resource, "Booking edit cancelled.", initialvalue=self.main_app.bookings.bookings[booking_name]["resource"])
+                if resource_name == None:
+                    return
+                #The booking being edited never conflicts with itself
+                booking_start_date = ask_valid("Booking Date", "Enter new booking start date (YYYY-MM-DD):", lambda text: service.check_start_date(resource_name, text, exclude=booking_name), "Booking edit cancelled.")
+                if booking_start_date == None:
+                    return
+                booking_end_date = ask_valid("Booking Date", "Enter new booking end date (YYYY-MM-DD):", lambda text: service.check_end_date(resource_name, booking_start_date, text, exclude=booking_name), "Booking edit cancelled.")
+                if booking_end_date == None:
+                    return
+                try:
+                    promoted = service.edit_booking(booking_name, new_booking_name, resource_name, booking_start_date, booking_end_date)
+                except BookingError as error:
+                    msgbox.showerror("Error", str(error))
+                    return
+                msgbox.showinfo("Success", f"Booking '{new_booking_name}' edited successfully." + describe_promoted(promoted))
         else:
             msgbox.showerror("Error", "No booking selected for editing.")
                   
     def delete_booking(self):
         """Handles deletion of a booking."""
-        if self.booking_listbox.curselection():
-            booking_name = self.booking_listbox.get(self.booking_listbox.curselection())
+        booking_name = self.booking_list.selected()
+        if booking_name is not None:
             user_name = self.main_app.bookings.bookings[booking_name]["owner"]
-            cancel = self.main_app.users.log_in(user_name, "delete booking", "Booking deletion")
+            cancel = self.main_app.log_in(user_name, "delete booking", "Booking deletion")
             if cancel is False:
                 confirm = msgbox.askyesno("Confirm Delete", f"Are you sure you want to delete booking '{booking_name}'?")
                 if confirm:
-                    del self.main_app.bookings.bookings[booking_name]   
-                    msgbox.showinfo("Success", f"Booking '{booking_name}' deleted successfully.")
+                    try:
+                        promoted = self.main_app.service.delete_booking(booking_name)
+                    except BookingError as error:
+                        msgbox.showerror("Error", str(error))
+                        return
+                    msgbox.showinfo("Success", f"Booking '{booking_name}' deleted successfully." + describe_promoted(promoted))
                 else:
                     msgbox.showinfo("Cancelled", "Booking deletion cancelled.")
-            else:
-                pass
         else:
             msgbox.showerror("Error", "No booking selected for deletion.")
     
@@ -857,20 +661,163 @@ class BookerPage(ttk.Frame):
         
         ttk.Label(frame, text="Booking Information", font=("Arial", 12)).pack(pady=(0, 15))
         
-        columns = ("Booking Name", "User", "Resource", "Start Date", "End Date")
-        tree = ttk.Treeview(frame, columns=columns, show="headings")
-        tree.heading("Booking Name", text="Booking Name")
-        tree.heading("User", text="User")
-        tree.heading("Resource", text="Resource")
-        tree.heading("Start Date", text="Start Date")
-        tree.heading("End Date", text="End Date")
-        tree.pack(fill="both", expand=True)
-
-        # Insert booking data into the grid
-        for booking_name, info in self.main_app.bookings.bookings.items():
-            tree.insert("", "end", values=(booking_name, info["owner"], info["resource"], info["start_date"], info["end_date"]))
+        columns = ("Booking Name", "User", "Resource", "Start Date", "End Date", "Repeats")
+        bookings = self.main_app.bookings.bookings
+        # Rows are only built for the bookings scrolled into view
+        table = VirtualTreeview(frame, columns, lambda booking_name: (booking_name, bookings[booking_name]["owner"], bookings[booking_name]["resource"],
+            bookings[booking_name]["start_date"], bookings[booking_name]["end_date"], describe_repeat(bookings[booking_name].get("repeat"))))
+        table.pack(fill="both", expand=True)
+        table.set_keys(bookings.keys())
         
+    def view_booking_history(self):
+        """Pages through past bookings, which a lazy store only reads from disk when asked."""
+        dialog_window = tk.Toplevel(self)
+        dialog_window.title("Booking History")
+        dialog_window.grab_set()
+
+        frame = ttk.Frame(dialog_window, padding="15")
+        frame.pack(fill="both", expand=True)
+
+        ttk.Label(frame, text="Booking History", font=("Arial", 12)).pack(pady=(0, 15))
+
+        columns = ("Booking Name", "User", "Resource", "Start Date", "End Date")
+        page_bookings = {}
+        table = VirtualTreeview(frame, columns, lambda booking_name: (booking_name, page_bookings[booking_name]["owner"], page_bookings[booking_name]["resource"],
+            page_bookings[booking_name]["start_date"], page_bookings[booking_name]["end_date"]))
+        table.pack(fill="both", expand=True)
+
+        page_frame = ttk.Frame(frame)
+        page_frame.pack(fill="x", pady=(10, 0))
+        page_label = ttk.Label(page_frame)
+        current_page = 0
+        def show_page(page):
+            nonlocal current_page
+            rows = self.main_app.bookings.history(page=page, page_size=100)
+            if page > 0 and not rows:
+                return
+            current_page = page
+            page_bookings.clear()
+            page_bookings.update(rows)
+            table.set_keys(booking_name for booking_name, _ in rows)
+            page_label.config(text=f"Page {page + 1}")
+        ttk.Button(page_frame, text="Previous", command=lambda: show_page(max(current_page - 1, 0))).pack(side="left")
+        page_label.pack(side="left", padx=20)
+        ttk.Button(page_frame, text="Next", command=lambda: show_page(current_page + 1)).pack(side="left")
+        show_page(0)
+
+    def join_waitlist(self):
+        """Queues a request for booked dates, to be booked automatically when they free up."""
+        service = self.main_app.service
+        request_name = ask_valid("Join Waitlist", "Enter booking name to use once the dates free up:", service.require_new_booking_name, "Waitlist request cancelled.")
+        if request_name == None:
+            return
+        user_name = ask_valid("User Name", "Enter username for the request:", service.require_user, "Waitlist request cancelled.")
+        if user_name == None:
+            return
+        cancel = self.main_app.log_in(user_name, "join the waitlist", "Waitlist request")
+        if cancel is True:
+            return
+        resource_name = ask_valid("Resource Name", "Enter resource name to wait for:", service.require_bookable_resource, "Waitlist request cancelled.")
+        if resource_name == None:
+            return
+        start_date = ask_valid("Booking Date", "Enter wanted start date (YYYY-MM-DD):", service.parse_date, "Waitlist request cancelled.")
+        if start_date == None:
+            return
+        end_date = ask_valid("Booking Date", "Enter wanted end date (YYYY-MM-DD):", service.parse_date, "Waitlist request cancelled.")
+        if end_date == None:
+            return
+        try:
+            service.join_waitlist(request_name, user_name, resource_name, start_date, end_date)
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+            return
+        position = self.main_app.bookings.waitlist.queue(resource_name).index(request_name) + 1
+        msgbox.showinfo("Success", f"'{request_name}' is number {position} on the waitlist for {resource_name}.")
+
+    def leave_waitlist(self):
+        """Withdraws a waiting request after its owner logs in."""
+        waitlist = self.main_app.bookings.waitlist
+        def require_request(request_name):
+            if request_name not in waitlist.requests:
+                raise NotFoundError("Waiting request does not exist.")
+            return request_name
+        request_name = ask_valid("Leave Waitlist", "Enter the waiting request's booking name:", require_request, "Withdrawal cancelled.")
+        if request_name == None:
+            return
+        cancel = self.main_app.log_in(waitlist.requests[request_name]["owner"], "leave the waitlist", "Withdrawal")
+        if cancel is True:
+            return
+        try:
+            self.main_app.service.leave_waitlist(request_name)
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+            return
+        msgbox.showinfo("Success", f"'{request_name}' has left the waitlist.")
+
+    def view_waitlist(self):
+        """Lists the waiting requests, oldest first."""
+        dialog_window = tk.Toplevel(self)
+        dialog_window.title("Waitlist")
+        dialog_window.grab_set()
+
+        frame = ttk.Frame(dialog_window, padding="15")
+        frame.pack(fill="both", expand=True)
+
+        ttk.Label(frame, text="Waitlist", font=("Arial", 12)).pack(pady=(0, 15))
+
+        columns = ("Booking Name", "User", "Resource", "Start Date", "End Date", "Requested")
+        waitlist = self.main_app.bookings.waitlist
+        requests = waitlist.requests
+        table = VirtualTreeview(frame, columns, lambda request_name: (request_name, requests[request_name]["owner"], requests[request_name]["resource"],
+            requests[request_name]["start_date"], requests[request_name]["end_date"], requests[request_name]["requested_at"][:16].replace("T", " ")))
+        table.pack(fill="both", expand=True)
+        table.set_keys(waitlist.queue())
+
+    def find_free_windows(self):
+        """Asks for a date range, window length and resource filter, then lists the earliest free windows."""
+        service = self.main_app.service
+        start_date = ask_valid("Find Free Windows", "Search from date (YYYY-MM-DD):", service.parse_date, "Search cancelled.",
+            initialvalue=datetime.date.today().isoformat())
+        if start_date == None:
+            return
+        end_date = ask_valid("Find Free Windows", "Search until date (YYYY-MM-DD):", service.parse_date, "Search cancelled.",
+            initialvalue=(start_date + datetime.timedelta(days=30)).isoformat())
+        if end_date == None:
+            return
+        length = ask_valid("Find Free Windows", "Window length in days:", lambda text: service.parse_number(text, 2, "Window length"), "Search cancelled.")
+        if length == None:
+            return
+        matching = ask_valid("Find Free Windows", "Only resources containing (Optional):", lambda text: text, "Search cancelled.")
+        if matching == None:
+            return
+        try:
+            windows = service.find_free_windows(start_date, end_date, length, count=20, matching=matching)
+        except BookingError as error:
+            msgbox.showerror("Error", str(error))
+            return
+        if not windows:
+            msgbox.showinfo("Find Free Windows", "No free windows found.")
+            return
+
+        dialog_window = tk.Toplevel(self)
+        dialog_window.title("Free Windows")
+        dialog_window.grab_set()
+
+        frame = ttk.Frame(dialog_window, padding="15")
+        frame.pack(fill="both", expand=True)
+
+        ttk.Label(frame, text="Free Windows", font=("Arial", 12)).pack(pady=(0, 15))
+
+        table = VirtualTreeview(frame, ("Resource", "Start Date", "End Date"), lambda i: windows[i])
+        table.pack(fill="both", expand=True)
+        table.set_keys(range(len(windows)))
+
 if __name__ == "__main__":
-    """Entry point for the application."""
+    """Entry point for the application; with a subcommand (see cli.py) it runs headless instead of starting the GUI."""
+    if len(sys.argv) > 1:
+        #Imported only here, so starting the GUI does not load the server, analytics and integrity modules
+        import cli
+        sys.exit(cli.main(sys.argv[1:]))
+    METRICS.enable_from_environment()
     MyApp = App()
     MyApp.mainloop()
\ No newline at end of file
@@ -0,0 +1,2308 @@
+import json
+import re
+import datetime
+import bisect
+import calendar
+import heapq
+import itertools
+import os
+import sqlite3
+import contextlib
+import hashlib
+import hmac
+import secrets
+import time
+import collections
+import gzip
+import functools
+import atexit
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class Metrics:
+    """Opt-in call counts, latency histograms and bytes written per operation, exportable as JSON or Prometheus text."""
+    #Upper bounds in seconds of the latency histogram buckets; slower calls land in a final overflow bucket
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        """Initializes disabled, empty metrics."""
+        self.enabled = False
+        self.operations = {}
+
+    def operation(self, name):
+        """Returns the stats dict for an operation, creating it on first use."""
+        if name not in self.operations:
+            self.operations[name] = {"count": 0, "seconds": 0.0, "buckets": [0] * (len(self.BUCKETS) + 1), "bytes_written": 0}
+        return self.operations[name]
+
+    def record(self, name, seconds):
+        """Records one call of an operation taking seconds."""
+        stats = self.operation(name)
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        stats["buckets"][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def record_bytes(self, name, count):
+        """Adds count bytes written to an operation."""
+        self.operation(name)["bytes_written"] += count
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Times the enclosed block as one call of an operation when metrics are enabled."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def to_json(self):
+        """Returns the metrics as a JSON-ready dict with the bucket bounds alongside each histogram."""
+        return {"buckets": list(self.BUCKETS), "operations": self.operations}
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = ["# TYPE booking_operation_seconds histogram"]
+        for name, stats in sorted(self.operations.items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ("+Inf",), stats["buckets"]):
+                cumulative += count
+                lines.append(f'booking_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'booking_operation_seconds_sum{{operation="{name}"}} {stats["seconds"]}')
+            lines.append(f'booking_operation_seconds_count{{operation="{name}"}} {stats["count"]}')
+        lines.append("# TYPE booking_bytes_written_total counter")
+        for name, stats in sorted(self.operations.items()):
+            if stats["bytes_written"]:
+                lines.append(f'booking_bytes_written_total{{operation="{name}"}} {stats["bytes_written"]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, filepath):
+        """Writes the metrics to filepath, as JSON if it ends in .json and as Prometheus text otherwise."""
+        with open(filepath, "w") as file:
+            if filepath.endswith(".json"):
+                json.dump(self.to_json(), file, indent=4)
+            else:
+                file.write(self.to_prometheus())
+
+    def enable_from_environment(self, variable="BOOKING_METRICS"):
+        """Enables metrics if the environment variable names an export file, which is written at exit."""
+        filepath = os.environ.get(variable)
+        if filepath:
+            self.enabled = True
+            atexit.register(self.export, filepath)
+
+METRICS = Metrics()
+
+def instrumented(function):
+    """Decorator recording each call of function in METRICS under its qualified name; only a flag check when disabled."""
+    name = function.__qualname__
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not METRICS.enabled:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            METRICS.record(name, time.perf_counter() - start)
+    return wrapper
+
+#Record fields copied into their own indexed column for each SQLite table
+SQLITE_TABLES = {
+    "users": (),
+    "resources": ("owner",),
+    "bookings": ("owner", "resource", "start_date", "end_date"),
+    "waitlist": ("owner", "resource"),
+}
+
+class JsonCodec:
+    """Encodes a dict of records as JSON with the standard library, compact unless an indent is given."""
+    binary = False
+
+    def __init__(self, indent=None):
+        """Initializes the codec; indent=4 gives the older, readable but larger format."""
+        self.indent = indent
+        self.name = "json" if indent is None else "json_indented"
+
+    def dumps(self, records):
+        """Returns records encoded as bytes."""
+        if self.indent is None:
+            return json.dumps(records, separators=(",", ":"), ensure_ascii=False).encode()
+        return json.dumps(records, indent=self.indent).encode()
+
+    def loads(self, data):
+        """Returns the records decoded from bytes; raises ValueError if they are invalid."""
+        return json.loads(data)
+
+class OrjsonCodec:
+    """Encodes a dict of records as compact JSON with orjson, several times faster than the standard library."""
+    binary = False
+    name = "orjson"
+
+    def dumps(self, records):
+        """Returns records encoded as bytes."""
+        return orjson.dumps(records)
+
+    def loads(self, data):
+        """Returns the records decoded from bytes; raises ValueError if they are invalid."""
+        return orjson.loads(data)
+
+class MsgpackCodec:
+    """Encodes a dict of records as MessagePack; smaller than JSON, but the files are binary and not JSON."""
+    binary = True
+    name = "msgpack"
+
+    def dumps(self, records):
+        """Returns records encoded as bytes."""
+        return msgpack.packb(records)
+
+    def loads(self, data):
+        """Returns the records decoded from bytes; raises ValueError if they are invalid."""
+        return msgpack.unpackb(data)
+
+def available_codecs():
+    """Returns an instance of every codec usable in this Python, the standard library ones first."""
+    codecs = [JsonCodec(indent=4), JsonCodec()]
+    if orjson is not None:
+        codecs.append(OrjsonCodec())
+    if msgpack is not None:
+        codecs.append(MsgpackCodec())
+    return codecs
+
+#JSON stores use the fastest JSON codec available; both write the same compact JSON
+DEFAULT_CODEC = OrjsonCodec() if orjson is not None else JsonCodec()
+
+def encode_record(record):
+    """Returns the canonical text of one record, used to spot changed records and as SQLite and journal data."""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def diff_records(saved, records, keys=None):
+    """Compares records with their last saved serialized form and returns (changed, removed).
+
+    With keys given, only those records are compared, so the untouched ones are not serialized again."""
+    changed = {}
+    if keys is None:
+        for key, record in records.items():
+            data = encode_record(record)
+            if saved.get(key) != data:
+                changed[key] = data
+        return changed, [key for key in saved if key not in records]
+    removed = []
+    for key in keys:
+        if key in records:
+            data = encode_record(records[key])
+            if saved.get(key) != data:
+                changed[key] = data
+        elif key in saved:
+            removed.append(key)
+    return changed, removed
+
+class SaveConflictError(Exception):
+    """Raised when a save finds records that another process changed differently since this one loaded them."""
+    def __init__(self, filepath, keys):
+        """Records the file and the conflicting record keys."""
+        super().__init__(f"{filepath} was changed by another program: {', '.join(keys)}")
+        self.filepath = filepath
+        self.keys = keys
+
+@contextlib.contextmanager
+def file_lock(filepath, exclusive=True):
+    """Holds an advisory lock on the directory containing filepath; a no-op where fcntl is unavailable."""
+    if fcntl is None:
+        yield
+        return
+    #Saves replace the file itself, so the lock lives on the directory that stays put
+    lock_fd = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(lock_fd)
+
+def file_stamp(filepath):
+    """Returns a version stamp that changes whenever the file is replaced or appended to, or None if it is missing."""
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def merge_records(saved, records, theirs):
+    """Merges another process's changes (theirs) into records, both relative to the serialized base saved.
+
+    Returns the sorted keys changed differently on both sides; records is only modified if there are none."""
+    ours_changed, ours_removed = diff_records(saved, records)
+    their_changed, their_removed = diff_records(saved, theirs)
+    conflicts = [key for key, data in their_changed.items()
+        if (key in ours_changed and ours_changed[key] != data) or key in ours_removed]
+    conflicts.extend(key for key in their_removed if key in ours_changed)
+    if conflicts:
+        return sorted(conflicts)
+    for key in their_changed:
+        if key not in ours_changed:
+            records[key] = theirs[key]
+    for key in their_removed:
+        records.pop(key, None)
+    return []
+
+class JsonStore:
+    """Stores a dict of records as a single JSON file, merging with changes saved by other processes."""
+    def __init__(self, filepath, codec=None):
+        """Initializes the store with a given file path and codec (DEFAULT_CODEC unless given)."""
+        self.filepath = filepath
+        self.codec = codec if codec is not None else DEFAULT_CODEC
+        self.saved = {}
+        self.stamp = None
+
+    def read(self):
+        """Reads and returns all records, or an empty dict if the file is missing or invalid."""
+        try:
+            with open(self.filepath, 'rb') as file:
+                return self.codec.loads(file.read())
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            return {}
+
+    def load(self):
+        """Loads and returns all records, remembering the version that was loaded."""
+        with file_lock(self.filepath, exclusive=False):
+            records = self.read()
+            self.stamp = file_stamp(self.filepath)
+        self.saved = {key: encode_record(record) for key, record in records.items()}
+        return records
+
+    @instrumented
+    def save(self, records, keys=None):
+        """Saves all records if any changed; returns True if another process's changes had to be merged into records first.
+
+        Every record is compared whatever keys says, since the file is rewritten whole anyway and callers may have
+        edited records in place. Raises SaveConflictError, without writing, if both sides changed the same record."""
+        with file_lock(self.filepath):
+            merged = file_stamp(self.filepath) != self.stamp
+            if merged:
+                conflicts = merge_records(self.saved, records, self.read())
+                if conflicts:
+                    raise SaveConflictError(self.filepath, conflicts)
+            changed, removed = diff_records(self.saved, records)
+            if not merged and not changed and not removed and self.stamp is not None:
+                return False
+            self.write(records)
+            self.stamp = file_stamp(self.filepath)
+        self.saved.update(changed)
+        for key in removed:
+            del self.saved[key]
+        return merged
+
+    def write(self, records):
+        """Writes all records to a temporary file first so an interrupted save cannot corrupt the file."""
+        temp_path = self.filepath + ".tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(self.codec.dumps(records))
+            file.flush()
+            os.fsync(file.fileno())
+            if METRICS.enabled:
+                METRICS.record_bytes("JsonStore.save", file.tell())
+        os.replace(temp_path, self.filepath)
+
+class JournalStore:
+    """Stores records as a JSON snapshot plus an append-only journal of changes, one JSON line each."""
+    def __init__(self, filepath, journal_path=None, compact_every=1000, codec=None):
+        """Initializes the store with a snapshot path (written with codec); the journal defaults to the same path plus '.journal'."""
+        self.filepath = filepath
+        self.journal_path = journal_path if journal_path is not None else filepath + ".journal"
+        self.compact_every = compact_every
+        self.snapshot = JsonStore(filepath, codec)
+        self.saved = {}
+        self.stamp = None
+        self.journal_lines = 0
+
+    def read(self):
+        """Reads the snapshot and replays the journal over it, dropping a torn final line."""
+        records = self.snapshot.read()
+        self.journal_lines = 0
+        valid_end = 0
+        try:
+            with open(self.journal_path, 'rb') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        #Only the final line can be torn by an interrupted append
+                        break
+                    if entry["op"] == "put":
+                        records[entry["key"]] = entry["record"]
+                    elif entry["op"] == "delete":
+                        records.pop(entry["key"], None)
+                    self.journal_lines += 1
+                    valid_end += len(line)
+            if valid_end < os.path.getsize(self.journal_path):
+                os.truncate(self.journal_path, valid_end)
+        except FileNotFoundError:
+            pass
+        return records
+
+    def current_stamp(self):
+        """Returns the combined version stamp of the snapshot and the journal."""
+        return file_stamp(self.filepath), file_stamp(self.journal_path)
+
+    def load(self):
+        """Loads the snapshot and replays the journal over it."""
+        with file_lock(self.filepath, exclusive=False):
+            records = self.read()
+            self.stamp = self.current_stamp()
+        self.saved = {key: encode_record(record) for key, record in records.items()}
+        return records
+
+    @instrumented
+    def save(self, records, keys=None):
+        """Appends one journal line per changed or removed record, compacting when the journal grows too long.
+
+        Only keys are compared when given, which must then cover every record added, changed or removed since the
+        last load or save. Returns True if another process's changes had to be merged into records first, and raises
+        SaveConflictError, without writing, if both sides changed the same record."""
+        with file_lock(self.filepath):
+            merged = self.current_stamp() != self.stamp
+            if merged:
+                theirs = self.read()
+                conflicts = merge_records(self.saved, records, theirs)
+                if conflicts:
+                    raise SaveConflictError(self.filepath, conflicts)
+                #Their changes are already on disk, so only ours need appending
+                self.saved = {key: encode_record(record) for key, record in theirs.items()}
+            self.append(records, keys)
+            self.stamp = self.current_stamp()
+        return merged
+
+    def append(self, records, keys=None):
+        """Appends the changes since the last save to the journal, looking only at keys if given."""
+        changed, removed = diff_records(self.saved, records, keys)
+        if not changed and not removed:
+            if not os.path.exists(self.filepath) and not os.path.exists(self.journal_path):
+                self.compact(records)
+            return
+        with open(self.journal_path, 'a') as file:
+            start = file.tell()
+            for key, data in changed.items():
+                file.write('{"op": "put", "key": ' + json.dumps(key) + ', "record": ' + data + '}\n')
+            for key in removed:
+                file.write(json.dumps({"op": "delete", "key": key}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+            if METRICS.enabled:
+                METRICS.record_bytes("JournalStore.save", file.tell() - start)
+        self.journal_lines += len(changed) + len(removed)
+        self.saved.update(changed)
+        for key in removed:
+            del self.saved[key]
+        if self.journal_lines >= self.compact_every:
+            self.compact(records)
+
+    def compact(self, records):
+        """Folds the journal into the snapshot file and empties the journal."""
+        self.snapshot.write(records)
+        #Replaying a journal over a snapshot that already contains it is harmless, so truncating last is safe
+        open(self.journal_path, 'w').close()
+        self.journal_lines = 0
+        self.saved = {key: encode_record(record) for key, record in records.items()}
+        self.stamp = self.current_stamp()
+
+class SqliteStore:
+    """Stores a dict of records as rows of a SQLite table, writing only the rows that changed."""
+    def __init__(self, db_path, table):
+        """Opens (and creates if needed) the table for users, resources or bookings."""
+        self.db_path = db_path
+        self.table = table
+        self.columns = SQLITE_TABLES[table]
+        self.connection = sqlite3.connect(db_path)
+        #Serialized form of each row as last loaded or saved, used to find changed rows
+        self.saved = {}
+        column_defs = "".join(f", {column} TEXT" for column in self.columns)
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, data TEXT NOT NULL{column_defs})")
+            for column in self.columns:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})")
+
+    def load(self):
+        """Loads and returns all records in the table."""
+        records = {}
+        self.saved = {}
+        for key, data in self.connection.execute(f"SELECT key, data FROM {self.table}"):
+            records[key] = json.loads(data)
+            self.saved[key] = data
+        return records
+
+    @instrumented
+    def save(self, records, keys=None):
+        """Upserts changed records and deletes removed ones in a single transaction.
+
+        Only keys are compared when given, which must then cover every record added, changed or removed since the
+        last load or save."""
+        changed, removed = diff_records(self.saved, records, keys)
+        if not changed and not removed:
+            return
+        names = ", ".join(("key", "data") + self.columns)
+        placeholders = ", ".join("?" for _ in range(len(self.columns) + 2))
+        updates = ", ".join(f"{name} = excluded.{name}" for name in ("data",) + self.columns)
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO {self.table} ({names}) VALUES ({placeholders}) ON CONFLICT(key) DO UPDATE SET {updates}",
+                [(key, data) + tuple(records[key].get(column) for column in self.columns) for key, data in changed.items()])
+            self.connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in removed])
+        if METRICS.enabled:
+            METRICS.record_bytes("SqliteStore.save", sum(len(key) + len(data) for key, data in changed.items()))
+        self.saved.update(changed)
+        for key in removed:
+            del self.saved[key]
+
+    def import_json(self, filepath):
+        """Replaces the table contents with the records in a JSON file and returns them."""
+        records = JsonStore(filepath).load()
+        self.load()
+        self.save(records)
+        return records
+
+    def export_json(self, filepath):
+        """Writes the saved table contents to a JSON file."""
+        JsonStore(filepath).write(self.load())
+
+class LazyBookingStore(SqliteStore):
+    """SQLite bookings store that only loads bookings ending within the last window_days or later, plus recurring rules.
+
+    Older bookings stay on disk and are read a page at a time by history(); renames and deletions that reach
+    them are queued and applied in the same transaction as the next save."""
+    def __init__(self, db_path, window_days=30):
+        """Opens the bookings table of db_path, keeping window_days of past bookings in memory."""
+        super().__init__(db_path, "bookings")
+        self.window_days = window_days
+        self.loaded_from = None
+        self.pending = []
+        with self.connection:
+            self.connection.execute("CREATE INDEX IF NOT EXISTS bookings_recurring ON bookings (key) WHERE json_extract(data, '$.repeat') IS NOT NULL")
+
+    def load(self):
+        """Loads and returns the active and future bookings and every recurring rule."""
+        records = {}
+        self.saved = {}
+        self.pending = []
+        self.loaded_from = (datetime.date.today() - datetime.timedelta(days=self.window_days)).isoformat()
+        #Two queries so each can use its own index; SQLite scans the whole table for the OR of both
+        rows = itertools.chain(self.connection.execute("SELECT key, data FROM bookings WHERE end_date >= ?", (self.loaded_from,)),
+            self.connection.execute("SELECT key, data FROM bookings WHERE json_extract(data, '$.repeat') IS NOT NULL"))
+        for key, data in rows:
+            records[key] = json.loads(data)
+            self.saved[key] = data
+        return records
+
+    def history_filter(self, column=None):
+        """Returns the SQL condition and parameters matching the bookings left unloaded, optionally also on column = ?."""
+        condition = "end_date < ? AND json_extract(data, '$.repeat') IS NULL"
+        return (condition + f" AND {column} = ?" if column else condition), [self.loaded_from]
+
+    def history(self, start_date=None, end_date=None, offset=0, limit=100):
+        """Returns up to limit (key, booking) pairs of the unloaded bookings overlapping the optional dates, by start date."""
+        condition, parameters = self.history_filter()
+        if start_date is not None:
+            condition += " AND end_date >= ?"
+            parameters.append(str(start_date))
+        if end_date is not None:
+            condition += " AND start_date <= ?"
+            parameters.append(str(end_date))
+        rows = self.connection.execute(f"SELECT key, data FROM bookings WHERE {condition} ORDER BY start_date, key LIMIT ? OFFSET ?",
+            parameters + [limit, offset])
+        return [(key, json.loads(data)) for key, data in rows]
+
+    def has_key(self, key):
+        """Returns True if a booking with this key is stored, loaded or not."""
+        return self.connection.execute("SELECT 1 FROM bookings WHERE key = ?", (key,)).fetchone() is not None
+
+    def update_history(self, column, old_value, new_value):
+        """Queues changing column from old_value to new_value on the unloaded bookings."""
+        condition, parameters = self.history_filter(column)
+        self.pending.append((f"UPDATE bookings SET {column} = ?, data = json_set(data, '$.{column}', ?) WHERE {condition}",
+            [new_value, new_value] + parameters + [old_value]))
+
+    def delete_history(self, column, value):
+        """Queues deleting the unloaded bookings whose column equals value."""
+        condition, parameters = self.history_filter(column)
+        self.pending.append((f"DELETE FROM bookings WHERE {condition}", parameters + [value]))
+
+    def save(self, records, keys=None):
+        """Applies the queued history changes and saves the loaded records in one transaction."""
+        pending, self.pending = self.pending, []
+        with self.connection:
+            for statement, parameters in pending:
+                self.connection.execute(statement, parameters)
+            super().save(records, keys)
+
+class BookingArchive:
+    """Finished bookings moved out of the live store, one gzip-compressed JSONL file per month of their last day."""
+    def __init__(self, directory="archive"):
+        """Initializes the archive in a directory, which is created on the first archival."""
+        self.directory = directory
+        self.cached_query = None
+
+    def partition_path(self, month):
+        """Returns the file path of the partition for a YYYY-MM month."""
+        return os.path.join(self.directory, f"bookings-{month}.jsonl.gz")
+
+    def months(self):
+        """Returns the YYYY-MM months that have a partition, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[len("bookings-"):-len(".jsonl.gz")] for name in names if name.startswith("bookings-") and name.endswith(".jsonl.gz"))
+
+    def append(self, records):
+        """Appends {key: (last day, booking)} records to the partition of their last day's month."""
+        partitions = {}
+        for key, (last_day, booking) in records.items():
+            partitions.setdefault(last_day[:7], []).append(json.dumps(dict(booking, booking_name=key)) + "\n")
+        os.makedirs(self.directory, exist_ok=True)
+        for month, lines in partitions.items():
+            #Each append adds a gzip member; readers see the members as one stream
+            with open(self.partition_path(month), "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as file:
+                    file.write("".join(lines).encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+        self.cached_query = None
+
+    def query(self, start_date=None, end_date=None):
+        """Returns the archived (key, booking) pairs overlapping the optional dates, ordered by start date."""
+        if self.cached_query is not None and self.cached_query[0] == (start_date, end_date):
+            return self.cached_query[1]
+        start, end = (to_ordinal(start_date) if start_date else None), (to_ordinal(end_date) if end_date else None)
+        found = {}
+        for month in self.months():
+            #Nothing in a partition lasts beyond its month, so older months cannot reach start_date
+            if start_date is not None and month < str(start_date)[:7]:
+                continue
+            with gzip.open(self.partition_path(month), "rt") as file:
+                for line in file:
+                    booking = json.loads(line)
+                    key = booking.pop("booking_name")
+                    if next(occurrences(booking, start, end), None) is not None:
+                        found[key] = booking
+        result = sorted(found.items(), key=lambda item: (item[1]["start_date"], item[0]))
+        self.cached_query = ((start_date, end_date), result)
+        return result
+
+def hash_password(password):
+    """Returns a salted slow hash of password, stored as 'scheme$parameters$salt$digest' text."""
+    salt = os.urandom(16)
+    if hasattr(hashlib, "scrypt"):
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=16384, r=8, p=1)
+        return f"scrypt$16384$8$1${salt.hex()}${digest.hex()}"
+    #Python builds without OpenSSL scrypt fall back to PBKDF2
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, 600000)
+    return f"pbkdf2_sha256$600000${salt.hex()}${digest.hex()}"
+
+def is_password_hash(value):
+    """Returns True if value was made by hash_password rather than being a plaintext password."""
+    return isinstance(value, str) and value.startswith(("scrypt$", "pbkdf2_sha256$"))
+
+def verify_password(password, stored):
+    """Returns True if password matches a hash made by hash_password."""
+    parts = stored.split("$")
+    if parts[0] == "scrypt":
+        n, r, p = (int(part) for part in parts[1:4])
+        digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(parts[4]), n=n, r=r, p=p)
+    else:
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(parts[2]), int(parts[1]))
+    return hmac.compare_digest(digest, bytes.fromhex(parts[-1]))
+
+class VerificationCache:
+    """Bounded cache of recent successful password checks, each expiring after ttl seconds."""
+    def __init__(self, max_size=256, ttl=300):
+        """Initializes an empty cache with a per-session secret."""
+        self.max_size = max_size
+        self.ttl = ttl
+        #user_name -> (stored hash, keyed digest of the password, expiry time), oldest first
+        self.entries = collections.OrderedDict()
+        self.secret = secrets.token_bytes(32)
+
+    def token(self, password):
+        """Returns a fast keyed digest of password, so the cache never holds the password itself."""
+        return hmac.new(self.secret, password.encode(), "sha256").digest()
+
+    def check(self, user_name, stored, password):
+        """Returns True if password was verified against the same stored hash within the last ttl seconds."""
+        entry = self.entries.get(user_name)
+        if entry is None:
+            return False
+        if entry[0] != stored or entry[2] < time.monotonic():
+            del self.entries[user_name]
+            return False
+        return hmac.compare_digest(entry[1], self.token(password))
+
+    def add(self, user_name, stored, password):
+        """Records a successful check, evicting the least recently added entry when full."""
+        self.entries[user_name] = (stored, self.token(password), time.monotonic() + self.ttl)
+        self.entries.move_to_end(user_name)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def discard(self, user_name):
+        """Forgets any cached check for user_name."""
+        self.entries.pop(user_name, None)
+
+class ChangeNotifier:
+    """Mixin letting views subscribe to added and removed keys instead of re-reading a whole model dict."""
+    #Called as recorder(model, keys) before records change, so a CommandLog can keep their old versions
+    recorder = None
+    #Keys added, changed or removed since the last load or save, or None while they are unknown
+    changed_keys = None
+
+    def subscribe(self, listener):
+        """Registers listener(added, removed, reset); reset is True when the whole dict was reloaded.
+
+        A key that is both removed and added is a record edited in place."""
+        self.listeners.append(listener)
+
+    def notify(self, added=(), removed=(), reset=False):
+        """Tells every listener which keys were added or removed."""
+        if reset:
+            self.changed_keys = None
+        else:
+            self.mark_changed(added)
+            self.mark_changed(removed)
+        for listener in self.listeners:
+            listener(added, removed, reset)
+
+    def notify_edited(self, keys):
+        """Tells every listener that the records of keys were edited in place."""
+        keys = list(keys)
+        if keys:
+            self.notify(added=keys, removed=keys)
+
+    def before_change(self, keys):
+        """Hands the keys about to be added, changed or removed to the recorder, if there is one."""
+        self.mark_changed(keys)
+        if self.recorder is not None:
+            self.recorder(self, keys)
+
+    def mark_changed(self, keys):
+        """Notes keys whose records need saving, so the store only has to compare those."""
+        if self.changed_keys is not None:
+            self.changed_keys.update(keys)
+
+def tokenize(text):
+    """Returns the lowercase words of text."""
+    return re.findall(r"\w+", str(text).lower())
+
+class SearchIndex:
+    """Inverted index from words to record keys, searched by word prefix and kept in step by change notifications.
+
+    Nothing is built until the first search, so models that are never searched pay nothing."""
+    def __init__(self, lookup, fields):
+        """Indexes each key plus the given fields of the record that lookup(key) returns."""
+        self.lookup = lookup
+        self.fields = fields
+        self.built = False
+        self.postings = {}
+        #Distinct words in sorted order, so all words with a prefix sit next to each other
+        self.words = []
+        self.key_words = {}
+
+    def record_words(self, key, record):
+        """Returns the set of words indexed for one record."""
+        words = set(tokenize(key))
+        for field in self.fields:
+            if record.get(field) is not None:
+                words.update(tokenize(record[field]))
+        return words
+
+    def add(self, key, record):
+        """Indexes one record."""
+        words = self.key_words[key] = self.record_words(key, record)
+        for word in words:
+            if word not in self.postings:
+                self.postings[word] = set()
+                bisect.insort(self.words, word)
+            self.postings[word].add(key)
+
+    def discard(self, key):
+        """Removes one record from the index."""
+        for word in self.key_words.pop(key, ()):
+            keys = self.postings[word]
+            keys.discard(key)
+            if not keys:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def rebuild(self, keys):
+        """Indexes the records of keys from scratch."""
+        self.postings = {}
+        self.key_words = {}
+        for key in keys:
+            words = self.key_words[key] = self.record_words(key, self.lookup(key))
+            for word in words:
+                self.postings.setdefault(word, set()).add(key)
+        self.words = sorted(self.postings)
+        self.built = True
+
+    def apply(self, added, removed, reset=False):
+        """Change notification listener; edits to an index that is not built yet are left for the first search."""
+        if reset:
+            self.built = False
+        if not self.built:
+            return
+        for key in removed:
+            self.discard(key)
+        for key in added:
+            self.add(key, self.lookup(key))
+
+    def search(self, query, keys):
+        """Returns the set of keys with a word starting with every word of query, or None if query has no words.
+
+        keys lists every current key and is only read if the index still has to be built."""
+        query_words = tokenize(query)
+        if not query_words:
+            return None
+        if not self.built:
+            self.rebuild(keys)
+        found = None
+        for query_word in query_words:
+            #Every word with the prefix sorts between the prefix itself and the prefix followed by the highest character
+            first = bisect.bisect_left(self.words, query_word)
+            last = bisect.bisect_left(self.words, query_word + "\U0010ffff", first)
+            matches = set().union(*map(self.postings.__getitem__, self.words[first:last]))
+            found = matches if found is None else found & matches
+            if not found:
+                break
+        return found
+
+class Users(ChangeNotifier):
+    """Handles user management including loading, saving, authentication, and deletion."""
+    def __init__(self, filepath="users.json", store=None):
+        """Initializes Users with a given JSON file path, or another store such as SqliteStore."""
+        self.filepath = filepath
+        self.store = store if store is not None else JsonStore(filepath)
+        self.verified = VerificationCache()
+        self.listeners = []
+        self.search_index = SearchIndex(lambda user_name: self.users[user_name], ("full_name",))
+        self.subscribe(self.search_index.apply)
+        self.load_users()
+    
+    @instrumented
+    def load_users(self):
+        """Loads users from the store, noting any plaintext passwords left from before hashing."""
+        self.users = self.store.load()
+        #Plaintext passwords are upgraded on their first successful check, or all at once by migrate_passwords
+        self.plaintext_users = {user_name for user_name, user in self.users.items() if not is_password_hash(user.get("password"))}
+        self.notify(added=list(self.users), reset=True)
+        self.changed_keys = set()
+            
+    @instrumented
+    def save_users(self):
+        """Saves users to the store, picking up changes another process saved in the meantime."""
+        if self.store.save(self.users, self.changed_keys):
+            #Another process saved in the meantime and its changes were merged in
+            self.plaintext_users = {user_name for user_name, user in self.users.items() if not is_password_hash(user.get("password"))}
+            self.notify(added=list(self.users), reset=True)
+        self.changed_keys = set()
+    
+    def delete_user(self, user_name):
+        """Deletes a user by username."""
+        if user_name in self.users:
+            self.before_change([user_name])
+            del self.users[user_name]
+            self.plaintext_users.discard(user_name)
+            self.verified.discard(user_name)
+            self.notify(removed=[user_name])
+            return True
+        return False
+
+    def add_user(self, user_name, user):
+        """Adds a user record; the password should then be set with set_password."""
+        self.before_change([user_name])
+        self.users[user_name] = user
+        self.notify(added=[user_name])
+
+    def update_user(self, user_name, **fields):
+        """Updates fields of an existing user, such as full_name."""
+        self.before_change([user_name])
+        self.users[user_name].update(fields)
+        self.notify_edited([user_name])
+
+    def get_record(self, user_name):
+        """Returns the record of user_name, or None if there is no such user."""
+        return self.users.get(user_name)
+
+    def restore_record(self, user_name, user):
+        """Puts a user record back as recorded, or deletes the user if user is None; used by undo and redo."""
+        if user is None:
+            self.delete_user(user_name)
+            return
+        edited = user_name in self.users
+        self.users[user_name] = user
+        self.verified.discard(user_name)
+        if is_password_hash(user.get("password")):
+            self.plaintext_users.discard(user_name)
+        else:
+            self.plaintext_users.add(user_name)
+        if edited:
+            self.notify_edited([user_name])
+        else:
+            self.notify(added=[user_name])
+
+    def search(self, query):
+        """Returns the set of usernames whose name or full name has words starting with every word of query, or None if query is blank."""
+        return self.search_index.search(query, self.users)
+
+    def rename_user(self, old_name, new_name):
+        """Moves a user's record to a new username."""
+        self.before_change([old_name, new_name])
+        self.users[new_name] = self.users.pop(old_name)
+        if old_name in self.plaintext_users:
+            self.plaintext_users.discard(old_name)
+            self.plaintext_users.add(new_name)
+        self.verified.discard(old_name)
+        self.notify(added=[new_name], removed=[old_name])
+    
+    def set_password(self, user_name, password):
+        """Stores a new salted hash of password for user_name."""
+        self.set_password_hash(user_name, hash_password(password))
+
+    def set_password_hash(self, user_name, stored):
+        """Stores a hash already made by hash_password for user_name."""
+        self.before_change([user_name])
+        self.users[user_name]["password"] = stored
+        self.plaintext_users.discard(user_name)
+        self.verified.discard(user_name)
+
+    @instrumented
+    def check_password(self, user_name, password):
+        """Returns True if password is correct for user_name, skipping the slow hash for recently verified users."""
+        stored = self.users[user_name]["password"]
+        if not is_password_hash(stored):
+            if not hmac.compare_digest(str(stored).encode(), password.encode()):
+                return False
+            self.set_password(user_name, password)
+            stored = self.users[user_name]["password"]
+        elif not self.verified.check(user_name, stored, password):
+            if not verify_password(password, stored):
+                return False
+        self.verified.add(user_name, stored, password)
+        return True
+
+    def migrate_passwords(self):
+        """Replaces every remaining plaintext password with its salted hash and returns how many were changed."""
+        migrated = 0
+        for user_name in list(self.plaintext_users):
+            if user_name in self.users:
+                self.set_password(user_name, str(self.users[user_name]["password"]))
+                migrated += 1
+        self.plaintext_users = set()
+        return migrated
+
+class Resources(ChangeNotifier):
+    """Handles resource management including loading, saving, updating owners."""
+    def __init__(self, filepath="resources.json", store=None):
+        """Initializes Resources with a given JSON file path, or another store such as SqliteStore."""
+        self.filepath = filepath
+        self.store = store if store is not None else JsonStore(filepath)
+        self.listeners = []
+        self.search_index = SearchIndex(lambda resource_key: self.resources[resource_key], ("description", "owner"))
+        self.subscribe(self.search_index.apply)
+        self.load_resources()
+    @instrumented
+    def load_resources(self):
+        """Loads resources from the store."""
+        self.resources = self.store.load()
+        #Older files list every booked day as its own ISO string; keep only the compact ranges
+        for resource in self.resources.values():
+            if resource.get("days_booked") and isinstance(resource["days_booked"][0], str):
+                resource["days_booked"] = DayBitmap.from_json(resource["days_booked"]).to_json()
+        self.rebuild_index()
+        self.notify(added=list(self.resources), reset=True)
+        self.changed_keys = set()
+    
+    @instrumented
+    def save_resources(self):
+        """Saves resources to the store, picking up changes another process saved in the meantime."""
+        if self.store.save(self.resources, self.changed_keys):
+            #Another process saved in the meantime and its changes were merged in
+            self.rebuild_index()
+            self.notify(added=list(self.resources), reset=True)
+        self.changed_keys = set()
+        
+    def rebuild_index(self):
+        """Rebuilds the owner to resource keys index from the resources dict."""
+        self.by_owner = {}
+        for resource_key, resource in self.resources.items():
+            self.by_owner.setdefault(resource.get("owner"), set()).add(resource_key)
+
+    def add_resource(self, resource_key, resource):
+        """Adds (or replaces) a resource and keeps the owner index in step."""
+        if resource_key in self.resources:
+            self.remove_resource(resource_key)
+        self.before_change([resource_key])
+        self.resources[resource_key] = resource
+        self.by_owner.setdefault(resource.get("owner"), set()).add(resource_key)
+        self.notify(added=[resource_key])
+
+    def remove_resource(self, resource_key):
+        """Removes a resource by key and returns it, or None if it does not exist."""
+        self.before_change([resource_key])
+        resource = self.resources.pop(resource_key, None)
+        if resource is not None:
+            self.by_owner[resource.get("owner")].discard(resource_key)
+            self.notify(removed=[resource_key])
+        return resource
+
+    def update_resource(self, resource_key, **fields):
+        """Updates fields of an existing resource, keeping the owner index in step."""
+        self.before_change([resource_key])
+        resource = self.resources[resource_key]
+        if "owner" in fields and fields["owner"] != resource.get("owner"):
+            self.by_owner[resource.get("owner")].discard(resource_key)
+            self.by_owner.setdefault(fields["owner"], set()).add(resource_key)
+        resource.update(fields)
+        self.notify_edited([resource_key])
+
+    def get_record(self, resource_key):
+        """Returns the record of resource_key, or None if there is no such resource."""
+        return self.resources.get(resource_key)
+
+    def restore_record(self, resource_key, resource):
+        """Puts a resource back as recorded, or removes it if resource is None; used by undo and redo."""
+        if resource is None:
+            self.remove_resource(resource_key)
+        elif resource_key in self.resources:
+            current = self.resources[resource_key]
+            self.by_owner[current.get("owner")].discard(resource_key)
+            #The booked days follow the bookings, which may have been saved since the record was copied
+            if "days_booked" in current:
+                resource["days_booked"] = current["days_booked"]
+            self.resources[resource_key] = resource
+            self.by_owner.setdefault(resource.get("owner"), set()).add(resource_key)
+            self.notify_edited([resource_key])
+        else:
+            self.add_resource(resource_key, resource)
+
+    def search(self, query):
+        """Returns the set of resource names whose name, description or owner has words starting with every word of query, or None if query is blank."""
+        return self.search_index.search(query, self.resources)
+
+    def rename_resource(self, old_name, new_name):
+        """Renames a resource, keeping its position in the owner index."""
+        if old_name != new_name:
+            self.add_resource(new_name, self.remove_resource(old_name))
+
+    def resources_owned_by(self, owner):
+        """Returns the keys of resources owned by owner."""
+        return set(self.by_owner.get(owner, ()))
+
+    def update_owners(self, old_owner, new_owner):
+        """Updates the owner of resources from old_owner to new_owner."""
+        resource_keys = self.by_owner.pop(old_owner, set())
+        self.before_change(resource_keys)
+        for resource_key in resource_keys:
+            self.resources[resource_key]["owner"] = new_owner
+        if resource_keys:
+            self.by_owner.setdefault(new_owner, set()).update(resource_keys)
+        self.notify_edited(resource_keys)
+            
+def to_ordinal(value):
+    """Converts a date or an ISO (YYYY-MM-DD) date string to a day ordinal; ordinals pass through unchanged."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    return value.toordinal()
+
+def bit_runs(bits):
+    """Yields (first, last) bit positions for each run of consecutive set bits in a non-negative int."""
+    #One scan of the binary digits, lowest bit first; clearing each run off the int would copy it once per run
+    for run in re.finditer("1+", bin(bits)[:1:-1]):
+        yield run.start(), run.end() - 1
+
+class DayBitmap:
+    """Set of booked days for one resource, held as the bits of a Python int (bit i is day ordinal base + i)."""
+    def __init__(self):
+        """Initializes an empty bitmap."""
+        self.base = None
+        self.bits = 0
+
+    def mask(self, start, end):
+        """Returns the bits covering day ordinals start to end inclusive."""
+        return ((1 << (end - start + 1)) - 1) << (start - self.base)
+
+    def add(self, start, end):
+        """Marks day ordinals start to end inclusive as booked."""
+        if self.base is None:
+            self.base = start
+        elif start < self.base:
+            self.bits <<= self.base - start
+            self.base = start
+        self.bits |= self.mask(start, end)
+
+    def discard(self, start, end):
+        """Marks day ordinals start to end inclusive as free."""
+        if self.base is None or end < self.base:
+            return
+        self.bits &= ~self.mask(max(start, self.base), end)
+
+    def overlaps(self, start, end):
+        """Returns True if any day from start to end inclusive is booked."""
+        if self.base is None or end < self.base:
+            return False
+        return self.bits & self.mask(max(start, self.base), end) != 0
+
+    def ranges(self):
+        """Yields (start, end) ordinal pairs for each run of consecutive booked days."""
+        for start, end in bit_runs(self.bits):
+            yield self.base + start, self.base + end
+
+    def free_ranges(self, start, end):
+        """Yields (start, end) ordinal pairs for each run of free days between start and end inclusive."""
+        if self.base is None:
+            busy = 0
+        elif start >= self.base:
+            busy = self.bits >> (start - self.base)
+        else:
+            busy = self.bits << (self.base - start)
+        free = ~busy & ((1 << (end - start + 1)) - 1)
+        for first, last in bit_runs(free):
+            yield start + first, start + last
+
+    def days(self):
+        """Yields every booked day ordinal in order."""
+        for start, end in self.ranges():
+            yield from range(start, end + 1)
+
+    def to_json(self):
+        """Returns the compact stored form: a list of [start, end] ISO date pairs."""
+        return [[datetime.date.fromordinal(start).isoformat(), datetime.date.fromordinal(end).isoformat()] for start, end in self.ranges()]
+
+    @classmethod
+    def from_json(cls, value):
+        """Builds a bitmap from [start, end] ISO pairs, or from the older list of single ISO dates."""
+        bitmap = cls()
+        for entry in value or []:
+            if isinstance(entry, str):
+                bitmap.add(to_ordinal(entry), to_ordinal(entry))
+            else:
+                bitmap.add(to_ordinal(entry[0]), to_ordinal(entry[1]))
+        return bitmap
+
+class AvailabilityIndex:
+    """Intervals of the bookings held against a single resource, as sorted blocks of start/end arrays.
+
+    Each block is kept sorted by start and remembers its latest end, so an insert or removal only shifts one
+    short block. A running maximum of those ends lets a query bisect straight to the first block that can reach
+    the dates it asks about, and skip any later block that ends before them."""
+    #Blocks are split in two once they grow past twice this many intervals
+    BLOCK_SIZE = 256
+
+    def __init__(self, intervals=()):
+        """Initializes the index from (start, end, key) triples (day ordinals), sorting them once."""
+        self.starts = []
+        self.ends = []
+        self.keys = []
+        #firsts[b] is the first start in block b and max_ends[b] its latest end
+        self.firsts = []
+        self.max_ends = []
+        intervals = sorted(intervals)
+        for i in range(0, len(intervals), self.BLOCK_SIZE):
+            block = intervals[i:i + self.BLOCK_SIZE]
+            self.starts.append([start for start, _, _ in block])
+            self.ends.append([end for _, end, _ in block])
+            self.keys.append([key for _, _, key in block])
+            self.firsts.append(block[0][0])
+            self.max_ends.append(max(self.ends[-1]))
+        #reaches[b] is the latest end in blocks 0 to b, so it never decreases
+        self.reaches = list(itertools.accumulate(self.max_ends, max))
+
+    def add(self, start, end, key):
+        """Adds the interval [start, end] (day ordinals) for a booking key."""
+        if not self.starts:
+            self.starts.append([start])
+            self.ends.append([end])
+            self.keys.append([key])
+            self.firsts.append(start)
+            self.max_ends.append(end)
+            self.reaches.append(end)
+            return
+        b = max(bisect.bisect_right(self.firsts, start) - 1, 0)
+        starts = self.starts[b]
+        i = bisect.bisect_right(starts, start)
+        starts.insert(i, start)
+        self.ends[b].insert(i, end)
+        self.keys[b].insert(i, key)
+        self.firsts[b] = starts[0]
+        if end > self.max_ends[b]:
+            self.max_ends[b] = end
+            #The running maximum only has to rise until it meets a block already reaching end
+            for c in range(b, len(self.reaches)):
+                if self.reaches[c] >= end:
+                    break
+                self.reaches[c] = end
+        if len(starts) > 2 * self.BLOCK_SIZE:
+            self.split(b)
+
+    def split(self, b):
+        """Splits block b into two halves."""
+        half = len(self.starts[b]) // 2
+        for blocks in (self.starts, self.ends, self.keys):
+            blocks.insert(b + 1, blocks[b][half:])
+            del blocks[b][half:]
+        self.firsts.insert(b + 1, self.starts[b + 1][0])
+        self.max_ends[b] = max(self.ends[b])
+        self.max_ends.insert(b + 1, max(self.ends[b + 1]))
+        self.update_reaches(b)
+
+    def update_reaches(self, b):
+        """Recomputes the running maximum of the block ends from block b on."""
+        if b == 0:
+            self.reaches = list(itertools.accumulate(self.max_ends, max))
+        else:
+            self.reaches[b - 1:] = itertools.accumulate(self.max_ends[b:], max, initial=self.reaches[b - 1])
+
+    def remove(self, start, key):
+        """Removes the interval starting at start for a booking key."""
+        #Equal starts can run across a block boundary, so look from the block before the first one starting there
+        b = max(bisect.bisect_left(self.firsts, start) - 1, 0)
+        while b < len(self.starts) and self.firsts[b] <= start:
+            starts, keys = self.starts[b], self.keys[b]
+            i = bisect.bisect_left(starts, start)
+            while i < len(starts) and starts[i] == start:
+                if keys[i] == key:
+                    del starts[i], self.ends[b][i], keys[i]
+                    if starts:
+                        self.firsts[b] = starts[0]
+                        self.max_ends[b] = max(self.ends[b])
+                    else:
+                        del self.starts[b], self.ends[b], self.keys[b], self.firsts[b], self.max_ends[b]
+                    self.update_reaches(b)
+                    return True
+                i += 1
+            b += 1
+        return False
+
+    def is_free(self, start, end):
+        """Returns True if no interval overlaps [start, end]."""
+        return not self.overlapping(start, end, first_only=True)
+
+    def overlapping(self, start, end, first_only=False):
+        """Returns the keys of all intervals overlapping [start, end], ordered by start (just the first one with first_only)."""
+        found = []
+        #Candidates lie from the first block whose running maximum end reaches start to the last one starting by end
+        for b in range(bisect.bisect_left(self.reaches, start), bisect.bisect_right(self.firsts, end)):
+            if self.max_ends[b] < start:
+                continue
+            starts, ends, keys = self.starts[b], self.ends[b], self.keys[b]
+            for i in range(bisect.bisect_right(starts, end)):
+                if ends[i] >= start:
+                    found.append(keys[i])
+                    if first_only:
+                        return found
+        return found
+
+#Days between occurrences for the fixed-length repeat periods; monthly rules step by calendar month
+REPEAT_DAYS = {"daily": 1, "weekly": 7}
+
+def add_months(ordinal, months):
+    """Returns the day ordinal months calendar months after ordinal, clamped to the end of shorter months."""
+    date = datetime.date.fromordinal(ordinal)
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    return datetime.date(year, month, min(date.day, calendar.monthrange(year, month)[1])).toordinal()
+
+def occurrences(booking, start=None, end=None):
+    """Yields (start, end) day ordinals for each occurrence of booking overlapping [start, end] (either may be None).
+
+    A booking without a "repeat" rule has one occurrence. A rule such as {"every": "weekly", "interval": 1, "count": 10}
+    or {"every": "monthly", "until": "2026-06-30"} repeats it, and only occurrences inside the window are generated."""
+    first = to_ordinal(booking["start_date"])
+    length = to_ordinal(booking["end_date"]) - first
+    rule = booking.get("repeat")
+    if not rule:
+        if (start is None or first + length >= start) and (end is None or first <= end):
+            yield first, first + length
+        return
+    interval = rule.get("interval", 1)
+    count = rule.get("count")
+    until = to_ordinal(rule["until"]) if rule.get("until") else None
+    step = REPEAT_DAYS.get(rule["every"], 0) * interval
+    #Jump straight to (just before) the first occurrence that can reach the window
+    n = 0
+    if start is not None and step:
+        n = max(0, (start - length - first) // step)
+    elif start is not None:
+        reach = datetime.date.fromordinal(max(first, start - length))
+        origin = datetime.date.fromordinal(first)
+        n = max(0, ((reach.year - origin.year) * 12 + reach.month - origin.month) // interval - 1)
+    while count is None or n < count:
+        occurrence = first + n * step if step else add_months(first, n * interval)
+        if (until is not None and occurrence > until) or (end is not None and occurrence > end):
+            return
+        if start is None or occurrence + length >= start:
+            yield occurrence, occurrence + length
+        n += 1
+
+def describe_repeat(rule):
+    """Returns a short description of a repeat rule, such as 'weekly x10' or 'every 2 months until 2026-06-30'."""
+    if not rule:
+        return ""
+    interval = rule.get("interval", 1)
+    period = rule["every"] if interval == 1 else f"every {interval} " + {"daily": "days", "weekly": "weeks", "monthly": "months"}[rule["every"]]
+    return f"{period} x{rule['count']}" if rule.get("count") else f"{period} until {rule['until']}"
+
+class Waitlist(ChangeNotifier):
+    """Requests for dates that were already booked, queued per resource in the order they were made.
+
+    Each resource keeps its requests sorted by first day, along with the length of its longest request, so the
+    requests overlapping freed dates are found by bisecting rather than by scanning the whole queue."""
+    def __init__(self, filepath="waitlist.json", store=None):
+        """Initializes the waitlist with a given JSON file path, or another store such as SqliteStore."""
+        self.filepath = filepath
+        self.store = store if store is not None else JsonStore(filepath)
+        self.listeners = []
+        self.load_requests()
+
+    def load_requests(self):
+        """Loads the waiting requests from the store."""
+        self.requests = self.store.load()
+        self.rebuild_index()
+        self.notify(added=list(self.requests), reset=True)
+        self.changed_keys = set()
+
+    def save_requests(self):
+        """Saves the waiting requests to the store, picking up changes another process saved in the meantime."""
+        if self.store.save(self.requests, self.changed_keys):
+            self.rebuild_index()
+            self.notify(added=list(self.requests), reset=True)
+        self.changed_keys = set()
+
+    def rebuild_index(self):
+        """Rebuilds the per-resource start day index from the requests dict."""
+        self.by_start = {}
+        self.longest = {}
+        for request_key, request in self.requests.items():
+            self.index_request(request_key, request)
+
+    def index_request(self, request_key, request):
+        """Adds a request to the start day index of its resource."""
+        start = to_ordinal(request["start_date"])
+        bisect.insort(self.by_start.setdefault(request["resource"], []), (start, request_key))
+        #Only ever grows, which keeps it a safe bound for how far before a freed range an overlapping request can start
+        self.longest[request["resource"]] = max(self.longest.get(request["resource"], 0), to_ordinal(request["end_date"]) - start)
+
+    def unindex_request(self, request_key, request):
+        """Removes a request from the start day index of its resource."""
+        entries = self.by_start[request["resource"]]
+        del entries[bisect.bisect_left(entries, (to_ordinal(request["start_date"]), request_key))]
+
+    def add_request(self, request_key, request):
+        """Adds (or replaces) a request."""
+        self.before_change([request_key])
+        is_new = request_key not in self.requests
+        if not is_new:
+            self.unindex_request(request_key, self.requests[request_key])
+        self.requests[request_key] = request
+        self.index_request(request_key, request)
+        if is_new:
+            self.notify(added=[request_key])
+        else:
+            self.notify_edited([request_key])
+
+    def remove_request(self, request_key):
+        """Removes a request by key and returns it, or None if it does not exist."""
+        self.before_change([request_key])
+        request = self.requests.pop(request_key, None)
+        if request is not None:
+            self.unindex_request(request_key, request)
+            self.notify(removed=[request_key])
+        return request
+
+    def get_record(self, request_key):
+        """Returns the request request_key, or None if there is none."""
+        return self.requests.get(request_key)
+
+    def restore_record(self, request_key, request):
+        """Puts a request back as recorded, or removes it if request is None; used by undo and redo."""
+        if request is None:
+            self.remove_request(request_key)
+        else:
+            self.add_request(request_key, request)
+
+    def overlapping(self, resource, start, end):
+        """Returns the keys of the requests for resource overlapping day ordinals [start, end], oldest request first."""
+        entries = self.by_start.get(resource, [])
+        first = bisect.bisect_left(entries, (start - self.longest.get(resource, 0),))
+        last = bisect.bisect_left(entries, (end + 1,))
+        found = [request_key for _, request_key in entries[first:last] if to_ordinal(self.requests[request_key]["end_date"]) >= start]
+        return sorted(found, key=lambda request_key: (self.requests[request_key]["requested_at"], request_key))
+
+    def queue(self, resource=None):
+        """Returns the keys of the requests, optionally only those for resource, oldest request first."""
+        keys = [request_key for _, request_key in self.by_start.get(resource, [])] if resource is not None else self.requests
+        return sorted(keys, key=lambda request_key: (self.requests[request_key]["requested_at"], request_key))
+
+    def rename_field(self, field, old_value, new_value):
+        """Changes the owner or resource of every request from old_value to new_value."""
+        request_keys = [request_key for request_key, request in self.requests.items() if request[field] == old_value]
+        self.before_change(request_keys)
+        for request_key in request_keys:
+            request = self.requests[request_key]
+            self.unindex_request(request_key, request)
+            request[field] = new_value
+            self.index_request(request_key, request)
+        self.notify_edited(request_keys)
+
+    def remove_where(self, field, value):
+        """Removes every request whose owner or resource is value."""
+        for request_key in [request_key for request_key, request in self.requests.items() if request[field] == value]:
+            self.remove_request(request_key)
+
+class Bookings(ChangeNotifier):
+    """Handles booking management including loading, saving, and date calculations."""
+    def __init__(self, filepath="bookings.json", store=None, archive=None, waitlist=None):
+        """Initializes Bookings with a given JSON file path, or another store such as SqliteStore, and an optional BookingArchive and Waitlist."""
+        self.filepath = filepath
+        self.store = store if store is not None else JsonStore(filepath)
+        self.archive = archive
+        self.waitlist = waitlist
+        self.listeners = []
+        self.search_index = SearchIndex(lambda booking_key: self.bookings[booking_key], ("owner", "resource", "start_date"))
+        self.subscribe(self.search_index.apply)
+        #Resources whose bookings changed since their stored days_booked was last rewritten
+        self.stale_resources = set()
+        self.load_bookings()
+    
+    @instrumented
+    def load_bookings(self):
+        """Loads bookings from the store."""
+        self.bookings = self.store.load()
+        self.rebuild_index()
+        self.notify(added=list(self.bookings), reset=True)
+        self.changed_keys = set()
+
+    @instrumented
+    def save_bookings(self):
+        """Saves bookings to the store, picking up changes another process saved in the meantime."""
+        if self.store.save(self.bookings, self.changed_keys):
+            #Another process saved in the meantime and its changes were merged in
+            self.rebuild_index()
+            self.notify(added=list(self.bookings), reset=True)
+        self.changed_keys = set()
+        if self.waitlist is not None:
+            self.waitlist.save_requests()
+
+    def rebuild_index(self):
+        """Rebuilds the availability index, day bitmaps, recurring rules and key indexes from the bookings dict."""
+        #(resource, first day, last day) of each booking removed since waiting requests were last promoted
+        self.released = []
+        self.index = {}
+        self.occupancy = {}
+        self.recurring = {}
+        self.by_owner = {}
+        self.by_resource = {}
+        intervals = {}
+        for booking_key, booking in self.bookings.items():
+            self.by_owner.setdefault(booking["owner"], set()).add(booking_key)
+            self.by_resource.setdefault(booking["resource"], set()).add(booking_key)
+            if booking.get("repeat"):
+                self.recurring.setdefault(booking["resource"], {})[booking_key] = booking
+            else:
+                intervals.setdefault(booking["resource"], []).append((to_ordinal(booking["start_date"]), to_ordinal(booking["end_date"]), booking_key))
+        #Each resource's intervals are sorted once here rather than inserted one by one
+        for resource, resource_intervals in intervals.items():
+            self.index[resource] = AvailabilityIndex(resource_intervals)
+            bitmap = self.occupancy[resource] = DayBitmap()
+            for start, end, _ in resource_intervals:
+                bitmap.add(start, end)
+
+    def index_booking(self, booking_key, booking):
+        """Adds a booking to the availability index (or recurring rules) of its resource and to the key indexes."""
+        self.by_owner.setdefault(booking["owner"], set()).add(booking_key)
+        self.by_resource.setdefault(booking["resource"], set()).add(booking_key)
+        if booking.get("repeat"):
+            #Rules are checked occurrence by occurrence within a window instead of being expanded into the index
+            self.recurring.setdefault(booking["resource"], {})[booking_key] = booking
+            return
+        self.stale_resources.add(booking["resource"])
+        if booking["resource"] not in self.index:
+            self.index[booking["resource"]] = AvailabilityIndex()
+            self.occupancy[booking["resource"]] = DayBitmap()
+        start, end = to_ordinal(booking["start_date"]), to_ordinal(booking["end_date"])
+        self.index[booking["resource"]].add(start, end, booking_key)
+        self.occupancy[booking["resource"]].add(start, end)
+
+    def unindex_booking(self, booking_key, booking):
+        """Removes a booking from the availability index (or recurring rules) of its resource and from the key indexes."""
+        self.by_owner.get(booking["owner"], set()).discard(booking_key)
+        self.by_resource.get(booking["resource"], set()).discard(booking_key)
+        resource_index = self.index.get(booking["resource"])
+        if booking.get("repeat"):
+            self.recurring.get(booking["resource"], {}).pop(booking_key, None)
+        elif resource_index is not None:
+            self.stale_resources.add(booking["resource"])
+            start, end = to_ordinal(booking["start_date"]), to_ordinal(booking["end_date"])
+            resource_index.remove(start, booking_key)
+            bitmap = self.occupancy[booking["resource"]]
+            bitmap.discard(start, end)
+            #Days shared with other (overlapping) bookings stay booked
+            for other_key in resource_index.overlapping(start, end):
+                other = self.bookings[other_key]
+                bitmap.add(max(start, to_ordinal(other["start_date"])), min(end, to_ordinal(other["end_date"])))
+
+    def bookings_owned_by(self, owner):
+        """Returns the keys of bookings made by owner."""
+        return set(self.by_owner.get(owner, ()))
+
+    def bookings_for_resource(self, resource):
+        """Returns the keys of bookings held against resource."""
+        return set(self.by_resource.get(resource, ()))
+
+    def rename_owner(self, old_owner, new_owner):
+        """Moves every booking made by old_owner over to new_owner."""
+        if old_owner == new_owner:
+            return
+        booking_keys = self.by_owner.pop(old_owner, set())
+        self.before_change(booking_keys)
+        for booking_key in booking_keys:
+            self.bookings[booking_key]["owner"] = new_owner
+        if booking_keys:
+            self.by_owner.setdefault(new_owner, set()).update(booking_keys)
+        self.notify_edited(booking_keys)
+        if hasattr(self.store, "update_history"):
+            self.store.update_history("owner", old_owner, new_owner)
+        if self.waitlist is not None:
+            self.waitlist.rename_field("owner", old_owner, new_owner)
+
+    def rename_resource(self, old_resource, new_resource):
+        """Moves every booking held against old_resource over to new_resource."""
+        if old_resource == new_resource:
+            return
+        booking_keys = self.bookings_for_resource(old_resource)
+        self.before_change(booking_keys)
+        for booking_key in booking_keys:
+            booking = self.bookings[booking_key]
+            self.unindex_booking(booking_key, booking)
+            booking["resource"] = new_resource
+            self.index_booking(booking_key, booking)
+        self.notify_edited(booking_keys)
+        if hasattr(self.store, "update_history"):
+            self.store.update_history("resource", old_resource, new_resource)
+        if self.waitlist is not None:
+            self.waitlist.rename_field("resource", old_resource, new_resource)
+
+    def add_booking(self, booking_key, booking):
+        """Adds (or replaces) a booking and keeps the availability index in step."""
+        self.before_change([booking_key])
+        is_new = booking_key not in self.bookings
+        if not is_new:
+            self.unindex_booking(booking_key, self.bookings[booking_key])
+        self.bookings[booking_key] = booking
+        self.index_booking(booking_key, booking)
+        if is_new:
+            self.notify(added=[booking_key])
+
+    def add_bookings(self, items):
+        """Adds new bookings from an iterable of (key, booking) pairs and returns how many were added.
+
+        Each booking is indexed before the next pair is taken, so a generator checking the pairs sees the earlier
+        ones; listeners hear about them all in one notification."""
+        booking_keys = []
+        for booking_key, booking in items:
+            self.before_change([booking_key])
+            self.bookings[booking_key] = booking
+            self.index_booking(booking_key, booking)
+            booking_keys.append(booking_key)
+        self.notify(added=booking_keys)
+        return len(booking_keys)
+
+    def remove_booking(self, booking_key):
+        """Removes a booking by key and returns it, or None if it does not exist."""
+        self.before_change([booking_key])
+        booking = self.bookings.pop(booking_key, None)
+        if booking is not None:
+            self.unindex_booking(booking_key, booking)
+            self.notify(removed=[booking_key])
+            if self.waitlist is not None:
+                #A recurring booking frees everything up to the end of its final occurrence
+                last = collections.deque(occurrences(booking), maxlen=1)
+                if last:
+                    self.released.append((booking["resource"], to_ordinal(booking["start_date"]), last[0][1]))
+        return booking
+
+    def get_record(self, booking_key):
+        """Returns the loaded booking booking_key, or None if there is none."""
+        return self.bookings.get(booking_key)
+
+    def restore_record(self, booking_key, booking):
+        """Puts a booking back as recorded, or removes it if booking is None; used by undo and redo."""
+        if booking is None:
+            self.remove_booking(booking_key)
+        elif booking_key in self.bookings:
+            self.add_booking(booking_key, booking)
+            self.notify_edited([booking_key])
+        else:
+            self.add_booking(booking_key, booking)
+
+    @instrumented
+    def conflicts(self, resource, start_date, end_date, exclude=None):
+        """Returns the keys of bookings on resource overlapping the given dates (inclusive)."""
+        start, end = to_ordinal(start_date), to_ordinal(end_date)
+        resource_index = self.index.get(resource)
+        found = resource_index.overlapping(start, end) if resource_index is not None else []
+        for booking_key, booking in self.recurring.get(resource, {}).items():
+            if next(occurrences(booking, start, end), None) is not None:
+                found.append(booking_key)
+        return [booking_key for booking_key in found if booking_key != exclude]
+
+    def conflicts_with(self, booking, exclude=None):
+        """Returns (day ordinal, keys) for the first occurrence of booking that overlaps other bookings, or None."""
+        for start, end in occurrences(booking):
+            found = self.conflicts(booking["resource"], start, end, exclude)
+            if found:
+                return start, found
+        return None
+
+    @instrumented
+    def is_free(self, resource, start_date, end_date, exclude=None):
+        """Returns True if resource has no bookings overlapping the given dates (inclusive)."""
+        if exclude is not None or self.recurring.get(resource):
+            return not self.conflicts(resource, start_date, end_date, exclude)
+        bitmap = self.occupancy.get(resource)
+        if bitmap is None:
+            return True
+        return not bitmap.overlaps(to_ordinal(start_date), to_ordinal(end_date))
+
+    def busy_days(self, resource, start=None, end=None):
+        """Returns a DayBitmap of the days resource is booked, with recurring occurrences expanded only within [start, end]."""
+        busy = DayBitmap()
+        bitmap = self.occupancy.get(resource)
+        if bitmap is not None and bitmap.bits:
+            busy.base, busy.bits = bitmap.base, bitmap.bits
+        for booking in self.recurring.get(resource, {}).values():
+            for occurrence_start, occurrence_end in occurrences(booking, start, end):
+                busy.add(occurrence_start, occurrence_end)
+        return busy
+
+    def free_windows(self, resource, start, end, length):
+        """Yields the earliest (start, end) ordinal window of length days in each free gap of resource between start and end."""
+        for gap_start, gap_end in self.busy_days(resource, start, end).free_ranges(start, end):
+            if gap_end - gap_start + 1 >= length:
+                yield gap_start, gap_start + length - 1
+
+    def days_booked(self, resource):
+        """Returns the days one-off bookings hold resource in the compact [start, end] ISO range form.
+
+        Recurring bookings are left out: a rule stays one record rather than being expanded into years of ranges."""
+        bitmap = self.occupancy.get(resource)
+        return bitmap.to_json() if bitmap is not None else []
+    
+    def generate_booking_dates(self, resource):
+        """Generates a sorted list of all booked dates for a given resource."""
+        return [datetime.date.fromordinal(day).isoformat() for day in self.busy_days(resource).days()]
+                    
+    def remove_user_bookings(self, user_name):
+        """Removes all bookings for a given user."""
+        for booking_key in self.bookings_owned_by(user_name):
+            self.remove_booking(booking_key)
+        if hasattr(self.store, "delete_history"):
+            self.store.delete_history("owner", user_name)
+        if self.waitlist is not None:
+            self.waitlist.remove_where("owner", user_name)
+    
+    def remove_resource_bookings(self, resource):
+        """Removes all bookings for a given resource."""
+        for booking_key in self.bookings_for_resource(resource):
+            self.remove_booking(booking_key)
+        if hasattr(self.store, "delete_history"):
+            self.store.delete_history("resource", resource)
+        if self.waitlist is not None:
+            self.waitlist.remove_where("resource", resource)
+
+    def search(self, query):
+        """Returns the set of booking names whose name, owner, resource or start date has words starting with every word of query, or None if query is blank."""
+        return self.search_index.search(query, self.bookings)
+
+    def has_booking(self, booking_key):
+        """Returns True if booking_key is taken, including by a booking the store has not loaded or a waiting request."""
+        return (booking_key in self.bookings or (hasattr(self.store, "has_key") and self.store.has_key(booking_key))
+            or (self.waitlist is not None and booking_key in self.waitlist.requests))
+
+    def promote_waiting(self, today=None):
+        """Turns waiting requests into bookings wherever released dates now leave them free; returns the {key: booking} added.
+
+        Only the requests overlapping a range released since the last call are looked at, oldest request first.
+        Requests whose first day has passed are never promoted and wait for their owners to withdraw them."""
+        released, self.released = self.released, []
+        promoted = {}
+        if self.waitlist is None:
+            return promoted
+        today = to_ordinal(today or datetime.date.today())
+        for resource, start, end in released:
+            if end < today:
+                continue
+            for request_key in self.waitlist.overlapping(resource, max(start, today), end):
+                request = self.waitlist.requests[request_key]
+                if to_ordinal(request["start_date"]) >= today and self.is_free(resource, request["start_date"], request["end_date"]):
+                    self.waitlist.remove_request(request_key)
+                    booking = {field: request[field] for field in ("owner", "resource", "start_date", "end_date")}
+                    self.add_booking(request_key, booking)
+                    promoted[request_key] = booking
+        return promoted
+
+    @instrumented
+    def history(self, start_date=None, end_date=None, page=0, page_size=100):
+        """Returns one page of (key, booking) pairs of past bookings overlapping the optional dates.
+
+        Archived bookings come first, then the past bookings still in the live store, each ordered by start date."""
+        archived = self.archive.query(start_date, end_date) if self.archive is not None else []
+        first = page * page_size
+        rows = archived[first:first + page_size]
+        if len(rows) < page_size:
+            rows += self.live_history(start_date, end_date, max(first - len(archived), 0), page_size - len(rows))
+        return rows
+
+    def live_history(self, start_date=None, end_date=None, offset=0, limit=100):
+        """Returns up to limit (key, booking) pairs of past bookings in the live store, by start date.
+
+        Lazy stores read these from disk; otherwise they are the finished one-off bookings held in memory."""
+        if hasattr(self.store, "history"):
+            return self.store.history(start_date, end_date, offset, limit)
+        today = datetime.date.today().isoformat()
+        past = sorted((booking["start_date"], booking_key) for booking_key, booking in self.bookings.items()
+            if booking["end_date"] < today and not booking.get("repeat")
+            and (start_date is None or booking["end_date"] >= str(start_date)) and (end_date is None or booking["start_date"] <= str(end_date)))
+        return [(booking_key, self.bookings[booking_key]) for _, booking_key in past[offset:offset + limit]]
+
+    def bookings_between(self, start_date=None, end_date=None, page_size=10000):
+        """Yields (key, booking) for every archived, unloaded and loaded booking that may overlap the optional dates.
+
+        Loaded bookings are yielded whether or not they overlap; recurring ones need their occurrences checked anyway."""
+        if self.archive is not None:
+            yield from self.archive.query(start_date, end_date)
+        if hasattr(self.store, "history"):
+            offset = 0
+            while True:
+                rows = self.store.history(start_date, end_date, offset, page_size)
+                yield from rows
+                if len(rows) < page_size:
+                    break
+                offset += page_size
+        yield from self.bookings.items()
+
+    @instrumented
+    def archive_finished(self, before=None):
+        """Moves bookings whose last day is before the given date (default today) into the archive.
+
+        Returns the archived {key: booking}; the caller saves the live store afterwards."""
+        before = str(before or datetime.date.today())
+        finished = {}
+        for booking_key, booking in self.bookings.items():
+            if booking.get("repeat"):
+                #A rule is finished once its final occurrence is
+                last = collections.deque(occurrences(booking), maxlen=1)
+                last_day = datetime.date.fromordinal(last[0][1]).isoformat() if last else booking["end_date"]
+            else:
+                last_day = booking["end_date"]
+            if last_day < before:
+                finished[booking_key] = (last_day, booking)
+        if hasattr(self.store, "history"):
+            for booking_key, booking in self.store.history(None, None, 0, -1):
+                if booking["end_date"] < before:
+                    finished[booking_key] = (booking["end_date"], booking)
+                    self.store.delete_history("key", booking_key)
+        if finished:
+            #Archive first: a crash before the live store is saved leaves duplicates, which queries collapse by key
+            self.archive.append(finished)
+        for booking_key in finished:
+            self.remove_booking(booking_key)
+        return {booking_key: booking for booking_key, (_, booking) in finished.items()}
+
+class BookingError(Exception):
+    """Base class for errors raised by BookingService; the message is meant to be shown to the user."""
+
+class ValidationError(BookingError):
+    """Raised when a value is empty, malformed or not allowed."""
+
+class NotFoundError(BookingError):
+    """Raised when a user, resource or booking does not exist."""
+
+class AlreadyExistsError(BookingError):
+    """Raised when a new or changed name is already taken."""
+
+class ConflictError(BookingError):
+    """Raised when a booking would overlap another booking of the same resource."""
+
+class AuthenticationError(BookingError):
+    """Raised when a password does not match."""
+
+#Default for edit arguments whose None value is meaningful (a resource owner of None means unowned)
+UNCHANGED = object()
+
+class CommandLog:
+    """Undo and redo history of service commands.
+
+    A step holds shallow copies of only the records its command changed, before and after, so the log grows
+    with the size of the edits rather than the size of the stores."""
+    def __init__(self, models, limit=100):
+        """Starts an empty log over the given models, keeping at most limit steps to undo."""
+        self.models = models
+        self.limit = limit
+        self.undo_steps = []
+        self.redo_steps = []
+        self.step = None
+        for model in models:
+            model.recorder = self.remember
+            model.subscribe(self.apply)
+
+    def remember(self, model, keys):
+        """Copies the records of keys before model changes them, the first time the current step touches each."""
+        if self.step is None:
+            return
+        before = self.step.setdefault(model, {})
+        for key in keys:
+            if key not in before:
+                record = model.get_record(key)
+                before[key] = None if record is None else dict(record)
+
+    def apply(self, added, removed, reset=False):
+        """Change notification listener; a reload or merge replaces the records the steps refer to, so it clears the log."""
+        if reset:
+            self.clear()
+
+    def clear(self):
+        """Forgets every step."""
+        self.undo_steps = []
+        self.redo_steps = []
+
+    def pending_history(self):
+        """Returns {model: queued statements} for the models whose store queues changes to unloaded records."""
+        return {model: model.store.pending for model in self.models if hasattr(model.store, "pending")}
+
+    @contextlib.contextmanager
+    def record(self, name):
+        """Records everything changed inside the with block as one step called name; nested blocks join the outer step.
+
+        If the block raises, whatever it had already changed is put back."""
+        if self.step is not None:
+            yield
+            return
+        self.step = {}
+        queued = {model: len(pending) for model, pending in self.pending_history().items()}
+        try:
+            yield
+        except BaseException:
+            self.take_back(self.finish_step(name, queued))
+            raise
+        step = self.finish_step(name, queued)
+        if step["changes"] or step["history"]:
+            self.undo_steps.append(step)
+            del self.undo_steps[:-self.limit]
+            self.redo_steps = []
+
+    def finish_step(self, name, queued):
+        """Ends the current step and returns it as {"name", "changes": {model: {key: (before, after)}}, "history"}.
+
+        queued gives the number of statements each model's store had queued when the step began."""
+        before, self.step = self.step, None
+        changes = {}
+        for model, records in before.items():
+            changed = {}
+            for key, old in records.items():
+                record = model.get_record(key)
+                new = None if record is None else dict(record)
+                if new != old:
+                    changed[key] = (old, new)
+            if changed:
+                changes[model] = changed
+        history = {model: pending[queued[model]:] for model, pending in self.pending_history().items() if len(pending) > queued[model]}
+        return {"name": name, "changes": changes, "history": history}
+
+    def restore(self, step, side):
+        """Puts back the records of a step as they were before (side 0) or after (side 1) it."""
+        for model, changed in step["changes"].items():
+            for key, versions in changed.items():
+                record = versions[side]
+                model.restore_record(key, None if record is None else dict(record))
+
+    def take_back(self, step):
+        """Reverts a step's records and drops the statements it queued for unloaded records."""
+        self.restore(step, 0)
+        for model, statements in step["history"].items():
+            queued = set(map(id, statements))
+            model.store.pending[:] = [statement for statement in model.store.pending if id(statement) not in queued]
+
+    def undo(self):
+        """Reverts the last step and returns its name."""
+        if not self.undo_steps:
+            raise ValidationError("Nothing to undo.")
+        step = self.undo_steps.pop()
+        self.take_back(step)
+        self.redo_steps.append(step)
+        return step["name"]
+
+    def redo(self):
+        """Applies the last undone step again and returns its name."""
+        if not self.redo_steps:
+            raise ValidationError("Nothing to redo.")
+        step = self.redo_steps.pop()
+        self.restore(step, 1)
+        for model, statements in step["history"].items():
+            model.store.pending.extend(statements)
+        self.undo_steps.append(step)
+        return step["name"]
+
+    def saved(self):
+        """Drops the last step whose changes to unloaded records were just written, and every step before it.
+
+        Those rows were changed on disk without being loaded, so there is no copy to put back."""
+        for index in range(len(self.undo_steps) - 1, -1, -1):
+            if self.undo_steps[index]["history"]:
+                del self.undo_steps[:index + 1]
+                return
+
+def command(method):
+    """Decorator making each call of a BookingService method one undoable step of the service's command log."""
+    name = method.__name__.replace("_", " ")
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.log.record(name):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class BookingService:
+    """Validated create, edit and delete operations over Users, Resources and Bookings, with no GUI."""
+    def __init__(self, users, resources, bookings):
+        """Initializes the service over already loaded model objects, with an empty undo history."""
+        self.users = users
+        self.resources = resources
+        self.bookings = bookings
+        self.log = CommandLog((users, resources, bookings) + ((bookings.waitlist,) if bookings.waitlist is not None else ()))
+
+    def require_user(self, user_name, role="User"):
+        """Returns user_name if the user exists."""
+        if not user_name:
+            raise ValidationError(f"{role} name cannot be empty.")
+        if user_name not in self.users.users:
+            raise NotFoundError(f"{role} does not exist. Please enter a valid username.")
+        return user_name
+
+    def require_new_user_name(self, user_name, current=None):
+        """Returns user_name if it can be used for a new (or the current) user."""
+        if not user_name:
+            raise ValidationError("Username cannot be empty.")
+        if user_name != current and user_name in self.users.users:
+            raise AlreadyExistsError("User already exists.")
+        return user_name
+
+    def require_password(self, password):
+        """Returns password if it is not empty."""
+        if not password:
+            raise ValidationError("Password cannot be empty.")
+        return password
+
+    def require_resource(self, resource_name):
+        """Returns resource_name if the resource exists."""
+        if not resource_name:
+            raise ValidationError("Resource name cannot be empty.")
+        if resource_name not in self.resources.resources:
+            raise NotFoundError("Resource does not exist. Please enter a valid resource name.")
+        return resource_name
+
+    def require_bookable_resource(self, resource_name):
+        """Returns resource_name if the resource exists and is available."""
+        self.require_resource(resource_name)
+        if not self.resources.resources[resource_name]["available"]:
+            raise ValidationError("Resource is not available for booking.")
+        return resource_name
+
+    def require_new_resource_name(self, resource_name, current=None):
+        """Returns resource_name if it can be used for a new (or the current) resource."""
+        if not resource_name:
+            raise ValidationError("Resource name cannot be empty.")
+        if resource_name != current and resource_name in self.resources.resources:
+            raise AlreadyExistsError("Resource already exists.")
+        return resource_name
+
+    def require_booking(self, booking_name):
+        """Returns booking_name if the booking exists."""
+        if booking_name not in self.bookings.bookings:
+            raise NotFoundError("Booking does not exist.")
+        return booking_name
+
+    def require_new_booking_name(self, booking_name, current=None):
+        """Returns booking_name if it can be used for a new (or the current) booking."""
+        if not booking_name:
+            raise ValidationError("Booking name cannot be empty.")
+        if booking_name != current and self.bookings.has_booking(booking_name):
+            raise AlreadyExistsError("Booking already exists.")
+        return booking_name
+
+    def parse_date(self, value):
+        """Returns value as a date, accepting a date or a YYYY-MM-DD string."""
+        if isinstance(value, datetime.date):
+            return value
+        if not value:
+            raise ValidationError("Booking date cannot be empty.")
+        try:
+            return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+        except ValueError:
+            raise ValidationError("Invalid date format. Please use YYYY-MM-DD.")
+
+    def parse_number(self, value, minimum, label):
+        """Returns value as an int no smaller than minimum, accepting an int or a digit string."""
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError(f"{label} must be a whole number.")
+        if number < minimum:
+            raise ValidationError(f"{label} must be at least {minimum}.")
+        return number
+
+    def check_start_date(self, resource_name, start_date, exclude=None):
+        """Returns the parsed start date if it is not in the past and the resource is free on it."""
+        start_date = self.parse_date(start_date)
+        if start_date < datetime.date.today():
+            raise ValidationError("Booking date cannot be in the past.")
+        if not self.bookings.is_free(resource_name, start_date, start_date, exclude):
+            raise ConflictError("Resource is already booked for this date.")
+        return start_date
+
+    def check_end_date(self, resource_name, start_date, end_date, exclude=None):
+        """Returns the parsed end date if it is after start_date and the resource is free throughout."""
+        end_date = self.parse_date(end_date)
+        if end_date <= start_date:
+            raise ValidationError("End date must be after start date.")
+        if not self.bookings.is_free(resource_name, start_date, end_date, exclude):
+            raise ConflictError("Resource is already booked within these dates.")
+        return end_date
+
+    def find_free_windows(self, start_date, end_date, length, count=5, matching=""):
+        """Returns up to count (resource, start, end) windows of length days, earliest first, between start_date and end_date.
+
+        Only available resources whose name or description contains matching are searched, and past days are skipped."""
+        start_date = max(self.parse_date(start_date), datetime.date.today())
+        end_date = self.parse_date(end_date)
+        length = self.parse_number(length, 2, "Window length")
+        count = self.parse_number(count, 1, "Number of windows")
+        if end_date < start_date:
+            raise ValidationError("End date must not be before start date.")
+        matching = matching.lower()
+        def windows(resource_name):
+            for start, end in self.bookings.free_windows(resource_name, start_date.toordinal(), end_date.toordinal(), length):
+                yield start, resource_name, end
+        #Each resource yields its windows in date order, so merging them finds the earliest without scanning every day
+        candidates = [windows(resource_name) for resource_name, resource in self.resources.resources.items()
+            if resource.get("available") and (matching in resource_name.lower() or matching in (resource.get("description") or "").lower())]
+        return [(resource_name, datetime.date.fromordinal(start).isoformat(), datetime.date.fromordinal(end).isoformat())
+            for start, resource_name, end in itertools.islice(heapq.merge(*candidates), count)]
+
+    def sync_days_booked(self):
+        """Copies the compact booked day ranges into the record of each resource whose bookings changed since the last call.
+
+        This runs once per save rather than after every change, since each copy costs as much as the resource's ranges."""
+        for resource_name in self.bookings.stale_resources:
+            if resource_name in self.resources.resources:
+                self.resources.resources[resource_name]["days_booked"] = self.bookings.days_booked(resource_name)
+                self.resources.mark_changed([resource_name])
+        self.bookings.stale_resources.clear()
+
+    def authenticate(self, user_name, password):
+        """Raises AuthenticationError unless password is correct for user_name."""
+        self.require_user(user_name)
+        self.require_password(password)
+        if not self.users.check_password(user_name, password):
+            raise AuthenticationError("Incorrect password.")
+
+    @command
+    def create_user(self, user_name, full_name, password):
+        """Creates a new user."""
+        self.require_new_user_name(user_name)
+        self.require_password(password)
+        self.users.add_user(user_name, {"full_name": full_name or ""})
+        self.users.set_password(user_name, password)
+
+    @command
+    def edit_user(self, user_name, new_user_name=None, full_name=None, password=None):
+        """Edits a user, carrying a rename over to their bookings and resources."""
+        self.require_user(user_name)
+        if new_user_name is not None and new_user_name != user_name:
+            self.require_new_user_name(new_user_name)
+            self.users.rename_user(user_name, new_user_name)
+            self.bookings.rename_owner(user_name, new_user_name)
+            self.resources.update_owners(user_name, new_user_name)
+            user_name = new_user_name
+        if full_name is not None:
+            self.users.update_user(user_name, full_name=full_name)
+        if password:
+            self.users.set_password(user_name, password)
+
+    @command
+    def delete_user(self, user_name, new_owner=None):
+        """Deletes a user and their bookings, handing their resources to new_owner (or to nobody)."""
+        self.require_user(user_name)
+        if new_owner is not None:
+            self.require_user(new_owner, "New owner")
+            if new_owner == user_name:
+                raise ValidationError("New owner must be a different user.")
+        self.resources.update_owners(user_name, new_owner)
+        self.bookings.remove_user_bookings(user_name)
+        self.users.delete_user(user_name)
+        self.promote_waiting()
+
+    @command
+    def create_resource(self, resource_name, description="", available=True, owner=None):
+        """Creates a new resource."""
+        self.require_new_resource_name(resource_name)
+        if owner is not None:
+            self.require_user(owner, "Owner")
+        self.resources.add_resource(resource_name, {
+            "description": description or "",
+            "available": bool(available),
+            "owner": owner
+        })
+
+    @command
+    def edit_resource(self, resource_name, new_resource_name=None, description=None, available=None, owner=UNCHANGED):
+        """Edits a resource, carrying a rename over to its bookings."""
+        self.require_resource(resource_name)
+        fields = {}
+        if description is not None:
+            fields["description"] = description
+        if available is not None:
+            fields["available"] = bool(available)
+        if owner is not UNCHANGED:
+            if owner is not None:
+                self.require_user(owner, "Owner")
+            fields["owner"] = owner
+        if new_resource_name is not None and new_resource_name != resource_name:
+            self.require_new_resource_name(new_resource_name)
+            self.resources.rename_resource(resource_name, new_resource_name)
+            self.bookings.rename_resource(resource_name, new_resource_name)
+            resource_name = new_resource_name
+        self.resources.update_resource(resource_name, **fields)
+
+    @command
+    def delete_resource(self, resource_name):
+        """Deletes a resource and its bookings."""
+        self.require_resource(resource_name)
+        self.resources.remove_resource(resource_name)
+        self.bookings.remove_resource_bookings(resource_name)
+
+    def check_repeat(self, booking, repeat, exclude=None):
+        """Returns the normalized repeat rule for booking if it is valid and none of its occurrences conflict."""
+        if not isinstance(repeat, dict) or repeat.get("every") not in ("daily", "weekly", "monthly"):
+            raise ValidationError("Repeat must be daily, weekly or monthly.")
+        rule = {"every": repeat["every"], "interval": self.parse_number(repeat.get("interval", 1), 1, "Repeat interval")}
+        if bool(repeat.get("count")) == bool(repeat.get("until")):
+            raise ValidationError("Repeat needs either an end date or a number of times.")
+        if repeat.get("count"):
+            rule["count"] = self.parse_number(repeat["count"], 1, "Number of times")
+        else:
+            until = self.parse_date(repeat["until"])
+            if until.isoformat() < booking["start_date"]:
+                raise ValidationError("Repeat end date must not be before the booking starts.")
+            rule["until"] = until.isoformat()
+        days = to_ordinal(booking["end_date"]) - to_ordinal(booking["start_date"]) + 1
+        if days > REPEAT_DAYS.get(rule["every"], 28) * rule["interval"]:
+            raise ValidationError("Each occurrence must end before the next one starts.")
+        conflict = self.bookings.conflicts_with(dict(booking, repeat=rule), exclude)
+        if conflict is not None:
+            raise ConflictError(f"Resource is already booked during the occurrence starting {datetime.date.fromordinal(conflict[0]).isoformat()}.")
+        return rule
+
+    def check_new_booking(self, booking_name, user_name, resource_name, start_date, end_date, repeat=None):
+        """Returns the record for a new booking after checking the user, the resource and the dates; repeat makes it a recurring rule."""
+        self.require_new_booking_name(booking_name)
+        self.require_user(user_name)
+        self.require_bookable_resource(resource_name)
+        start_date = self.check_start_date(resource_name, start_date)
+        end_date = self.check_end_date(resource_name, start_date, end_date)
+        booking = {
+            "owner": user_name,
+            "resource": resource_name,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+        }
+        if repeat:
+            booking["repeat"] = self.check_repeat(booking, repeat)
+        return booking
+
+    @command
+    def create_booking(self, booking_name, user_name, resource_name, start_date, end_date, repeat=None):
+        """Creates a booking after checking the user, the resource and the dates; repeat makes it a recurring rule."""
+        self.bookings.add_booking(booking_name, self.check_new_booking(booking_name, user_name, resource_name, start_date, end_date, repeat))
+
+    @command
+    def edit_booking(self, booking_name, new_booking_name=None, resource_name=None, start_date=None, end_date=None, repeat=UNCHANGED):
+        """Edits a booking; the booking never conflicts with its own old dates. repeat=None makes it a single booking."""
+        self.require_booking(booking_name)
+        booking = self.bookings.bookings[booking_name]
+        if new_booking_name is None:
+            new_booking_name = booking_name
+        self.require_new_booking_name(new_booking_name, current=booking_name)
+        if resource_name is None:
+            resource_name = booking["resource"]
+        elif resource_name != booking["resource"]:
+            self.require_bookable_resource(resource_name)
+        if repeat is UNCHANGED:
+            repeat = booking.get("repeat")
+        start_date = self.check_start_date(resource_name, start_date or booking["start_date"], exclude=booking_name)
+        end_date = self.check_end_date(resource_name, start_date, end_date or booking["end_date"], exclude=booking_name)
+        edited = {
+            "owner": booking["owner"],
+            "resource": resource_name,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+        }
+        if repeat:
+            edited["repeat"] = self.check_repeat(edited, repeat, exclude=booking_name)
+        self.bookings.remove_booking(booking_name)
+        self.bookings.add_booking(new_booking_name, edited)
+        return self.promote_waiting()
+
+    @command
+    def delete_booking(self, booking_name):
+        """Deletes a booking and returns the keys of the waiting requests booked into the dates it freed."""
+        self.require_booking(booking_name)
+        self.bookings.remove_booking(booking_name)
+        return self.promote_waiting()
+
+    def promote_waiting(self):
+        """Books the waiting requests that removed bookings have made room for and returns their keys."""
+        return sorted(self.bookings.promote_waiting())
+
+    @command
+    def join_waitlist(self, request_name, user_name, resource_name, start_date, end_date):
+        """Queues a request for dates the resource is booked on, to be booked under request_name once they free up."""
+        if self.bookings.waitlist is None:
+            raise ValidationError("No waitlist is configured.")
+        self.require_new_booking_name(request_name)
+        self.require_user(user_name)
+        self.require_bookable_resource(resource_name)
+        start_date = self.parse_date(start_date)
+        if start_date < datetime.date.today():
+            raise ValidationError("Booking date cannot be in the past.")
+        end_date = self.parse_date(end_date)
+        if end_date <= start_date:
+            raise ValidationError("End date must be after start date.")
+        if self.bookings.is_free(resource_name, start_date, end_date):
+            raise ValidationError("Resource is free for these dates, so it can be booked straight away.")
+        self.bookings.waitlist.add_request(request_name, {
+            "owner": user_name,
+            "resource": resource_name,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "requested_at": datetime.datetime.now().isoformat(),
+        })
+
+    @command
+    def leave_waitlist(self, request_name):
+        """Withdraws a waiting request."""
+        if self.bookings.waitlist is None or self.bookings.waitlist.remove_request(request_name) is None:
+            raise NotFoundError("Waiting request does not exist.")
+
+    def save(self):
+        """Saves users, resources and bookings."""
+        self.sync_days_booked()
+        self.users.save_users()
+        self.resources.save_resources()
+        self.bookings.save_bookings()
+        self.log.saved()
+
+    def reload(self):
+        """Throws away every unsaved change by loading the stores again, which also forgets the undo history."""
+        models = [self.users, self.resources, self.bookings]
+        if self.bookings.waitlist is not None:
+            models.append(self.bookings.waitlist)
+        for model in models:
+            if hasattr(model.store, "pending"):
+                model.store.pending.clear()
+        self.users.load_users()
+        self.resources.load_resources()
+        self.bookings.load_bookings()
+        if self.bookings.waitlist is not None:
+            self.bookings.waitlist.load_requests()
+        self.bookings.stale_resources.clear()
+        self.log.clear()
+
+    def undo(self):
+        """Reverts the last command and returns its name, such as "delete user"."""
+        return self.log.undo()
+
+    def redo(self):
+        """Applies the last undone command again and returns its name."""
+        return self.log.redo()
+
+    @command
+    def purge_bookings(self, user_name=None, resource_name=None, before=None):
+        """Deletes, in one pass, the loaded bookings matching every given filter and returns their keys.
+
+        before keeps bookings whose last day is on or after that date; with no filters nothing is purged."""
+        if user_name is None and resource_name is None and before is None:
+            raise ValidationError("Give a user, a resource or a date to purge bookings.")
+        if before is not None:
+            before = self.parse_date(before).isoformat()
+        if user_name is not None:
+            booking_keys = self.bookings.bookings_owned_by(user_name)
+        else:
+            booking_keys = set(self.bookings.bookings)
+        if resource_name is not None:
+            booking_keys &= self.bookings.bookings_for_resource(resource_name)
+        purged = []
+        for booking_key in sorted(booking_keys):
+            booking = self.bookings.bookings[booking_key]
+            if before is not None:
+                #A recurring booking lasts until its final occurrence ends
+                last = collections.deque(occurrences(booking), maxlen=1)
+                if last and last[0][1] >= to_ordinal(before):
+                    continue
+            self.bookings.remove_booking(booking_key)
+            purged.append(booking_key)
+        self.promote_waiting()
+        return purged
+
+    def archive_bookings(self, before=None):
+        """Moves finished bookings into the bookings archive and returns how many were moved."""
+        if self.bookings.archive is None:
+            raise ValidationError("No booking archive is configured.")
+        archived = self.bookings.archive_finished(before)
+        #The archive files are written straight away, so earlier steps could no longer be undone cleanly
+        self.log.clear()
+        return len(archived)
+
+def open_stores(database=None, journal=False, lazy=False):
+    """Returns the users, resources and bookings stores over the default JSON files, journaled JSON files, or a SQLite database file.
+
+    With lazy set, database bookings that finished a while ago are left on disk until asked for."""
+    if database is None and journal:
+        return JournalStore("users.json"), JournalStore("resources.json"), JournalStore("bookings.json")
+    if database is None:
+        return JsonStore("users.json"), JsonStore("resources.json"), JsonStore("bookings.json")
+    return SqliteStore(database, "users"), SqliteStore(database, "resources"), (LazyBookingStore(database) if lazy else SqliteStore(database, "bookings"))
+
+def open_service(database=None, journal=False):
+    """Returns a BookingService over the default JSON files, journaled JSON files, or a SQLite database file."""
+    users_store, resources_store, bookings_store = open_stores(database, journal, lazy=True)
+    if database is not None:
+        waitlist = Waitlist(store=SqliteStore(database, "waitlist"))
+    else:
+        waitlist = Waitlist(store=JournalStore("waitlist.json") if journal else None)
+    return BookingService(Users(store=users_store), Resources(store=resources_store),
+        Bookings(store=bookings_store, archive=BookingArchive(), waitlist=waitlist))
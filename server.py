@@ -0,0 +1,258 @@
+import asyncio
+import contextlib
+import hmac
+import json
+import urllib.parse
+from models import (open_service, hash_password, is_password_hash, verify_password, UNCHANGED, BookingError, ValidationError, NotFoundError,
+    AlreadyExistsError, ConflictError, AuthenticationError)
+
+#HTTP status for each service error type; anything else is a server error
+ERROR_STATUS = {
+    ValidationError: 400,
+    AuthenticationError: 403,
+    NotFoundError: 404,
+    AlreadyExistsError: 409,
+    ConflictError: 409,
+}
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 409: "Conflict", 500: "Internal Server Error"}
+
+class BookingServer:
+    """Serves BookingService operations over HTTP/JSON with asyncio."""
+    def __init__(self, service, save, commit_delay=0.05):
+        """Initializes the server; save is called to persist all stores after changes."""
+        self.service = service
+        self.save = save
+        self.commit_delay = commit_delay
+        self.resource_locks = {}
+        self.pending_commit = None
+
+    def resource_lock(self, resource_name):
+        """Returns the lock serializing booking changes on one resource."""
+        if resource_name not in self.resource_locks:
+            self.resource_locks[resource_name] = asyncio.Lock()
+        return self.resource_locks[resource_name]
+
+    async def commit(self):
+        """Waits until changes made so far are saved; changes from many clients share one save."""
+        loop = asyncio.get_running_loop()
+        if self.pending_commit is None:
+            self.pending_commit = loop.create_future()
+            loop.call_later(self.commit_delay, self.flush)
+        await asyncio.shield(self.pending_commit)
+
+    def flush(self):
+        """Saves all stores and wakes the clients waiting on the commit."""
+        pending_commit, self.pending_commit = self.pending_commit, None
+        try:
+            self.save()
+            pending_commit.set_result(None)
+        except Exception as error:
+            #Every waiting client is told the save failed, so none of their changes may be written by a later save
+            self.service.reload()
+            pending_commit.set_exception(error)
+
+    async def handle_client(self, reader, writer):
+        """Reads one HTTP request from a connection and writes the JSON response."""
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            body = json.loads(await reader.readexactly(length)) if length else {}
+            if not isinstance(body, dict):
+                raise ValueError("the body must be a JSON object")
+            status, payload = await self.dispatch(method, target, body)
+        except (ValueError, KeyError, TypeError) as error:
+            status, payload = 400, {"error": f"Bad request: {error}"}
+        except Exception:
+            status, payload = 500, {"error": "Internal server error."}
+        try:
+            data = json.dumps(payload).encode()
+            writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+            await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def dispatch(self, method, target, body):
+        """Routes a request to the service and returns (status, payload)."""
+        url = urllib.parse.urlsplit(target)
+        path = [urllib.parse.unquote(part) for part in url.path.strip("/").split("/") if part]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        route = (method, path[0] if path else "", len(path))
+        handler = {
+            ("GET", "users", 1): self.list_users,
+            ("POST", "users", 1): self.create_user,
+            ("PATCH", "users", 2): self.edit_user,
+            ("DELETE", "users", 2): self.delete_user,
+            ("GET", "resources", 1): self.list_resources,
+            ("GET", "resources", 3): self.resource_availability,
+            ("POST", "resources", 1): self.create_resource,
+            ("PATCH", "resources", 2): self.edit_resource,
+            ("DELETE", "resources", 2): self.delete_resource,
+            ("GET", "bookings", 1): self.list_bookings,
+            ("POST", "bookings", 1): self.create_booking,
+            ("PATCH", "bookings", 2): self.edit_booking,
+            ("DELETE", "bookings", 2): self.delete_booking,
+        }.get(route)
+        if handler is None:
+            return 404, {"error": "Unknown route."}
+        try:
+            return await handler(path[1:], query, body)
+        except BookingError as error:
+            return ERROR_STATUS.get(type(error), 500), {"error": str(error)}
+
+    async def authenticate(self, user_name, password):
+        """Raises AuthenticationError unless password is correct for user_name, like BookingService.authenticate.
+
+        A password not in the verification cache is hashed on a worker thread, so other clients are served meanwhile;
+        so is the hash replacing a plaintext password left from before hashing."""
+        users = self.service.users
+        self.service.require_user(user_name)
+        self.service.require_password(password)
+        stored = users.users[user_name]["password"]
+        loop = asyncio.get_running_loop()
+        if not is_password_hash(stored):
+            if not hmac.compare_digest(str(stored).encode(), password.encode()):
+                raise AuthenticationError("Incorrect password.")
+            hashed = await loop.run_in_executor(None, hash_password, password)
+            if users.users.get(user_name, {}).get("password") == stored:
+                users.set_password_hash(user_name, hashed)
+                users.verified.add(user_name, hashed, password)
+        elif not users.verified.check(user_name, stored, password):
+            if not await loop.run_in_executor(None, verify_password, password, stored):
+                raise AuthenticationError("Incorrect password.")
+            users.verified.add(user_name, stored, password)
+        #Now a cache hit, unless the user changed while the hash ran
+        self.service.authenticate(user_name, password)
+
+    async def authenticate_owner(self, resource_name, body):
+        """Checks the owner's password for an owned resource; unowned resources are open to anyone."""
+        owner = self.service.resources.resources[self.service.require_resource(resource_name)]["owner"]
+        if owner is not None:
+            await self.authenticate(owner, body.get("password"))
+
+    async def list_users(self, path, query, body):
+        """Returns all users without their passwords."""
+        return 200, {user_name: {"full_name": user.get("full_name", "")} for user_name, user in self.service.users.users.items()}
+
+    async def create_user(self, path, query, body):
+        """Creates a user."""
+        self.service.create_user(body["user_name"], body.get("full_name", ""), body.get("password"))
+        await self.commit()
+        return 201, {"user_name": body["user_name"]}
+
+    async def edit_user(self, path, query, body):
+        """Edits a user after checking their password."""
+        await self.authenticate(path[0], body.get("password"))
+        self.service.edit_user(path[0], body.get("new_user_name"), body.get("full_name"), body.get("new_password"))
+        await self.commit()
+        return 200, {"user_name": body.get("new_user_name") or path[0]}
+
+    async def delete_user(self, path, query, body):
+        """Deletes a user after checking their password."""
+        await self.authenticate(path[0], body.get("password"))
+        self.service.delete_user(path[0], body.get("new_owner"))
+        await self.commit()
+        return 200, {"deleted": path[0]}
+
+    async def list_resources(self, path, query, body):
+        """Returns all resources."""
+        return 200, self.service.resources.resources
+
+    async def resource_availability(self, path, query, body):
+        """Returns whether a resource is free between the start and end query dates."""
+        if path[1] != "availability":
+            return 404, {"error": "Unknown route."}
+        resource_name = self.service.require_resource(path[0])
+        start_date = self.service.parse_date(query.get("start"))
+        end_date = self.service.parse_date(query.get("end", query.get("start")))
+        conflicts = self.service.bookings.conflicts(resource_name, start_date, end_date)
+        return 200, {"free": not conflicts, "conflicts": conflicts}
+
+    async def create_resource(self, path, query, body):
+        """Creates a resource."""
+        self.service.create_resource(body["resource_name"], body.get("description", ""), body.get("available", True), body.get("owner"))
+        await self.commit()
+        return 201, {"resource_name": body["resource_name"]}
+
+    async def edit_resource(self, path, query, body):
+        """Edits a resource after checking its owner's password."""
+        async with self.resource_lock(path[0]):
+            await self.authenticate_owner(path[0], body)
+            self.service.edit_resource(path[0], body.get("new_resource_name"), body.get("description"), body.get("available"), body.get("owner", UNCHANGED))
+            await self.commit()
+        return 200, {"resource_name": body.get("new_resource_name") or path[0]}
+
+    async def delete_resource(self, path, query, body):
+        """Deletes a resource and its bookings after checking its owner's password."""
+        async with self.resource_lock(path[0]):
+            await self.authenticate_owner(path[0], body)
+            self.service.delete_resource(path[0])
+            await self.commit()
+        return 200, {"deleted": path[0]}
+
+    async def list_bookings(self, path, query, body):
+        """Returns all bookings, optionally only those for one resource."""
+        if "resource" in query:
+            bookings = self.service.bookings.bookings
+            return 200, {key: bookings[key] for key in self.service.bookings.bookings_for_resource(query["resource"])}
+        return 200, self.service.bookings.bookings
+
+    async def create_booking(self, path, query, body):
+        """Creates a booking after checking the booking user's password."""
+        await self.authenticate(body["user_name"], body.get("password"))
+        #Holding the lock until the save completes makes the next client for this resource see the booking
+        async with self.resource_lock(body["resource_name"]):
+            self.service.create_booking(body["booking_name"], body["user_name"], body["resource_name"], body["start_date"], body["end_date"], body.get("repeat"))
+            await self.commit()
+        return 201, {"booking_name": body["booking_name"]}
+
+    async def edit_booking(self, path, query, body):
+        """Edits a booking after checking its owner's password."""
+        booking = self.service.bookings.bookings[self.service.require_booking(path[0])]
+        await self.authenticate(booking["owner"], body.get("password"))
+        #Lock both resources in a fixed order when a booking moves between them
+        resource_names = sorted({booking["resource"], body.get("resource_name") or booking["resource"]})
+        async with contextlib.AsyncExitStack() as stack:
+            for resource_name in resource_names:
+                await stack.enter_async_context(self.resource_lock(resource_name))
+            self.service.edit_booking(path[0], body.get("new_booking_name"), body.get("resource_name"), body.get("start_date"), body.get("end_date"),
+                body.get("repeat", UNCHANGED))
+            await self.commit()
+        return 200, {"booking_name": body.get("new_booking_name") or path[0]}
+
+    async def delete_booking(self, path, query, body):
+        """Deletes a booking after checking its owner's password."""
+        booking = self.service.bookings.bookings[self.service.require_booking(path[0])]
+        await self.authenticate(booking["owner"], body.get("password"))
+        async with self.resource_lock(booking["resource"]):
+            self.service.delete_booking(path[0])
+            await self.commit()
+        return 200, {"deleted": path[0]}
+
+async def serve(host="127.0.0.1", port=8080, database=None, journal=False):
+    """Runs the booking server over the default JSON files, journaled JSON files, or a SQLite database if given."""
+    service = open_service(database, journal)
+    booking_server = BookingServer(service, service.save)
+    server = await asyncio.start_server(booking_server.handle_client, host, port)
+    async with server:
+        await server.serve_forever()
+
+async def send_request(host, port, method, path, body=None):
+    """Minimal HTTP/JSON client for the booking server; returns (status, payload)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {urllib.parse.quote(path, safe='/?=&')} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), json.loads(payload)
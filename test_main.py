@@ -3,7 +3,28 @@ from unittest.mock import patch, MagicMock
 import os
 import json
 import time
-from main import Users, Resources, Bookings, App, UserPage, ResourcePage, BookerPage
+import datetime
+import asyncio
+import tempfile
+import contextlib
+import io
+import functools
+from types import SimpleNamespace
+import random
+import subprocess
+import threading
+import sys
+from main import App, UserPage, ResourcePage, BookerPage, VirtualView, SearchBox
+from models import (Users, Resources, Bookings, SqliteStore, JournalStore,
+    BookingService, ValidationError, NotFoundError, AlreadyExistsError, ConflictError, AuthenticationError,
+    is_password_hash, DayBitmap, JsonStore, SaveConflictError, occurrences, to_ordinal, LazyBookingStore,
+    BookingArchive, METRICS, JsonCodec, available_codecs, Waitlist, AvailabilityIndex, encode_record, open_service, hash_password)
+import analytics
+import benchmark
+import integrity
+import cli
+from importer import import_bookings
+from server import BookingServer, send_request
 
 
 class TestGetUsers(unittest.TestCase):
@@ -153,6 +174,40 @@ class TestPageInstantiation(unittest.TestCase):
         self.assertIsInstance(resource_page, ResourcePage)
         self.assertIsInstance(booker_page, BookerPage)
 
+class TestSearchBox(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.resources = Resources(os.path.join(self.directory.name, 'resources.json'))
+        self.resources.add_resource('bench1', {'description': 'lab bench', 'available': True, 'owner': None})
+        self.resources.add_resource('pc', {'description': 'desk', 'available': True, 'owner': None})
+        #Widget-free stand-ins, so the diffing runs without a display
+        self.view = SimpleNamespace(keys=['bench1'], selected_key=None, render=lambda: None)
+        self.view.apply = functools.partial(VirtualView.apply, self.view)
+        box = SimpleNamespace(view=self.view, model=self.resources, entry=SimpleNamespace(get=lambda: 'lab'))
+        self.resources.subscribe(functools.partial(SearchBox.apply, box))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_edits_move_records_in_and_out_of_results(self):
+        self.resources.update_resource('pc', description='lab desk')
+        self.assertEqual(self.view.keys, ['bench1', 'pc'])
+        self.resources.update_resource('bench1', description='spare bench')
+        self.assertEqual(self.view.keys, ['pc'])
+        self.resources.update_resource('pc', description='lab desk by the door')
+        self.assertEqual(self.view.keys, ['pc'])
+
+class TestModelsImport(unittest.TestCase):
+    def test_models_import_without_tk(self):
+        result = subprocess.run([sys.executable, '-c', 'import models, sys; print("tkinter" in sys.modules)'],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_gui_import_skips_headless_modules(self):
+        result = subprocess.run([sys.executable, '-c', 'import main, sys; print(sorted({"cli", "analytics", "integrity", "server"} & set(sys.modules)))'],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), '[]')
+
 class TestScalability(unittest.TestCase):
     def test_scalability_computer_lab(self):
         users_file = "scalability_users.json"
@@ -303,5 +358,1286 @@ class TestPersistence(unittest.TestCase):
         users2.load_users()
         self.assertIn('u1', users2.users)
 
+    def test_opening_and_unchanged_saves_do_not_write(self):
+        with open(self.users_file, 'w') as f:
+            json.dump({'u1': {'full_name': 'U1', 'password': 'p'}}, f, indent=4)
+        with open(self.users_file, 'rb') as f:
+            before = f.read()
+        users = Users(self.users_file)
+        Resources(self.resources_file)
+        users.save_users()
+        with open(self.users_file, 'rb') as f:
+            self.assertEqual(f.read(), before)
+        self.assertFalse(os.path.exists(self.resources_file))
+
+class TestAvailabilityIndex(unittest.TestCase):
+    def setUp(self):
+        self.bookings_file = 'availability_bookings.json'
+        with open(self.bookings_file, 'w') as f:
+            json.dump({
+                'b1': {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-07-01', 'end_date': '2025-07-05'},
+                'b2': {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-07-10', 'end_date': '2025-07-12'},
+                'b3': {'owner': 'u2', 'resource': 'r2', 'start_date': '2025-07-01', 'end_date': '2025-07-31'}
+            }, f)
+        self.bookings = Bookings(self.bookings_file)
+
+    def tearDown(self):
+        if os.path.exists(self.bookings_file):
+            os.remove(self.bookings_file)
+
+    def test_conflicts_after_load(self):
+        self.assertEqual(self.bookings.conflicts('r1', '2025-07-04', '2025-07-10'), ['b1', 'b2'])
+        self.assertEqual(self.bookings.conflicts('r1', '2025-07-06', '2025-07-09'), [])
+        self.assertTrue(self.bookings.is_free('r1', '2025-07-06', '2025-07-09'))
+        self.assertFalse(self.bookings.is_free('r1', '2025-07-12', '2025-07-20'))
+        self.assertTrue(self.bookings.is_free('unknown', '2025-07-01', '2025-07-31'))
+
+    def test_add_and_remove_keep_index_in_step(self):
+        self.bookings.add_booking('b4', {'owner': 'u2', 'resource': 'r1', 'start_date': '2025-07-06', 'end_date': '2025-07-09'})
+        self.assertFalse(self.bookings.is_free('r1', '2025-07-07', '2025-07-07'))
+        self.bookings.remove_booking('b1')
+        self.assertTrue(self.bookings.is_free('r1', '2025-07-01', '2025-07-05'))
+        self.bookings.remove_resource_bookings('r1')
+        self.assertTrue(self.bookings.is_free('r1', '2025-01-01', '2025-12-31'))
+        self.assertIn('b3', self.bookings.bookings)
+
+    def test_exclude_ignores_booking_being_edited(self):
+        self.assertFalse(self.bookings.is_free('r1', '2025-07-02', '2025-07-08'))
+        self.assertTrue(self.bookings.is_free('r1', '2025-07-02', '2025-07-08', exclude='b1'))
+
+    def test_index_matches_scan_after_random_changes(self):
+        rng = random.Random(1)
+        #A few long intervals reach past many later blocks
+        intervals = {f'k{i}': (start, start + rng.randrange(1000 if i % 50 == 0 else 40)) for i, start in enumerate(rng.sample(range(3000), 1500))}
+        with patch.object(AvailabilityIndex, 'BLOCK_SIZE', 8):
+            index = AvailabilityIndex((start, end, key) for key, (start, end) in list(intervals.items())[:700])
+            for key, (start, end) in list(intervals.items())[700:]:
+                index.add(start, end, key)
+            for key in rng.sample(sorted(intervals), 900):
+                self.assertTrue(index.remove(intervals.pop(key)[0], key))
+        for _ in range(200):
+            start = rng.randrange(3100)
+            end = start + rng.randrange(30)
+            expected = sorted((first, key) for key, (first, last) in intervals.items() if first <= end and last >= start)
+            self.assertEqual(index.overlapping(start, end), [key for _, key in expected])
+            self.assertEqual(index.is_free(start, end), not expected)
+
+    def test_generate_booking_dates(self):
+        dates = self.bookings.generate_booking_dates('r1')
+        self.assertEqual(len(dates), 8)
+        self.assertEqual(dates[0], '2025-07-01')
+
+class TestDayBitmap(unittest.TestCase):
+    def setUp(self):
+        self.resources_file = 'bitmap_resources.json'
+        self.bookings_file = 'bitmap_bookings.json'
+        with open(self.resources_file, 'w') as f:
+            json.dump({'r1': {'description': '', 'available': True, 'owner': None,
+                'days_booked': ['2099-07-01', '2099-07-02', '2099-07-03', '2099-07-10']}}, f)
+        with open(self.bookings_file, 'w') as f:
+            json.dump({}, f)
+
+    def tearDown(self):
+        for f in [self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_ranges_and_overlaps(self):
+        bitmap = DayBitmap()
+        bitmap.add(110, 112)
+        bitmap.add(100, 104)
+        bitmap.add(105, 105)
+        self.assertEqual(list(bitmap.ranges()), [(100, 105), (110, 112)])
+        self.assertTrue(bitmap.overlaps(90, 100))
+        self.assertFalse(bitmap.overlaps(106, 109))
+        bitmap.discard(102, 111)
+        self.assertEqual(list(bitmap.ranges()), [(100, 101), (112, 112)])
+        self.assertEqual(list(DayBitmap.from_json(bitmap.to_json()).days()), [100, 101, 112])
+
+    def test_legacy_days_booked_load_as_ranges(self):
+        resources = Resources(self.resources_file)
+        self.assertEqual(resources.resources['r1']['days_booked'], [['2099-07-01', '2099-07-03'], ['2099-07-10', '2099-07-10']])
+
+    def test_save_writes_days_booked_of_changed_resources(self):
+        users = Users('bitmap_users.json')
+        self.addCleanup(os.remove, 'bitmap_users.json')
+        service = BookingService(users, Resources(self.resources_file), Bookings(self.bookings_file))
+        service.create_user('u1', '', 'p1')
+        service.create_booking('b1', 'u1', 'r1', '2099-07-01', '2099-07-04')
+        service.create_booking('b2', 'u1', 'r1', '2099-07-05', '2099-07-06')
+        service.save()
+        self.assertEqual(Resources(self.resources_file).resources['r1']['days_booked'], [['2099-07-01', '2099-07-06']])
+        service.delete_booking('b1')
+        self.assertEqual(service.bookings.stale_resources, {'r1'})
+        service.save()
+        self.assertEqual(service.resources.resources['r1']['days_booked'], [['2099-07-05', '2099-07-06']])
+        self.assertEqual(service.bookings.stale_resources, set())
+        self.assertTrue(service.bookings.is_free('r1', '2099-07-01', '2099-07-04'))
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        self.db_file = 'test_store.db'
+        self.json_file = 'test_store_bookings.json'
+        for f in [self.db_file, self.json_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def tearDown(self):
+        for store in getattr(self, 'stores', []):
+            store.connection.close()
+        for f in [self.db_file, self.json_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def open_bookings(self):
+        store = SqliteStore(self.db_file, 'bookings')
+        self.stores = getattr(self, 'stores', []) + [store]
+        return Bookings(store=store)
+
+    def test_round_trip_and_delete(self):
+        bookings = self.open_bookings()
+        bookings.add_booking('b1', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'})
+        bookings.add_booking('b2', {'owner': 'u2', 'resource': 'r1', 'start_date': '2025-01-05', 'end_date': '2025-01-06'})
+        bookings.save_bookings()
+        bookings.remove_booking('b1')
+        bookings.rename_owner('u2', 'u3')
+        bookings.save_bookings()
+        reopened = self.open_bookings()
+        self.assertEqual(list(reopened.bookings), ['b2'])
+        self.assertEqual(reopened.bookings['b2']['owner'], 'u3')
+        self.assertFalse(reopened.is_free('r1', '2025-01-06', '2025-01-07'))
+
+    def test_save_writes_only_changed_rows(self):
+        bookings = self.open_bookings()
+        bookings.add_booking('b1', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'})
+        bookings.save_bookings()
+        changes = bookings.store.connection.total_changes
+        bookings.save_bookings()
+        self.assertEqual(bookings.store.connection.total_changes, changes)
+
+    def test_save_encodes_only_changed_records(self):
+        bookings = self.open_bookings()
+        bookings.add_bookings((f'b{i}', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'}) for i in range(50))
+        bookings.save_bookings()
+        bookings.remove_booking('b3')
+        bookings.rename_owner('u1', 'u2')
+        bookings.save_bookings()
+        bookings.add_booking('extra', {'owner': 'u2', 'resource': 'r2', 'start_date': '2025-01-01', 'end_date': '2025-01-02'})
+        with patch('models.encode_record', wraps=encode_record) as encode:
+            bookings.save_bookings()
+        self.assertEqual(encode.call_count, 1)
+        reopened = self.open_bookings()
+        self.assertEqual(len(reopened.bookings), 50)
+        self.assertEqual(reopened.bookings_owned_by('u2'), set(reopened.bookings))
+
+    def test_json_import_and_export(self):
+        with open(self.json_file, 'w') as f:
+            json.dump({'b1': {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'}}, f)
+        store = SqliteStore(self.db_file, 'bookings')
+        self.stores = [store]
+        store.import_json(self.json_file)
+        rows = store.connection.execute("SELECT key FROM bookings WHERE resource = 'r1'").fetchall()
+        self.assertEqual(rows, [('b1',)])
+        os.remove(self.json_file)
+        store.export_json(self.json_file)
+        with open(self.json_file) as f:
+            self.assertIn('b1', json.load(f))
+
+class TestLazyBookingStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, 'bookings.db')
+        today = datetime.date.today()
+        day = lambda offset: (today + datetime.timedelta(days=offset)).isoformat()
+        records = {f'old{i}': {'owner': 'u1' if i % 2 else 'u2', 'resource': 'r1', 'start_date': day(-400 + i * 3), 'end_date': day(-399 + i * 3)} for i in range(50)}
+        records['recent'] = {'owner': 'u1', 'resource': 'r1', 'start_date': day(-10), 'end_date': day(-9)}
+        records['future'] = {'owner': 'u1', 'resource': 'r1', 'start_date': day(5), 'end_date': day(6)}
+        records['weekly'] = {'owner': 'u2', 'resource': 'r2', 'start_date': day(-700), 'end_date': day(-699), 'repeat': {'every': 'weekly', 'interval': 1, 'count': 500}}
+        store = SqliteStore(self.db_path, 'bookings')
+        store.save(records)
+        store.connection.close()
+        self.store = LazyBookingStore(self.db_path)
+        self.bookings = Bookings(store=self.store)
+
+    def tearDown(self):
+        self.store.connection.close()
+        self.directory.cleanup()
+
+    def test_only_active_window_and_rules_load(self):
+        self.assertEqual(sorted(self.bookings.bookings), ['future', 'recent', 'weekly'])
+        self.assertTrue(self.bookings.has_booking('old3'))
+        self.assertFalse(self.bookings.has_booking('missing'))
+
+    def test_history_pages_from_disk(self):
+        first_page = self.bookings.history(page=0, page_size=20)
+        self.assertEqual([key for key, _ in first_page], [f'old{i}' for i in range(20)])
+        self.assertEqual(len(self.bookings.history(page=2, page_size=20)), 10)
+        self.assertEqual(self.bookings.history(page=3, page_size=20), [])
+        start = first_page[5][1]['start_date']
+        self.assertEqual([key for key, _ in self.bookings.history(start_date=start, end_date=start)], ['old5'])
+
+    def test_cascades_reach_history_on_save(self):
+        self.bookings.rename_owner('u1', 'one')
+        self.bookings.remove_user_bookings('u2')
+        self.assertEqual(self.bookings.history(page_size=100)[1][1]['owner'], 'u1')
+        self.bookings.save_bookings()
+        history = self.bookings.history(page_size=100)
+        self.assertEqual(len(history), 25)
+        self.assertTrue(all(booking['owner'] == 'one' for _, booking in history))
+        self.assertEqual(Bookings(store=LazyBookingStore(self.db_path)).bookings_owned_by('one'), {'recent', 'future'})
+
+class TestBookingArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.bookings_file = os.path.join(self.directory.name, 'bookings.json')
+        self.archive_dir = os.path.join(self.directory.name, 'archive')
+        JsonStore(self.bookings_file).save({
+            'jan': {'owner': 'u1', 'resource': 'r1', 'start_date': '2024-01-30', 'end_date': '2024-02-02'},
+            'mar': {'owner': 'u1', 'resource': 'r1', 'start_date': '2024-03-01', 'end_date': '2024-03-03'},
+            'rule': {'owner': 'u2', 'resource': 'r2', 'start_date': '2024-01-01', 'end_date': '2024-01-02', 'repeat': {'every': 'monthly', 'interval': 1, 'count': 3}},
+            'open': {'owner': 'u2', 'resource': 'r2', 'start_date': '2024-01-01', 'end_date': '2024-01-02', 'repeat': {'every': 'weekly', 'interval': 1, 'until': '2099-01-01'}},
+            'late': {'owner': 'u2', 'resource': 'r1', 'start_date': '2024-05-01', 'end_date': '2024-05-02'}
+        })
+        self.bookings = Bookings(self.bookings_file, archive=BookingArchive(self.archive_dir))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_finished_bookings_move_to_monthly_partitions(self):
+        archived = self.bookings.archive_finished('2024-04-01')
+        self.assertEqual(sorted(archived), ['jan', 'mar', 'rule'])
+        self.bookings.save_bookings()
+        self.assertEqual(sorted(Bookings(self.bookings_file).bookings), ['late', 'open'])
+        self.assertEqual(self.bookings.archive.months(), ['2024-02', '2024-03'])
+        self.assertTrue(os.path.exists(os.path.join(self.archive_dir, 'bookings-2024-03.jsonl.gz')))
+
+    def test_history_spans_archive_and_live_data(self):
+        self.bookings.archive_finished('2024-02-15')
+        self.bookings.archive_finished('2024-04-01')
+        self.assertEqual([key for key, _ in self.bookings.history()], ['rule', 'jan', 'mar', 'late'])
+        self.assertEqual([key for key, _ in self.bookings.history(page=1, page_size=3)], ['late'])
+        self.assertEqual([key for key, _ in self.bookings.history('2024-02-01', '2024-02-01')], ['rule', 'jan'])
+        self.assertEqual(self.bookings.history('2024-04-01', '2024-04-30'), [])
+
+class TestJournalStore(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_file = 'journal_bookings.json'
+        self.journal_file = 'journal_bookings.json.journal'
+        for f in [self.snapshot_file, self.journal_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def tearDown(self):
+        for f in [self.snapshot_file, self.journal_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_saves_append_only_changes(self):
+        bookings = Bookings(store=JournalStore(self.snapshot_file))
+        bookings.add_booking('b1', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'})
+        bookings.add_booking('b2', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-05', 'end_date': '2025-01-06'})
+        bookings.save_bookings()
+        bookings.remove_booking('b1')
+        bookings.save_bookings()
+        bookings.save_bookings()
+        with open(self.journal_file) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry['op'] for entry in entries], ['put', 'put', 'delete'])
+        reopened = Bookings(store=JournalStore(self.snapshot_file))
+        self.assertEqual(list(reopened.bookings), ['b2'])
+
+    def test_save_encodes_only_changed_records(self):
+        bookings = Bookings(store=JournalStore(self.snapshot_file))
+        bookings.add_bookings((f'b{i}', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'}) for i in range(50))
+        bookings.save_bookings()
+        bookings.remove_booking('b3')
+        with patch('models.encode_record', wraps=encode_record) as encode:
+            bookings.save_bookings()
+        self.assertEqual(encode.call_count, 0)
+        self.assertEqual(len(Bookings(store=JournalStore(self.snapshot_file)).bookings), 49)
+
+    def test_torn_line_is_ignored(self):
+        bookings = Bookings(store=JournalStore(self.snapshot_file))
+        bookings.add_booking('b1', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'})
+        bookings.save_bookings()
+        with open(self.journal_file, 'a') as f:
+            f.write('{"op": "put", "key": "b2", "rec')
+        reopened = Bookings(store=JournalStore(self.snapshot_file))
+        self.assertEqual(list(reopened.bookings), ['b1'])
+        reopened.add_booking('b3', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-02-01', 'end_date': '2025-02-02'})
+        reopened.save_bookings()
+        self.assertEqual(list(Bookings(store=JournalStore(self.snapshot_file)).bookings), ['b1', 'b3'])
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        bookings = Bookings(store=JournalStore(self.snapshot_file, compact_every=3))
+        for i in range(3):
+            bookings.add_booking(f'b{i}', {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-01-01', 'end_date': '2025-01-02'})
+        bookings.save_bookings()
+        self.assertEqual(os.path.getsize(self.journal_file), 0)
+        with open(self.snapshot_file) as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+class TestConcurrentSaves(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.directory.name, 'bookings.json')
+        JsonStore(self.filepath).save({
+            'b1': {'owner': 'u1', 'resource': 'r1', 'start_date': '2099-07-01', 'end_date': '2099-07-02'},
+            'b2': {'owner': 'u2', 'resource': 'r1', 'start_date': '2099-07-05', 'end_date': '2099-07-06'}
+        })
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_json_store_merges_other_changes(self):
+        first, second = JsonStore(self.filepath), JsonStore(self.filepath)
+        mine, theirs = first.load(), second.load()
+        theirs['b3'] = {'owner': 'u2', 'resource': 'r2', 'start_date': '2099-07-01', 'end_date': '2099-07-01'}
+        del theirs['b2']
+        self.assertFalse(second.save(theirs))
+        mine['b1']['owner'] = 'u3'
+        self.assertTrue(first.save(mine))
+        self.assertEqual(sorted(mine), ['b1', 'b3'])
+        self.assertEqual(JsonStore(self.filepath).load(), mine)
+
+    def test_conflicting_changes_are_reported_without_writing(self):
+        first, second = JournalStore(self.filepath), JournalStore(self.filepath)
+        mine, theirs = first.load(), second.load()
+        theirs['b1']['end_date'] = '2099-07-03'
+        second.save(theirs)
+        mine['b1']['end_date'] = '2099-07-04'
+        mine['b4'] = {'owner': 'u1', 'resource': 'r1', 'start_date': '2099-08-01', 'end_date': '2099-08-01'}
+        with self.assertRaises(SaveConflictError) as context:
+            first.save(mine)
+        self.assertEqual(context.exception.keys, ['b1'])
+        self.assertEqual(JournalStore(self.filepath).load(), theirs)
+
+    def test_models_rebuild_indexes_after_merge(self):
+        first, second = Bookings(self.filepath), Bookings(self.filepath)
+        second.add_booking('b3', {'owner': 'u2', 'resource': 'r2', 'start_date': '2099-07-01', 'end_date': '2099-07-03'})
+        second.save_bookings()
+        first.remove_booking('b1')
+        first.save_bookings()
+        self.assertEqual(sorted(first.bookings), ['b2', 'b3'])
+        self.assertFalse(first.is_free('r2', '2099-07-02', '2099-07-02'))
+        self.assertEqual(sorted(Bookings(self.filepath).bookings), ['b2', 'b3'])
+
+class TestSecondaryIndexes(unittest.TestCase):
+    def setUp(self):
+        self.resources_file = 'index_resources.json'
+        self.bookings_file = 'index_bookings.json'
+        with open(self.resources_file, 'w') as f:
+            json.dump({
+                'r1': {'description': '', 'available': True, 'owner': 'u1'},
+                'r2': {'description': '', 'available': True, 'owner': 'u2'}
+            }, f)
+        with open(self.bookings_file, 'w') as f:
+            json.dump({
+                'b1': {'owner': 'u1', 'resource': 'r1', 'start_date': '2025-07-01', 'end_date': '2025-07-02'},
+                'b2': {'owner': 'u1', 'resource': 'r2', 'start_date': '2025-07-01', 'end_date': '2025-07-02'},
+                'b3': {'owner': 'u2', 'resource': 'r1', 'start_date': '2025-07-05', 'end_date': '2025-07-06'}
+            }, f)
+        self.resources = Resources(self.resources_file)
+        self.bookings = Bookings(self.bookings_file)
+
+    def tearDown(self):
+        for f in [self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_indexes_built_on_load(self):
+        self.assertEqual(self.bookings.bookings_owned_by('u1'), {'b1', 'b2'})
+        self.assertEqual(self.bookings.bookings_for_resource('r1'), {'b1', 'b3'})
+        self.assertEqual(self.resources.resources_owned_by('u2'), {'r2'})
+
+    def test_cascade_delete_touches_only_matching_rows(self):
+        self.bookings.remove_user_bookings('u1')
+        self.assertEqual(list(self.bookings.bookings), ['b3'])
+        self.assertEqual(self.bookings.bookings_for_resource('r1'), {'b3'})
+        self.bookings.remove_resource_bookings('r1')
+        self.assertEqual(self.bookings.bookings, {})
+
+    def test_renames_keep_indexes_consistent(self):
+        self.bookings.rename_owner('u1', 'u9')
+        self.resources.update_owners('u1', 'u9')
+        self.assertEqual(self.bookings.bookings['b1']['owner'], 'u9')
+        self.assertEqual(self.bookings.bookings_owned_by('u9'), {'b1', 'b2'})
+        self.assertEqual(self.resources.resources_owned_by('u9'), {'r1'})
+        self.resources.rename_resource('r1', 'lab')
+        self.bookings.rename_resource('r1', 'lab')
+        self.assertEqual(self.resources.resources_owned_by('u9'), {'lab'})
+        self.assertEqual(self.bookings.bookings_for_resource('lab'), {'b1', 'b3'})
+        self.assertFalse(self.bookings.is_free('lab', '2025-07-05', '2025-07-05'))
+        self.assertTrue(self.bookings.is_free('r1', '2025-07-05', '2025-07-05'))
+        self.bookings.save_bookings()
+        self.bookings.load_bookings()
+        self.assertEqual(self.bookings.bookings_for_resource('lab'), {'b1', 'b3'})
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.users_file = 'search_users.json'
+        self.resources_file = 'search_resources.json'
+        self.bookings_file = 'search_bookings.json'
+        for f in [self.users_file, self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+        self.service = BookingService(Users(self.users_file), Resources(self.resources_file), Bookings(self.bookings_file))
+        self.start = datetime.date.today() + datetime.timedelta(days=1)
+        self.service.create_user('alice', 'Alice Smith', 'p1')
+        self.service.create_user('bob', 'Bob Smithers', 'p2')
+        self.service.create_resource('lab1', 'Physics lab', True, 'alice')
+        self.service.create_booking('b1', 'bob', 'lab1', self.start, self.start + datetime.timedelta(days=1))
+
+    def tearDown(self):
+        for f in [self.users_file, self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_prefix_and_multi_word_search(self):
+        users = self.service.users
+        self.assertEqual(users.search('smi'), {'alice', 'bob'})
+        self.assertEqual(users.search('SMITH al'), {'alice'})
+        self.assertEqual(users.search('carol'), set())
+        self.assertIsNone(users.search('  '))
+        self.assertEqual(self.service.resources.search('phys ali'), {'lab1'})
+        self.assertEqual(self.service.bookings.search('bob lab'), {'b1'})
+        self.assertEqual(self.service.bookings.search(str(self.start.year)), {'b1'})
+
+    def test_index_follows_edits(self):
+        users = self.service.users
+        users.search('a')
+        self.service.edit_user('alice', 'carol', full_name='Carol Jones')
+        self.assertEqual(users.search('smith'), {'bob'})
+        self.assertEqual(users.search('jon'), {'carol'})
+        self.assertEqual(self.service.resources.search('carol'), {'lab1'})
+        self.service.edit_resource('lab1', description='Chemistry lab')
+        self.assertEqual(self.service.resources.search('phys'), set())
+        self.assertEqual(self.service.resources.search('chem'), {'lab1'})
+        self.service.delete_user('bob')
+        self.assertEqual(users.search('bob'), set())
+        self.assertEqual(self.service.bookings.search('b1'), set())
+        users.load_users()
+        self.assertEqual(users.search('alice'), set())
+
+    def test_search_over_100k_entries_reads_no_records(self):
+        bookings = Bookings('search_scale.json', store=JsonStore(os.devnull))
+        bookings.bookings = {f'booking{i}': {'owner': f'user{i % 1000}', 'resource': f'PC{i % 250}', 'start_date': '2030-01-01', 'end_date': '2030-01-02'} for i in range(100000)}
+        bookings.search('warm up')
+        #Once built, the index answers from its postings without looking at a single record
+        with patch.object(bookings.search_index, 'lookup', side_effect=AssertionError):
+            found = bookings.search('user12 pc12')
+        expected = {key for key, booking in bookings.bookings.items() if booking['owner'].startswith('user12') and booking['resource'].startswith('PC12')}
+        self.assertEqual(found, expected)
+
+class TestBookingService(unittest.TestCase):
+    def setUp(self):
+        self.users_file = 'service_users.json'
+        self.resources_file = 'service_resources.json'
+        self.bookings_file = 'service_bookings.json'
+        for f in [self.users_file, self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+        self.service = BookingService(Users(self.users_file), Resources(self.resources_file), Bookings(self.bookings_file))
+        self.start = datetime.date.today() + datetime.timedelta(days=1)
+        self.service.create_user('u1', 'User One', 'p1')
+        self.service.create_user('u2', '', 'p2')
+        self.service.create_resource('r1', 'Room', True, 'u1')
+        self.service.create_booking('b1', 'u1', 'r1', self.start, self.start + datetime.timedelta(days=3))
+
+    def tearDown(self):
+        for f in [self.users_file, self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_typed_errors(self):
+        with self.assertRaises(AlreadyExistsError):
+            self.service.create_user('u1', '', 'p')
+        with self.assertRaises(ValidationError):
+            self.service.create_user('u3', '', '')
+        with self.assertRaises(NotFoundError):
+            self.service.create_resource('r2', '', True, 'nobody')
+        with self.assertRaises(ValidationError):
+            self.service.create_booking('b2', 'u2', 'r1', 'not a date', '2099-01-01')
+        with self.assertRaises(AuthenticationError):
+            self.service.authenticate('u1', 'wrong')
+        self.service.authenticate('u1', 'p1')
+
+    def test_booking_conflicts(self):
+        with self.assertRaises(ConflictError):
+            self.service.create_booking('b2', 'u2', 'r1', self.start + datetime.timedelta(days=2), self.start + datetime.timedelta(days=5))
+        self.service.create_booking('b2', 'u2', 'r1', self.start + datetime.timedelta(days=4), self.start + datetime.timedelta(days=5))
+        self.service.edit_booking('b1', 'moved', end_date=self.start + datetime.timedelta(days=1))
+        self.assertNotIn('b1', self.service.bookings.bookings)
+        self.assertEqual(self.service.bookings.bookings['moved']['owner'], 'u1')
+        with self.assertRaises(ConflictError):
+            self.service.edit_booking('moved', end_date=self.start + datetime.timedelta(days=4))
+
+    def test_user_rename_and_delete_cascade(self):
+        self.service.edit_user('u1', 'one', full_name='Renamed')
+        self.assertEqual(self.service.resources.resources['r1']['owner'], 'one')
+        self.assertEqual(self.service.bookings.bookings['b1']['owner'], 'one')
+        self.service.delete_user('one', new_owner='u2')
+        self.assertEqual(self.service.resources.resources['r1']['owner'], 'u2')
+        self.assertEqual(self.service.bookings.bookings, {})
+        self.assertNotIn('one', self.service.users.users)
+
+    def test_resource_rename_and_delete_cascade(self):
+        self.service.edit_resource('r1', 'lab', available=False, owner=None)
+        self.assertEqual(self.service.resources.resources['lab']['owner'], None)
+        self.assertEqual(self.service.bookings.bookings['b1']['resource'], 'lab')
+        with self.assertRaises(ValidationError):
+            self.service.create_booking('b2', 'u2', 'lab', self.start + datetime.timedelta(days=10), self.start + datetime.timedelta(days=11))
+        self.service.delete_resource('lab')
+        self.assertEqual(self.service.bookings.bookings, {})
+
+    def test_find_free_windows(self):
+        day = lambda offset: (self.start + datetime.timedelta(days=offset)).isoformat()
+        self.service.create_resource('r2', 'Lab PC', True, 'u2')
+        self.service.create_resource('r3', 'Lab PC', False, 'u2')
+        self.service.create_booking('b2', 'u2', 'r2', self.start, self.start + datetime.timedelta(days=1))
+        self.service.create_booking('b3', 'u2', 'r1', self.start + datetime.timedelta(days=6), self.start + datetime.timedelta(days=8))
+        windows = self.service.find_free_windows(self.start, self.start + datetime.timedelta(days=20), 2, count=3)
+        self.assertEqual(windows, [('r2', day(2), day(3)), ('r1', day(4), day(5)), ('r1', day(9), day(10))])
+        self.assertEqual(self.service.find_free_windows(self.start, day(20), '3', matching='lab'), [('r2', day(2), day(4))])
+        self.assertEqual(self.service.find_free_windows(self.start, day(5), 5, matching='room'), [])
+        with self.assertRaises(ValidationError):
+            self.service.find_free_windows(self.start, day(5), 1)
+
+class TestCommandLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'undo.db')
+        self.service = self.open()
+        self.start = datetime.date.today() + datetime.timedelta(days=1)
+        self.service.create_user('u1', 'User One', 'p1')
+        self.service.create_user('u2', '', 'p2')
+        self.service.create_resource('r1', 'Room', True, 'u1')
+        self.service.create_booking('b1', 'u1', 'r1', self.start, self.start + datetime.timedelta(days=3))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open(self):
+        return BookingService(Users(store=SqliteStore(self.database, 'users')), Resources(store=SqliteStore(self.database, 'resources')),
+            Bookings(store=LazyBookingStore(self.database)))
+
+    def test_undo_and_redo_delete_user_cascade(self):
+        self.service.save()
+        days_booked = self.service.resources.resources['r1']['days_booked']
+        self.service.delete_user('u1', new_owner='u2')
+        self.assertEqual(self.service.undo(), 'delete user')
+        self.assertEqual(self.service.users.users['u1']['full_name'], 'User One')
+        self.assertEqual(self.service.resources.resources['r1']['owner'], 'u1')
+        self.service.save()
+        self.assertEqual(self.service.resources.resources['r1']['days_booked'], days_booked)
+        self.assertEqual(self.service.bookings.bookings_owned_by('u1'), {'b1'})
+        self.assertFalse(self.service.bookings.is_free('r1', self.start, self.start))
+        self.assertEqual(self.service.resources.search('u1'), {'r1'})
+        self.service.authenticate('u1', 'p1')
+        self.assertEqual(self.service.redo(), 'delete user')
+        self.assertNotIn('u1', self.service.users.users)
+        self.assertEqual(self.service.resources.resources_owned_by('u2'), {'r1'})
+        self.assertTrue(self.service.bookings.is_free('r1', self.start, self.start))
+        with self.assertRaises(ValidationError):
+            self.service.redo()
+
+    def test_steps_hold_only_the_records_they_changed(self):
+        for i in range(50):
+            self.service.create_resource(f'pc{i}', '', True, 'u2')
+        self.service.edit_user('u1', 'one')
+        step = self.service.log.undo_steps[-1]
+        self.assertEqual({model: sorted(changed) for model, changed in step['changes'].items()},
+            {self.service.users: ['one', 'u1'], self.service.resources: ['r1'], self.service.bookings: ['b1']})
+        self.service.undo()
+        self.service.create_user('u3', '', 'p3')
+        with self.assertRaises(ValidationError):
+            self.service.redo()
+
+    def test_undo_keeps_days_booked_written_since(self):
+        self.service.edit_resource('r1', description='Big room')
+        self.service.create_booking('b2', 'u1', 'r1', self.start + datetime.timedelta(days=10), self.start + datetime.timedelta(days=11))
+        self.service.save()
+        days_booked = self.service.resources.resources['r1']['days_booked']
+        self.service.undo()
+        self.service.undo()
+        self.assertEqual(self.service.resources.resources['r1']['description'], 'Room')
+        self.assertEqual(self.service.resources.resources['r1']['days_booked'], days_booked)
+
+    def test_failed_command_is_rolled_back(self):
+        with patch.object(self.service.bookings, 'rename_owner', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.service.edit_user('u1', 'one')
+        self.assertEqual(sorted(self.service.users.users), ['u1', 'u2'])
+        self.assertEqual(self.service.undo(), 'create booking')
+
+    def test_unloaded_history_changes_follow_undo_until_saved(self):
+        self.service.edit_user('u1', 'one')
+        self.assertEqual(len(self.service.bookings.store.pending), 1)
+        self.service.undo()
+        self.assertEqual(self.service.bookings.store.pending, [])
+        self.service.redo()
+        self.service.save()
+        with self.assertRaises(ValidationError):
+            self.service.undo()
+        self.assertEqual(self.open().bookings.bookings['b1']['owner'], 'one')
+
+class TestWaitlist(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.service = self.open()
+        self.start = datetime.date.today() + datetime.timedelta(days=10)
+        self.service.create_user('u1', '', 'p1')
+        self.service.create_user('u2', '', 'p2')
+        self.service.create_resource('r1', 'Room', True, 'u1')
+        self.service.create_resource('r2', 'Desk', True, 'u1')
+        self.service.create_booking('b1', 'u1', 'r1', self.day(0), self.day(5))
+        self.service.create_booking('b2', 'u1', 'r2', self.day(0), self.day(5))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open(self):
+        path = lambda name: os.path.join(self.directory.name, name)
+        return BookingService(Users(path('users.json')), Resources(path('resources.json')),
+            Bookings(path('bookings.json'), waitlist=Waitlist(path('waitlist.json'))))
+
+    def day(self, offset):
+        return self.start + datetime.timedelta(days=offset)
+
+    def test_join_requires_booked_dates(self):
+        with self.assertRaises(ValidationError):
+            self.service.join_waitlist('w1', 'u2', 'r1', self.day(6), self.day(8))
+        with self.assertRaises(AlreadyExistsError):
+            self.service.join_waitlist('b2', 'u2', 'r1', self.day(1), self.day(2))
+        self.service.join_waitlist('w1', 'u2', 'r1', self.day(1), self.day(2))
+        with self.assertRaises(AlreadyExistsError):
+            self.service.create_booking('w1', 'u2', 'r1', self.day(20), self.day(21))
+
+    def test_delete_promotes_oldest_overlapping_request(self):
+        self.service.join_waitlist('w1', 'u2', 'r1', self.day(1), self.day(3))
+        self.service.join_waitlist('w2', 'u1', 'r1', self.day(2), self.day(4))
+        self.service.join_waitlist('w3', 'u2', 'r2', self.day(1), self.day(2))
+        self.assertEqual(self.service.delete_booking('b1'), ['w1'])
+        self.assertEqual(self.service.bookings.bookings['w1']['owner'], 'u2')
+        self.assertFalse(self.service.bookings.is_free('r1', self.day(1), self.day(1)))
+        self.assertEqual(self.service.bookings.waitlist.queue(), ['w2', 'w3'])
+        self.service.leave_waitlist('w2')
+        with self.assertRaises(NotFoundError):
+            self.service.leave_waitlist('w2')
+
+    def test_shortened_booking_promotes(self):
+        self.service.join_waitlist('w1', 'u2', 'r1', self.day(4), self.day(6))
+        self.assertEqual(self.service.edit_booking('b1', end_date=self.day(3)), ['w1'])
+        self.assertEqual(self.service.bookings.waitlist.queue(), [])
+
+    def test_user_changes_cascade_to_requests(self):
+        self.service.join_waitlist('w1', 'u2', 'r1', self.day(1), self.day(3))
+        self.service.join_waitlist('w2', 'u1', 'r2', self.day(1), self.day(3))
+        self.service.edit_user('u2', 'two')
+        self.assertEqual(self.service.bookings.waitlist.requests['w1']['owner'], 'two')
+        self.service.delete_user('two')
+        self.assertEqual(self.service.bookings.waitlist.queue(), ['w2'])
+
+    def test_promotion_is_undone_with_its_command(self):
+        self.service.join_waitlist('w1', 'u2', 'r1', self.day(1), self.day(3))
+        self.service.delete_booking('b1')
+        self.assertEqual(self.service.undo(), 'delete booking')
+        self.assertEqual(sorted(self.service.bookings.bookings), ['b1', 'b2'])
+        self.assertEqual(self.service.bookings.waitlist.queue('r1'), ['w1'])
+        self.assertFalse(self.service.bookings.is_free('r1', self.day(1), self.day(1)))
+
+    def test_requests_persist(self):
+        self.service.join_waitlist('w1', 'u2', 'r1', self.day(1), self.day(3))
+        self.service.save()
+        service = self.open()
+        self.assertEqual(service.bookings.waitlist.queue('r1'), ['w1'])
+        self.assertEqual(service.delete_booking('b1'), ['w1'])
+
+class TestRecurringBookings(unittest.TestCase):
+    def setUp(self):
+        self.files = ['recurring_users.json', 'recurring_resources.json', 'recurring_bookings.json']
+        for f in self.files:
+            if os.path.exists(f):
+                os.remove(f)
+        self.service = BookingService(Users(self.files[0]), Resources(self.files[1]), Bookings(self.files[2]))
+        self.service.create_user('u1', '', 'p1')
+        self.service.create_resource('r1', 'Room', True, 'u1')
+        #A Monday far enough ahead that no date is in the past
+        self.start = datetime.date(2099, 1, 5)
+
+    def tearDown(self):
+        for f in self.files:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def day(self, offset):
+        return (self.start + datetime.timedelta(days=offset)).toordinal()
+
+    def test_occurrences_only_within_window(self):
+        weekly = {'start_date': '2099-01-05', 'end_date': '2099-01-06', 'repeat': {'every': 'weekly', 'interval': 1, 'count': 520}}
+        self.assertEqual(list(occurrences(weekly, self.day(14), self.day(22))), [(self.day(14), self.day(15)), (self.day(21), self.day(22))])
+        self.assertEqual(len(list(occurrences(weekly))), 520)
+        monthly = {'start_date': '2099-01-31', 'end_date': '2099-01-31', 'repeat': {'every': 'monthly', 'until': '2099-04-30'}}
+        self.assertEqual([datetime.date.fromordinal(start).isoformat() for start, end in occurrences(monthly, to_ordinal('2099-02-01'))],
+            ['2099-02-28', '2099-03-31', '2099-04-30'])
+
+    def test_rules_conflict_without_expanding(self):
+        self.service.create_booking('weekly', 'u1', 'r1', self.start, self.start + datetime.timedelta(days=1), {'every': 'weekly', 'until': '2100-12-31'})
+        self.assertEqual(len(self.service.bookings.bookings), 1)
+        self.service.create_booking('once', 'u1', 'r1', '2101-01-03', '2101-01-04')
+        self.service.save()
+        self.assertEqual(self.service.resources.resources['r1']['days_booked'], [['2101-01-03', '2101-01-04']])
+        self.assertEqual(self.service.bookings.conflicts('r1', '2100-06-01', '2100-06-30'), ['weekly'])
+        self.assertTrue(self.service.bookings.is_free('r1', self.start + datetime.timedelta(days=2), self.start + datetime.timedelta(days=6)))
+        with self.assertRaises(ConflictError):
+            self.service.create_booking('clash', 'u1', 'r1', '2100-03-01', '2100-03-10')
+        with self.assertRaises(ConflictError):
+            self.service.create_booking('daily', 'u1', 'r1', self.start + datetime.timedelta(days=2), self.start + datetime.timedelta(days=3), {'every': 'daily', 'interval': 2, 'count': 3})
+        with self.assertRaises(ValidationError):
+            self.service.create_booking('long', 'u1', 'r1', self.start + datetime.timedelta(days=2), self.start + datetime.timedelta(days=3), {'every': 'daily', 'count': 2})
+        self.service.create_booking('fortnight', 'u1', 'r1', self.start + datetime.timedelta(days=2), self.start + datetime.timedelta(days=3), {'every': 'weekly', 'interval': 2, 'count': 3})
+        windows = self.service.find_free_windows(self.start, self.start + datetime.timedelta(days=13), 2, count=10)
+        self.assertEqual(windows, [('r1', '2099-01-09', '2099-01-10'), ('r1', '2099-01-14', '2099-01-15')])
+
+class TestBookingServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.users_file = 'server_users.json'
+        self.resources_file = 'server_resources.json'
+        self.bookings_file = 'server_bookings.json'
+        for f in [self.users_file, self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+        self.service = BookingService(Users(self.users_file), Resources(self.resources_file), Bookings(self.bookings_file))
+        self.service.create_user('u1', '', 'p1')
+        self.service.create_resource('r1', '', True, None)
+        self.saves = 0
+        self.save_error = None
+        def save():
+            self.saves += 1
+            if self.save_error is not None:
+                raise self.save_error
+            self.service.bookings.save_bookings()
+        self.server = await asyncio.start_server(BookingServer(self.service, save, commit_delay=0.01).handle_client, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.start = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+        self.end = (datetime.date.today() + datetime.timedelta(days=3)).isoformat()
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for f in [self.users_file, self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def booking(self, name):
+        return {'booking_name': name, 'user_name': 'u1', 'password': 'p1', 'resource_name': 'r1', 'start_date': self.start, 'end_date': self.end}
+
+    async def test_concurrent_clients_cannot_double_book(self):
+        results = await asyncio.gather(*[send_request('127.0.0.1', self.port, 'POST', '/bookings', self.booking(f'b{i}')) for i in range(5)])
+        statuses = sorted(status for status, payload in results)
+        self.assertEqual(statuses, [201, 409, 409, 409, 409])
+        with open(self.bookings_file) as f:
+            self.assertEqual(len(json.load(f)), 1)
+        status, payload = await send_request('127.0.0.1', self.port, 'GET', f'/resources/r1/availability?start={self.start}')
+        self.assertEqual((status, payload['free']), (200, False))
+
+    async def test_errors_and_listing(self):
+        status, payload = await send_request('127.0.0.1', self.port, 'POST', '/bookings', dict(self.booking('b1'), password='wrong'))
+        self.assertEqual(status, 403)
+        status, payload = await send_request('127.0.0.1', self.port, 'DELETE', '/bookings/missing', {'password': 'p1'})
+        self.assertEqual(status, 404)
+        status, payload = await send_request('127.0.0.1', self.port, 'GET', '/users')
+        self.assertEqual(payload, {'u1': {'full_name': ''}})
+
+    async def test_bad_bodies_and_unexpected_errors(self):
+        status, payload = await send_request('127.0.0.1', self.port, 'POST', '/users', ['u2'])
+        self.assertEqual(status, 400)
+        with patch.object(self.service, 'create_user', side_effect=RuntimeError('boom')):
+            status, payload = await send_request('127.0.0.1', self.port, 'POST', '/users', {'user_name': 'u2', 'password': 'p2'})
+        self.assertEqual((status, payload), (500, {'error': 'Internal server error.'}))
+
+    async def test_failed_commit_discards_the_change(self):
+        self.service.save()
+        self.save_error = OSError('disk full')
+        status, payload = await send_request('127.0.0.1', self.port, 'POST', '/bookings', self.booking('b1'))
+        self.assertEqual(status, 500)
+        self.assertNotIn('b1', self.service.bookings.bookings)
+        self.save_error = None
+        status, payload = await send_request('127.0.0.1', self.port, 'POST', '/bookings', self.booking('b2'))
+        self.assertEqual(status, 201)
+        with open(self.bookings_file) as f:
+            self.assertEqual(list(json.load(f)), ['b2'])
+
+    async def test_plaintext_password_is_hashed_on_a_worker_thread(self):
+        self.service.users.add_user('legacy', {'full_name': '', 'password': 'old'})
+        threads = []
+        def hash_on_thread(password):
+            threads.append(threading.current_thread())
+            return hash_password(password)
+        with patch('server.hash_password', hash_on_thread), patch('models.hash_password', side_effect=AssertionError):
+            status, payload = await send_request('127.0.0.1', self.port, 'POST', '/bookings', dict(self.booking('b1'), user_name='legacy', password='old'))
+        self.assertEqual(status, 201)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertTrue(is_password_hash(self.service.users.users['legacy']['password']))
+
+    async def test_password_hashing_does_not_block_other_clients(self):
+        self.service.users.verified.discard('u1')
+        entered, release, finished = threading.Event(), threading.Event(), threading.Event()
+        def held_verify(password, stored):
+            entered.set()
+            release.wait(5)
+            finished.set()
+            return password == 'p1'
+        with patch('server.verify_password', held_verify):
+            booking = asyncio.create_task(send_request('127.0.0.1', self.port, 'POST', '/bookings', self.booking('b1')))
+            await asyncio.get_running_loop().run_in_executor(None, entered.wait, 5)
+            status, payload = await send_request('127.0.0.1', self.port, 'GET', '/bookings')
+            #The other client was answered while the hash was still held up
+            self.assertFalse(finished.is_set())
+            self.assertEqual((status, payload), (200, {}))
+            release.set()
+            self.assertEqual((await booking)[0], 201)
+
+class TestBulkImport(unittest.TestCase):
+    def setUp(self):
+        self.files = ['import_users.json', 'import_resources.json', 'import_bookings.json', 'import_requests.jsonl', 'import_requests.jsonl.rejected.jsonl']
+        for f in self.files:
+            if os.path.exists(f):
+                os.remove(f)
+        self.service = BookingService(Users(self.files[0]), Resources(self.files[1]), Bookings(self.files[2]))
+        self.service.create_user('u1', '', 'p1')
+        self.service.create_resource('r1', '', True, None)
+        day = self.day
+        lines = [
+            json.dumps({'booking_name': 'b1', 'owner': 'u1', 'resource': 'r1', 'start_date': day(1), 'end_date': day(3)}),
+            json.dumps({'booking_name': 'b2', 'owner': 'u1', 'resource': 'r1', 'start_date': day(2), 'end_date': day(4)}),
+            '{"booking_name": "broken"',
+            '',
+            json.dumps({'booking_name': 'b3', 'owner': 'nobody', 'resource': 'r1', 'start_date': day(5), 'end_date': day(6)}),
+            json.dumps({'booking_name': 'b4', 'owner': 'u1', 'resource': 'r1', 'start_date': day(5), 'end_date': day(6)}),
+        ]
+        with open(self.files[3], 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def tearDown(self):
+        for f in self.files:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def day(self, offset):
+        return (datetime.date.today() + datetime.timedelta(days=offset)).isoformat()
+
+    def test_import_accepts_valid_and_records_rejects(self):
+        result = import_bookings(self.service, self.files[3], batch_size=2)
+        self.assertEqual(result, {'accepted': 2, 'rejected': 3})
+        with open(self.files[2]) as f:
+            self.assertEqual(sorted(json.load(f)), ['b1', 'b4'])
+        with open(self.files[4]) as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([reject['line'] for reject in rejects], [2, 3, 5])
+        self.assertIn('already booked', rejects[0]['reason'])
+        self.assertEqual(self.service.log.undo_steps, [])
+        with open(self.files[1]) as f:
+            self.assertEqual(json.load(f)['r1']['days_booked'], [[self.day(1), self.day(3)], [self.day(5), self.day(6)]])
+
+    def test_failed_import_reloads_checkpoint(self):
+        self.service.create_booking('b0', 'u1', 'r1', self.day(10), self.day(11))
+        self.service.bookings.save_bookings()
+        with patch.object(self.service.bookings.store, 'save', side_effect=[False, OSError]):
+            with self.assertRaises(OSError):
+                import_bookings(self.service, self.files[3])
+        self.assertEqual(sorted(self.service.bookings.bookings), ['b0'])
+        self.assertTrue(self.service.bookings.is_free('r1', self.day(1), self.day(6)))
+
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'data.db')
+        service = self.open()
+        start = datetime.date.today() + datetime.timedelta(days=1)
+        for user_name in ['u1', 'u2', 'u3']:
+            service.create_user(user_name, '', 'p')
+        service.create_resource('r1', '', True, 'u1')
+        service.create_resource('r2', '', True, 'u2')
+        service.create_booking('b1', 'u1', 'r1', start, start + datetime.timedelta(days=1))
+        service.create_booking('b2', 'u2', 'r2', start, start + datetime.timedelta(days=1))
+        service.create_booking('b3', 'u3', 'r2', start + datetime.timedelta(days=5), start + datetime.timedelta(days=6))
+        service.save()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open(self):
+        service = BookingService(Users(store=SqliteStore(self.database, 'users')), Resources(store=SqliteStore(self.database, 'resources')),
+            Bookings(store=LazyBookingStore(self.database)))
+        return service
+
+    def run_cli(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            status = cli.main(['--database', self.database] + list(argv))
+        return status, output.getvalue()
+
+    def test_delete_users_and_reassign(self):
+        status, output = self.run_cli('delete-users', 'u1', 'nobody', '--new-owner', 'u2')
+        self.assertEqual(status, 1)
+        self.assertIn('nobody: User does not exist.', output)
+        service = self.open()
+        self.assertEqual(sorted(service.users.users), ['u2', 'u3'])
+        self.assertEqual(service.resources.resources['r1']['owner'], 'u2')
+        self.assertEqual(sorted(service.bookings.bookings), ['b2', 'b3'])
+
+    def test_bulk_renames_save_once(self):
+        mapping = os.path.join(self.directory.name, 'renames.csv')
+        with open(mapping, 'w') as f:
+            f.write('u1,one\nu2,two\n')
+        with patch.object(BookingService, 'save', autospec=True, side_effect=BookingService.save) as save:
+            status, output = self.run_cli('rename-users', mapping)
+        self.assertEqual((status, save.call_count), (0, 1))
+        self.assertIn('2 users renamed', output)
+        service = self.open()
+        self.assertEqual(service.resources.resources['r2']['owner'], 'two')
+        self.assertEqual(service.bookings.bookings['b1']['owner'], 'one')
+
+    def test_purge_and_dry_run(self):
+        status, output = self.run_cli('--dry-run', 'purge-bookings', '--resource', 'r2')
+        self.assertIn('2 bookings purged', output)
+        self.assertEqual(len(self.open().bookings.bookings), 3)
+        self.run_cli('purge-bookings', '--resource', 'r2', '--user', 'u3')
+        self.assertEqual(sorted(self.open().bookings.bookings), ['b1', 'b2'])
+
+    def test_migrate_passwords(self):
+        service = self.open()
+        service.users.add_user('legacy', {'full_name': '', 'password': 'old'})
+        service.save()
+        status, output = self.run_cli('migrate-passwords')
+        self.assertEqual(status, 0)
+        self.assertIn('1 passwords hashed', output)
+        service = self.open()
+        self.assertTrue(is_password_hash(service.users.users['legacy']['password']))
+        service.authenticate('legacy', 'old')
+
+    def test_dry_run_leaves_json_files_unchanged(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory.name)
+        service = open_service()
+        service.create_user('u1', '', 'p')
+        service.create_resource('r1', '', True, 'u1')
+        service.create_booking('b1', 'u1', 'r1', '2099-01-01', '2099-01-02')
+        service.save()
+        os.remove('waitlist.json')
+        files = {}
+        for name in ['users.json', 'resources.json', 'bookings.json']:
+            with open(name, 'rb') as f:
+                files[name] = f.read()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(cli.main(['--dry-run', 'purge-bookings', '--resource', 'r1']), 0)
+            cli.main(['report', '--output', 'report.json'])
+        for name, data in files.items():
+            with open(name, 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertFalse(os.path.exists('waitlist.json'))
+
+    def test_serve_uses_journal(self):
+        with patch('cli.serve', MagicMock()) as serve, patch('cli.asyncio.run'):
+            cli.main(['--journal', 'serve', '0'])
+        serve.assert_called_once_with(port=0, database=None, journal=True)
+
+    def test_import_saves_once(self):
+        requests_file = os.path.join(self.directory.name, 'requests.jsonl')
+        start = datetime.date.today() + datetime.timedelta(days=10)
+        with open(requests_file, 'w') as f:
+            f.write(json.dumps({'booking_name': 'b4', 'owner': 'u1', 'resource': 'r1', 'start_date': str(start), 'end_date': str(start + datetime.timedelta(days=1))}) + '\n')
+            f.write(json.dumps({'booking_name': 'b5', 'owner': 'nobody', 'resource': 'r1', 'start_date': str(start), 'end_date': str(start)}) + '\n')
+        with patch.object(BookingService, 'save') as save:
+            status, output = self.run_cli('import', requests_file)
+        self.assertEqual((status, output, save.call_count), (0, '1 bookings imported, 1 rejected\n', 0))
+        self.assertEqual(sorted(self.open().bookings.bookings), ['b1', 'b2', 'b3', 'b4'])
+
+    def test_dry_run_archive_is_refused(self):
+        with self.assertRaises(SystemExit):
+            self.run_cli('--dry-run', 'archive')
+        self.assertEqual(len(self.open().bookings.bookings), 3)
+
+    def test_report_is_written_without_saving(self):
+        output_file = os.path.join(self.directory.name, 'report.json')
+        with patch.object(BookingService, 'save') as save:
+            status, output = self.run_cli('report', '--start', str(datetime.date.today()), '--end', str(datetime.date.today() + datetime.timedelta(days=30)), '--output', output_file)
+        self.assertEqual((status, save.call_count), (0, 0))
+        with open(output_file) as f:
+            self.assertEqual(len(json.load(f)['resources']), 2)
+        self.assertEqual(self.run_cli('report', '--start', 'soon')[0], 1)
+
+    def test_check_and_repair(self):
+        store = SqliteStore(self.database, 'users')
+        users = store.load()
+        del users['u2'], users['u3']
+        store.save(users)
+        status, output = self.run_cli('check')
+        self.assertEqual(status, 1)
+        self.assertIn("bookings b2: Owner 'u2' does not exist.", output)
+        self.assertEqual(self.run_cli('check', '--repair')[0], 0)
+        self.assertEqual(self.run_cli('check'), (0, '0 issues found\n'))
+        self.assertEqual(sorted(self.open().bookings.bookings), ['b1'])
+
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        self.resources_file = 'analytics_resources.json'
+        self.bookings_file = 'analytics_bookings.json'
+        with open(self.resources_file, 'w') as f:
+            json.dump({name: {'description': '', 'available': True, 'owner': 'u1'} for name in ['r1', 'r2', 'r3']}, f)
+        with open(self.bookings_file, 'w') as f:
+            json.dump({
+                'b1': {'owner': 'u1', 'resource': 'r1', 'start_date': '2030-01-30', 'end_date': '2030-02-02'},
+                'b2': {'owner': 'u2', 'resource': 'r2', 'start_date': '2030-02-01', 'end_date': '2030-02-01'},
+                'b3': {'owner': 'u1', 'resource': 'r2', 'start_date': '2030-02-10', 'end_date': '2030-02-11',
+                    'repeat': {'every': 'weekly', 'interval': 1, 'count': 3}},
+                'b4': {'owner': 'u2', 'resource': 'r1', 'start_date': '2029-12-20', 'end_date': '2029-12-31'}
+            }, f)
+        self.resources = Resources(self.resources_file)
+        self.bookings = Bookings(self.bookings_file)
+
+    def tearDown(self):
+        for f in [self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def check_report(self):
+        report = analytics.utilization_report(self.bookings, self.resources, '2030-01-01', '2030-02-28')
+        self.assertEqual(report['bookings'], 5)
+        self.assertEqual([(row['resource'], row['period'], row['booked_days']) for row in report['resources']],
+            [('r1', '2030-01', 2), ('r1', '2030-02', 2), ('r2', '2030-02', 7)])
+        self.assertEqual(report['resources'][0]['utilization'], round(2 / 31, 4))
+        self.assertEqual([(row['user'], row['period'], row['booked_days']) for row in report['users']],
+            [('u1', '2030-01', 2), ('u1', '2030-02', 8), ('u2', '2030-02', 1)])
+        self.assertEqual(report['peaks'][1], {'period': '2030-02', 'peak_bookings': 2, 'peak_day': '2030-02-01'})
+        self.assertEqual(report['idle'], ['r3'])
+        return report
+
+    def test_report_without_numpy(self):
+        with patch('analytics.numpy', None):
+            self.check_report()
+
+    @unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+    def test_report_with_numpy(self):
+        self.check_report()
+
+    def test_weekly_periods_and_csv_output(self):
+        report = analytics.utilization_report(self.bookings, self.resources, '2030-02-01', '2030-02-14', 'week')
+        self.assertEqual([row['period'] for row in report['peaks']], ['2030-01-28', '2030-02-04', '2030-02-11'])
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, 'report.csv')
+            analytics.write_report(report, filepath)
+            with open(filepath) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'kind,name,period,value,utilization')
+        self.assertIn('resource,r1,2030-01-28,2,0.6667', lines)
+        self.assertIn('idle,r3,,,', lines)
+        with self.assertRaises(ValidationError):
+            analytics.utilization_report(self.bookings, self.resources, '2030-02-01', '2030-01-01')
+
+class TestIntegrity(unittest.TestCase):
+    def setUp(self):
+        self.users = {'u1': {'full_name': '', 'password': 'p'}, 'u2': {'full_name': '', 'password': 'p'}}
+        self.resources = {
+            'r1': {'description': '', 'available': True, 'owner': 'u1', 'days_booked': [['2030-01-01', '2030-01-03']]},
+            'r2': {'description': '', 'available': True, 'owner': 'gone'}
+        }
+        self.bookings = {
+            'ok': {'owner': 'u1', 'resource': 'r1', 'start_date': '2030-01-01', 'end_date': '2030-01-03'},
+            'clash': {'owner': 'u2', 'resource': 'r1', 'start_date': '2030-01-03', 'end_date': '2030-01-04'},
+            'weekly': {'owner': 'u2', 'resource': 'r1', 'start_date': '2030-01-02', 'end_date': '2030-01-03',
+                'repeat': {'every': 'weekly', 'interval': 1, 'count': 2}},
+            'stale': {'owner': 'old_name', 'resource': 'r1', 'start_date': '2030-02-01', 'end_date': '2030-02-02'},
+            'nowhere': {'owner': 'u1', 'resource': 'r9', 'start_date': '2030-02-01', 'end_date': '2030-02-02'},
+            'backwards': {'owner': 'u1', 'resource': 'r2', 'start_date': '2030-03-05', 'end_date': '2030-03-01'},
+            'garbled': {'owner': 'u1', 'resource': 'r2', 'start_date': '05/03/2030', 'end_date': '2030-03-06'}
+        }
+
+    def problems(self, issues):
+        return sorted((found['store'], found['key'], found['problem']) for found in issues)
+
+    def test_finds_every_kind_of_issue(self):
+        issues = integrity.check(self.users, self.resources, self.bookings, workers=1)
+        self.assertEqual(self.problems(issues), [
+            ('bookings', 'backwards', 'reversed_dates'), ('bookings', 'clash', 'overlap'), ('bookings', 'garbled', 'bad_date'),
+            ('bookings', 'nowhere', 'unknown_resource'), ('bookings', 'stale', 'unknown_owner'), ('bookings', 'weekly', 'overlap'),
+            ('resources', 'r2', 'days_booked'), ('resources', 'r2', 'unknown_owner')])
+
+    def test_process_pool_matches_single_process(self):
+        expected = integrity.check(self.users, self.resources, self.bookings, workers=1)
+        with patch('integrity.CHUNK_SIZE', 2):
+            issues = integrity.check(self.users, self.resources, self.bookings, workers=2)
+        self.assertEqual(self.problems(issues), self.problems(expected))
+
+    def test_repair_leaves_nothing_to_report(self):
+        issues = integrity.check(self.users, self.resources, self.bookings, workers=1)
+        integrity.repair(issues, self.resources, self.bookings)
+        self.assertEqual(sorted(self.bookings), ['backwards', 'ok'])
+        self.assertEqual(self.bookings['backwards']['start_date'], '2030-03-01')
+        self.assertIsNone(self.resources['r2']['owner'])
+        self.assertEqual(self.resources['r2']['days_booked'], [['2030-03-01', '2030-03-05']])
+        self.assertEqual(integrity.check(self.users, self.resources, self.bookings, workers=1), [])
+
+    def test_recurring_bookings_are_kept_or_dropped_whole(self):
+        resources = {'r1': {'description': '', 'available': True, 'owner': 'u1', 'days_booked': []}}
+        bookings = {
+            'rule': {'owner': 'u1', 'resource': 'r1', 'start_date': '2030-01-02', 'end_date': '2030-01-04',
+                'repeat': {'every': 'weekly', 'interval': 1, 'count': 2}},
+            'z': {'owner': 'u2', 'resource': 'r1', 'start_date': '2030-01-03', 'end_date': '2030-01-03'},
+            'w': {'owner': 'u2', 'resource': 'r1', 'start_date': '2030-01-08', 'end_date': '2030-01-09'}
+        }
+        issues = integrity.check(self.users, resources, bookings, workers=1)
+        self.assertEqual(sorted((found['key'], found['other']) for found in issues), [('w', 'rule'), ('z', 'rule')])
+        integrity.repair(issues, resources, bookings)
+        self.assertEqual(list(bookings), ['rule'])
+        self.assertEqual(integrity.check(self.users, resources, bookings, workers=1), [])
+
+class TestBenchmark(unittest.TestCase):
+    def test_small_scale_run_and_regression_check(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = {'200': benchmark.run_scale(200, directory)}
+        self.assertIn('conflict_check_1000', results['200'])
+        baseline = {'200': {operation: seconds * 10 + 1 for operation, seconds in results['200'].items()}}
+        self.assertEqual(benchmark.compare(results, baseline, 0.25), [])
+        baseline['200']['load'] = results['200']['load'] / 100
+        self.assertEqual(len(benchmark.compare(results, baseline, 0.25)), 1)
+
+    def test_codec_comparison(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = benchmark.run_codecs(200, directory)
+        self.assertLess(results['json_bytes'], results['json_indented_bytes'])
+        self.assertIn('json_load', results)
+        baseline = {'200': {operation: value * 10 + 1 for operation, value in results.items()}}
+        baseline['200']['json_bytes'] = results['json_bytes'] // 2
+        regressions = benchmark.compare({'200': results}, baseline, 0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn(f"json_bytes at 200 bookings: {results['json_bytes']} bytes", regressions[0])
+
+class TestCodecs(unittest.TestCase):
+    def test_codecs_round_trip_and_read_older_files(self):
+        records = {'b1': {'owner': 'ü', 'resource': 'r1', 'start_date': '2099-01-01', 'end_date': '2099-01-02'}}
+        with tempfile.TemporaryDirectory() as directory:
+            for codec in available_codecs():
+                store = JsonStore(os.path.join(directory, codec.name), codec)
+                store.save(records)
+                self.assertEqual(JsonStore(store.filepath, codec).load(), records)
+            #Files written in the older indented format still load with the default codec
+            self.assertEqual(JsonStore(os.path.join(directory, 'json_indented')).load(), records)
+        self.assertIn(JsonCodec().name, [codec.name for codec in available_codecs()])
+
+class TestPasswordHashing(unittest.TestCase):
+    def setUp(self):
+        self.users_file = 'hash_users.json'
+        with open(self.users_file, 'w') as f:
+            json.dump({'legacy': {'full_name': '', 'password': 'secret'}, 'other': {'full_name': '', 'password': 'o'}}, f)
+        self.users = Users(self.users_file)
+
+    def tearDown(self):
+        if os.path.exists(self.users_file):
+            os.remove(self.users_file)
+
+    def test_plaintext_upgraded_on_first_check(self):
+        self.assertEqual(self.users.plaintext_users, {'legacy', 'other'})
+        self.assertFalse(self.users.check_password('legacy', 'wrong'))
+        self.assertTrue(self.users.check_password('legacy', 'secret'))
+        self.assertTrue(is_password_hash(self.users.users['legacy']['password']))
+        self.assertEqual(self.users.migrate_passwords(), 1)
+        self.users.save_users()
+        with open(self.users_file) as f:
+            self.assertNotIn('"o"', f.read())
+        self.assertTrue(Users(self.users_file).check_password('other', 'o'))
+
+    def test_cache_skips_slow_hash_until_expiry(self):
+        self.users.set_password('legacy', 'new')
+        self.assertTrue(self.users.check_password('legacy', 'new'))
+        with patch('models.verify_password', return_value=False) as verify:
+            self.assertTrue(self.users.check_password('legacy', 'new'))
+            self.assertFalse(self.users.check_password('legacy', 'wrong'))
+            self.assertEqual(verify.call_count, 1)
+        self.users.verified.ttl = -1
+        self.users.verified.add('legacy', self.users.users['legacy']['password'], 'new')
+        with patch('models.verify_password', return_value=True) as verify:
+            self.assertTrue(self.users.check_password('legacy', 'new'))
+            self.assertEqual(verify.call_count, 1)
+
+    def test_cache_is_bounded(self):
+        self.users.verified.max_size = 2
+        for name in ['a', 'b', 'c']:
+            self.users.verified.add(name, 'hash', 'pw')
+        self.assertEqual(list(self.users.verified.entries), ['b', 'c'])
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.bookings = Bookings(os.path.join(self.directory.name, 'bookings.json'))
+        METRICS.operations = {}
+
+    def tearDown(self):
+        METRICS.enabled = False
+        METRICS.operations = {}
+        self.directory.cleanup()
+
+    def test_disabled_records_nothing(self):
+        self.bookings.is_free('r1', '2099-01-01', '2099-01-02')
+        self.bookings.save_bookings()
+        self.assertEqual(METRICS.operations, {})
+
+    def test_counts_latency_and_bytes(self):
+        METRICS.enabled = True
+        self.bookings.add_booking('b1', {'owner': 'u1', 'resource': 'r1', 'start_date': '2099-01-01', 'end_date': '2099-01-02'})
+        for _ in range(3):
+            self.bookings.is_free('r1', '2099-01-01', '2099-01-02')
+        self.bookings.save_bookings()
+        with METRICS.timer('custom'):
+            pass
+        self.assertEqual(METRICS.operations['Bookings.is_free']['count'], 3)
+        self.assertEqual(sum(METRICS.operations['Bookings.is_free']['buckets']), 3)
+        self.assertEqual(METRICS.operations['Bookings.save_bookings']['count'], 1)
+        self.assertGreater(METRICS.operations['JsonStore.save']['bytes_written'], 0)
+        self.assertEqual(METRICS.operations['custom']['count'], 1)
+        text = METRICS.to_prometheus()
+        self.assertIn('booking_operation_seconds_count{operation="Bookings.is_free"} 3', text)
+        self.assertIn('booking_operation_seconds_bucket{operation="Bookings.is_free",le="+Inf"} 3', text)
+        self.assertIn('booking_bytes_written_total{operation="JsonStore.save"}', text)
+        export_path = os.path.join(self.directory.name, 'metrics.json')
+        METRICS.export(export_path)
+        with open(export_path) as f:
+            self.assertEqual(json.load(f)['operations']['Bookings.is_free']['count'], 3)
+
+class TestChangeNotifications(unittest.TestCase):
+    def setUp(self):
+        self.resources_file = 'notify_resources.json'
+        self.bookings_file = 'notify_bookings.json'
+        self.resources = Resources(self.resources_file)
+        self.bookings = Bookings(self.bookings_file)
+        self.events = []
+        self.resources.subscribe(lambda added, removed, reset: self.events.append(('resources', list(added), list(removed), reset)))
+        self.bookings.subscribe(lambda added, removed, reset: self.events.append(('bookings', list(added), list(removed), reset)))
+
+    def tearDown(self):
+        for f in [self.resources_file, self.bookings_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_mutations_send_diffs(self):
+        self.resources.add_resource('r1', {'description': '', 'available': True, 'owner': None})
+        self.resources.rename_resource('r1', 'lab')
+        self.bookings.add_booking('b1', {'owner': 'u1', 'resource': 'lab', 'start_date': '2025-01-01', 'end_date': '2025-01-02'})
+        self.bookings.add_booking('b1', {'owner': 'u1', 'resource': 'lab', 'start_date': '2025-01-03', 'end_date': '2025-01-04'})
+        self.bookings.remove_booking('b1')
+        self.assertEqual(self.events, [
+            ('resources', ['r1'], [], False),
+            ('resources', [], ['r1'], False),
+            ('resources', ['lab'], [], False),
+            ('bookings', ['b1'], [], False),
+            ('bookings', [], ['b1'], False),
+        ])
+
+    def test_load_sends_reset(self):
+        self.bookings.load_bookings()
+        self.assertEqual(self.events, [('bookings', [], [], True)])
+
 if __name__ == '__main__':
     unittest.main()